@@ -1,11 +1,71 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, Response
 import os
-import threading
-import traceback
 import sys
-import utilities.load_historical_options_data as loader
+import threading
+from utilities import resources
+from utilities.jobs import JobManager, DEFAULT_JOB_STATE_PATH
+from utilities.metrics import METRICS
+from utilities.query_cache import QueryCache, DEFAULT_QUERY_CACHE_ENTRIES, DEFAULT_QUERY_CACHE_TTL
 
 app = Flask(__name__)
+config = resources.get_config()
+jobs = JobManager(config.get("job_state_path", DEFAULT_JOB_STATE_PATH))
+query_cache = QueryCache(config.get("query_cache_entries", DEFAULT_QUERY_CACHE_ENTRIES),
+                         config.get("query_cache_ttl", DEFAULT_QUERY_CACHE_TTL))
+SNAPSHOT_COLUMNS = ['contractID', 'symbol', 'date', 'expiration', 'type', 'strike', 'last', 'mark', 'bid', 'ask',
+                    'volume', 'open_interest', 'implied_volatility', 'delta', 'gamma', 'theta', 'vega', 'rho']
+
+# The loader, the analytics and the warehouse client are imported on first use,
+# so a cold instance answers / without loading pandas or the Google client libraries
+_lazy_lock = threading.Lock()
+_loader = None
+_storage = None
+
+def invalidate_loaded(symbol, dates):
+    dropped = query_cache.invalidate(symbol=symbol, dates=dates)
+    if dropped:
+        print(f"Dropped {dropped} cached responses for {symbol} after loading {len(dates)} dates.",
+              file=sys.stdout, flush=True)
+
+def get_loader():
+    global _loader
+    with _lazy_lock:
+        if _loader is None:
+            import utilities.load_historical_options_data as loader
+            # Loads only run in this process through /run, so listening from here on misses none
+            loader.add_load_listener(invalidate_loaded)
+            _loader = loader
+        return _loader
+
+def get_app_storage():
+    global _storage
+    with _lazy_lock:
+        if _storage is None:
+            from utilities.storage import get_storage
+            _storage = get_storage(config)
+        return _storage
+
+def screen_metrics():
+    import pyarrow as pa
+    from utilities.daily_aggregates import DAILY_METRICS_SCHEMA
+    return {field.name for field in DAILY_METRICS_SCHEMA
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)}
+
+def cached_json(key, compute, tags):
+    """Serve compute() through the query cache, answering 304 when the client's ETag still matches."""
+    try:
+        entry = query_cache.get_or_compute(key, compute, tags)
+    except Exception as e:
+        print(f"Query {key} failed: {e}", file=sys.stdout, flush=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    response = Response(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    # Clients revalidate every time; unchanged data costs a 304 from memory
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def bad_request(message):
+    return jsonify({"status": "error", "message": message}), 400
 
 @app.route("/", methods=["GET"])
 def index():
@@ -14,22 +74,104 @@ def index():
 
 @app.route("/run", methods=["POST", "GET"])
 def run_loader():
-    print("/run endpoint called. Spawning background thread...", file=sys.stdout, flush=True)
-    def run_in_background():
-        print("[Background] Entered run_in_background.", file=sys.stdout, flush=True)
-        try:
-            print("[Background] About to call loader.main()...", file=sys.stdout, flush=True)
-            loader.main()
-            print("[Background] loader.main() finished.", file=sys.stdout, flush=True)
-        except Exception as e:
-            print(f"[Background] Exception: {e}", file=sys.stdout, flush=True)
-            traceback.print_exc()
-        print("[Background] Exiting run_in_background.", file=sys.stdout, flush=True)
-    thread = threading.Thread(target=run_in_background)
-    thread.start()
-    return jsonify({"status": "started"}), 202
+    print("/run endpoint called.", file=sys.stdout, flush=True)
+    loader = get_loader()
+    job, created = jobs.start("backfill", lambda job: loader.main(job=job))
+    if not created:
+        print(f"Job {job.id} is already running, not starting another one.", file=sys.stdout, flush=True)
+        return jsonify({"status": "already_running", "job": job.to_dict()}), 409
+    return jsonify({"status": "started", "job": job.to_dict()}), 202
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify({"jobs": [job.to_dict() for job in jobs.list()]})
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    job.cancel()
+    print(f"Cancellation requested for job {job_id}.", file=sys.stdout, flush=True)
+    return jsonify(job.to_dict()), 202
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/summary", methods=["GET"])
+def metrics_summary():
+    return jsonify(METRICS.summary(include_dates=False))
+
+@app.route("/symbols/<symbol>/metrics", methods=["GET"])
+def symbol_metrics(symbol):
+    """Daily metric history for one symbol, optionally limited to start/end and a list of columns."""
+    from utilities.daily_aggregates import DAILY_METRICS_SCHEMA, read_daily_metrics
+    symbol = symbol.upper()
+    start = request.args.get("start")
+    end = request.args.get("end")
+    columns = request.args.get("columns")
+    if columns:
+        columns = ["symbol", "date"] + [name for name in columns.split(",") if name not in ("symbol", "date")]
+        unknown = [name for name in columns if name not in DAILY_METRICS_SCHEMA.names]
+        if unknown:
+            return bad_request(f"Unknown columns: {', '.join(unknown)}")
+    def compute():
+        table = read_daily_metrics(get_app_storage(), symbol=symbol, start=start, end=end, columns=columns)
+        return {"symbol": symbol, "rows": table.sort_by("date").to_pylist()}
+    return cached_json(("metrics", symbol, start, end, tuple(columns or ())), compute, [f"symbol:{symbol}"])
+
+@app.route("/screener", methods=["GET"])
+def screener():
+    """Symbols ranked by one metric on a date, e.g. /screener?date=2025-06-02&metric=skew_25d&top=10."""
+    date = request.args.get("date")
+    metric = request.args.get("metric", "excess_volume_z")
+    ascending = request.args.get("order", "desc") == "asc"
+    if not date:
+        return bad_request("date is required")
+    if metric not in screen_metrics():
+        return bad_request(f"Unknown metric: {metric}")
+    try:
+        top = int(request.args.get("top", 25))
+    except ValueError:
+        return bad_request("top must be an integer")
+    def compute():
+        from utilities.daily_aggregates import screen
+        table = screen(get_app_storage(), date, metric=metric, top=top, ascending=ascending)
+        return {"date": date, "metric": metric, "rows": table.to_pylist()}
+    return cached_json(("screener", date, metric, top, ascending), compute, [f"date:{date}"])
+
+@app.route("/symbols/<symbol>/chain", methods=["GET"])
+def chain_snapshot(symbol):
+    """The option chain for one symbol on a date (latest loaded date by default), optionally one expiration or type."""
+    symbol = symbol.upper()
+    date = request.args.get("date")
+    expiration = request.args.get("expiration")
+    option_type = request.args.get("type")
+    def compute():
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        storage = get_app_storage()
+        table_id = storage.options_table_id(symbol)
+        day = date or max(storage.existing_dates(symbol, table_id), default=None)
+        if day is None:
+            return {"symbol": symbol, "date": None, "rows": []}
+        table = storage.read_table(table_id, symbol=symbol, start=day, end=day, columns=SNAPSHOT_COLUMNS)
+        if expiration:
+            table = table.filter(pc.equal(table['expiration'].cast(pa.string()), expiration))
+        if option_type:
+            table = table.filter(pc.equal(table['type'], option_type))
+        table = table.sort_by([("expiration", "ascending"), ("strike", "ascending"), ("type", "ascending")])
+        return {"symbol": symbol, "date": day, "rows": table.to_pylist()}
+    return cached_json(("chain", symbol, date, expiration, option_type), compute, [f"symbol:{symbol}"])
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port)
-#
\ No newline at end of file
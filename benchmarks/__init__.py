@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for voldisloc. Run from the project root, e.g.
+python -m benchmarks.bench_columnar_parse
+"""
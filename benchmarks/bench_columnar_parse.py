@@ -0,0 +1,118 @@
+"""
+Compare the legacy per-row dict + pandas + JSON load path with the columnar
+pyarrow + Parquet path.
+
+Reports CPU seconds per million contracts and the number of load jobs each path
+would submit for one month of one symbol. No network or BigQuery access needed.
+
+    python -m benchmarks.bench_columnar_parse --contracts-per-day 5000 --days 21
+"""
+import argparse
+import json
+import math
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic_chains import synthetic_rows
+from utilities.columnar import concat_batches, parse_options_rows, split_by_bytes, to_parquet_buffer
+from utilities.bigquery_storage import DEFAULT_MAX_LOAD_BYTES
+
+LEGACY_CHUNK_SIZE = 1000
+
+
+def _legacy_row(row, symbol, date):
+    return {
+        'contractID': row.get('contractID'),
+        'symbol': row.get('symbol', symbol),
+        'expiration': row.get('expiration'),
+        'strike': float(row.get('strike')) if row.get('strike') is not None else None,
+        'type': row.get('type'),
+        'last': float(row.get('last')) if row.get('last') is not None else None,
+        'mark': float(row.get('mark')) if row.get('mark') is not None else None,
+        'bid': float(row.get('bid')) if row.get('bid') is not None else None,
+        'bid_size': int(row.get('bid_size')) if row.get('bid_size') is not None else None,
+        'ask': float(row.get('ask')) if row.get('ask') is not None else None,
+        'ask_size': int(row.get('ask_size')) if row.get('ask_size') is not None else None,
+        'volume': int(row.get('volume')) if row.get('volume') is not None else None,
+        'open_interest': int(row.get('open_interest')) if row.get('open_interest') is not None else None,
+        'date': row.get('date', date),
+        'implied_volatility': float(row.get('implied_volatility')) if row.get('implied_volatility') is not None else None,
+        'delta': float(row.get('delta')) if row.get('delta') is not None else None,
+        'gamma': float(row.get('gamma')) if row.get('gamma') is not None else None,
+        'theta': float(row.get('theta')) if row.get('theta') is not None else None,
+        'vega': float(row.get('vega')) if row.get('vega') is not None else None,
+        'rho': float(row.get('rho')) if row.get('rho') is not None else None,
+        'collected_date': date
+    }
+
+
+def run_legacy(days):
+    """Per-row dicts, then the old push_batch_to_bq chunk loop up to the JSON payload."""
+    batch = []
+    for symbol, date, rows in days:
+        for row in rows:
+            batch.append(_legacy_row(row, symbol, date))
+    load_jobs = 0
+    for i in range(0, len(batch), LEGACY_CHUNK_SIZE):
+        df = pd.DataFrame(batch[i:i + LEGACY_CHUNK_SIZE])
+        for col in ['strike', 'last', 'mark', 'bid', 'ask', 'implied_volatility', 'delta', 'gamma', 'theta', 'vega', 'rho']:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        for col in ['bid_size', 'ask_size', 'volume', 'open_interest']:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        for col in ['expiration', 'date', 'collected_date']:
+            df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d')
+        df = df.dropna(subset=['symbol', 'date', 'strike', 'type'])
+        records = df.to_dict('records')
+        # load_table_from_json serializes every record to newline-delimited JSON
+        payload = "\n".join(json.dumps(r, default=int) for r in records)
+        load_jobs += 1
+        del df, records, payload
+    return len(batch), load_jobs
+
+
+def run_columnar(days, max_load_bytes):
+    """Typed arrow arrays per response, then one Parquet payload per byte-sized slice."""
+    tables = [parse_options_rows(rows, symbol, date) for symbol, date, rows in days]
+    batch = concat_batches(tables)
+    load_jobs = 0
+    for piece in split_by_bytes(batch, max_load_bytes):
+        buffer = to_parquet_buffer(piece)
+        load_jobs += 1
+        del buffer
+    return batch.num_rows, load_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contracts-per-day", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=21)
+    parser.add_argument("--max-load-bytes", type=int, default=DEFAULT_MAX_LOAD_BYTES)
+    args = parser.parse_args()
+
+    dates = pd.bdate_range("2025-05-01", periods=args.days).strftime("%Y-%m-%d")
+    days = [("BENCH", date, synthetic_rows("BENCH", date, args.contracts_per_day)) for date in dates]
+    contracts = args.contracts_per_day * args.days
+    print(f"Synthetic month: {args.days} days x {args.contracts_per_day} contracts = {contracts} contracts")
+
+    results = {}
+    for name, run in (("legacy", run_legacy), ("columnar", lambda d: run_columnar(d, args.max_load_bytes))):
+        cpu_start = time.process_time()
+        rows, load_jobs = run(days)
+        cpu = time.process_time() - cpu_start
+        results[name] = {
+            "rows": rows,
+            "cpu_seconds": cpu,
+            "cpu_seconds_per_million": cpu / contracts * 1e6,
+            "load_jobs": load_jobs,
+        }
+        print(f"{name:>9}: {cpu:.2f}s CPU, {cpu / contracts * 1e6:.2f}s per million contracts, {load_jobs} load jobs")
+
+    speedup = results["legacy"]["cpu_seconds"] / max(results["columnar"]["cpu_seconds"], 1e-9)
+    print(f"Columnar path is {speedup:.1f}x faster and submits "
+          f"{math.ceil(results['legacy']['load_jobs'] / max(results['columnar']['load_jobs'], 1))}x fewer load jobs")
+    return results
+
+
+if __name__ == "__main__":
+    main()
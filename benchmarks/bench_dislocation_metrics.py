@@ -0,0 +1,91 @@
+"""
+Time the vectorized dislocation metrics for one day of the full universe and
+check them against a straightforward per-(symbol, date) pandas computation on a
+sample.
+
+    python -m benchmarks.bench_dislocation_metrics --symbols 500 --contracts-per-symbol 4000
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utilities import dislocation_metrics as dm
+
+
+def synthetic_chain_table(n_symbols, contracts_per_symbol, days=1, start="2025-05-01", seed=0):
+    """Chain Table for n_symbols x days, built directly with NumPy so millions of rows are cheap."""
+    rng = np.random.default_rng(seed)
+    n = n_symbols * contracts_per_symbol * days
+    start_days = (datetime.date.fromisoformat(start) - datetime.date(1970, 1, 1)).days
+    symbol_index = np.repeat(np.arange(n_symbols), contracts_per_symbol * days)
+    date = start_days + np.tile(np.repeat(np.arange(days), contracts_per_symbol), n_symbols)
+    dte = rng.choice([2, 9, 16, 30, 58, 93, 184, 366], size=n)
+    is_call = rng.random(n) < 0.5
+    delta = rng.random(n) * np.where(is_call, 1.0, -1.0)
+    return pa.table({
+        'symbol': pa.array(np.array([f"SYM{i:03d}" for i in range(n_symbols)])[symbol_index]),
+        'date': pa.array(date.astype(np.int32)).cast(pa.date32()),
+        'expiration': pa.array((date + dte).astype(np.int32)).cast(pa.date32()),
+        'type': pa.array(np.where(is_call, 'call', 'put')),
+        'strike': rng.random(n) * 500,
+        'volume': rng.integers(0, 5000, n),
+        'open_interest': rng.integers(0, 50000, n),
+        'delta': delta,
+        'implied_volatility': 0.15 + rng.random(n) * 0.6,
+    })
+
+
+def reference_metrics(chain):
+    """Per-group pandas computation of a subset of the metrics, for checking."""
+    df = chain.to_pandas()
+    df['dte'] = (pd.to_datetime(df['expiration']) - pd.to_datetime(df['date'])).dt.days
+
+    def one(g):
+        abs_delta = g['delta'].abs()
+        atm = g[(abs_delta >= 0.4) & (abs_delta <= 0.6) & g['dte'].between(*dm.SHORT_TENOR_DAYS)]
+        wing = g[(abs_delta >= 0.2) & (abs_delta <= 0.3) & g['dte'].between(*dm.SKEW_TENOR_DAYS)]
+        return pd.Series({
+            'volume_oi_ratio': g['volume'].sum() / g['open_interest'].sum(),
+            'atm_iv_short': atm['implied_volatility'].mean(),
+            'skew_25d': wing[wing['type'] == 'put']['implied_volatility'].mean()
+                        - wing[wing['type'] == 'call']['implied_volatility'].mean(),
+            'delta_adjusted_volume': (g['volume'] * abs_delta * dm.CONTRACT_MULTIPLIER).sum(),
+        })
+
+    return df.groupby(['symbol', 'date']).apply(one).reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--contracts-per-symbol", type=int, default=4000)
+    parser.add_argument("--history-days", type=int, default=60, help="days of per-symbol history for excess volume")
+    args = parser.parse_args()
+
+    chain = synthetic_chain_table(args.symbols, args.contracts_per_symbol)
+    print(f"Chain: {chain.num_rows:,} contracts, {args.symbols} symbols")
+    started = time.perf_counter()
+    metrics = dm.compute_dislocation_metrics(chain)
+    elapsed = time.perf_counter() - started
+    print(f"compute_dislocation_metrics: {elapsed:.2f}s ({chain.num_rows / elapsed / 1e6:.1f}M contracts/s)")
+
+    sample = synthetic_chain_table(5, 2000, days=2, seed=1)
+    expected = reference_metrics(sample)
+    actual = dm.compute_dislocation_metrics(sample).to_pandas()
+    for column in ('volume_oi_ratio', 'atm_iv_short', 'skew_25d', 'delta_adjusted_volume'):
+        np.testing.assert_allclose(actual[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9)
+    print("Matches the pandas reference on the sample")
+
+    history = synthetic_chain_table(args.symbols, 200, days=args.history_days, seed=2)
+    started = time.perf_counter()
+    daily = dm.add_excess_volume(dm.compute_dislocation_metrics(history))
+    print(f"{args.history_days}-day history + excess volume for {args.symbols} symbols: "
+          f"{time.perf_counter() - started:.2f}s ({daily.num_rows:,} symbol-days)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Time the vectorized implied vol solver and Greeks on a universe-sized array of
+contracts priced with known volatilities, and check the recovered vols.
+
+    python -m benchmarks.bench_implied_vol --contracts 2000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utilities import black_scholes as bs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contracts", type=int, default=2000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n = args.contracts
+    spot = rng.uniform(20, 500, n)
+    strike = spot * rng.uniform(0.5, 1.5, n)
+    t = rng.choice([2, 9, 16, 30, 58, 93, 184, 366, 730], n) / bs.DAYS_PER_YEAR
+    is_call = rng.random(n) < 0.5
+    vol = rng.uniform(0.08, 1.5, n)
+    price = bs.bs_price(spot, strike, t, vol, is_call)
+
+    started = time.perf_counter()
+    solved = bs.implied_vol(price, spot, strike, t, is_call)
+    iv_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    bs.greeks(spot, strike, t, solved, is_call)
+    greeks_seconds = time.perf_counter() - started
+
+    ok = np.isfinite(solved)
+    price_error = np.abs(bs.bs_price(spot, strike, t, solved, is_call) - price)[ok]
+    sensitive = ok & (bs.bs_vega(spot, strike, t, vol) > 0.01)
+    print(f"Contracts: {n:,}")
+    print(f"implied_vol: {iv_seconds:.2f}s ({n / iv_seconds / 1e6:.2f}M contracts/s), "
+          f"solved {ok.mean():.2%} (the rest are priced at intrinsic value)")
+    print(f"greeks: {greeks_seconds:.2f}s")
+    print(f"max price error {price_error.max():.1e}, max vol error where vega > 0.01: "
+          f"{np.abs(solved - vol)[sensitive].max():.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Storage volume of delta-only live polling against full snapshots.
+
+Polls REALTIME_OPTIONS on the mock server (a --change-rate share of each
+chain trades between polls) through utilities.live_snapshot into an
+in-memory warehouse, and reports the contracts stored against the
+contracts a full reload per poll would store. Checks that the incrementally
+maintained live metrics match compute_dislocation_metrics over the final
+full chains; exits non-zero if they differ.
+
+    python -m benchmarks.bench_live_snapshot --symbols 5 --polls 10 --change-rate 0.05
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from benchmarks.mock_alpha_vantage import MockAlphaVantage
+from utilities import live_snapshot
+from utilities.columnar import parse_options_rows
+from utilities.dislocation_metrics import compute_dislocation_metrics
+from utilities.storage import MemoryStorage, dedupe_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=5)
+    parser.add_argument("--polls", type=int, default=10)
+    parser.add_argument("--contracts-per-chain", type=int, default=4000)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    symbols = [f"LIVE{i}" for i in range(args.symbols)]
+    storage = MemoryStorage()
+    config = {"live_poll_seconds": 0, "api_calls_per_minute": 6000, "max_workers": 4}
+    with MockAlphaVantage(contracts_per_day=args.contracts_per_chain, realtime_change_rate=args.change_rate) as mock:
+        config["alpha_vantage_url"] = mock.url
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with output:
+            totals = live_snapshot.main(config=config, symbols=symbols, storage=storage, api_key="benchmark",
+                                        polls=args.polls)
+        elapsed = time.perf_counter() - started
+        today = datetime.date.today().isoformat()
+        final_chains = pa.concat_tables([dedupe_batch(parse_options_rows(mock.realtime_chains[s], s, today))
+                                         for s in symbols])
+
+    stored = storage.read_table(live_snapshot.LIVE_QUOTES_TABLE).num_rows
+    print(f"{args.polls} polls of {args.symbols} chains x {args.contracts_per_chain} contracts in {elapsed:.1f}s")
+    print(f"Full snapshots: {totals['contracts']} rows; delta-only: {stored} rows "
+          f"({stored / max(totals['contracts'], 1):.1%}), {totals['metric_rows']} live metric rows")
+
+    # Each symbol's latest row (a symbol gets a row only on polls where its chain changed)
+    live = storage.read_table(live_snapshot.LIVE_METRICS_TABLE)
+    latest = live.group_by("symbol").aggregate([("snapshot_at", "max")]).rename_columns(["symbol", "snapshot_at"])
+    live = live.join(latest, ["symbol", "snapshot_at"], join_type="inner").sort_by("symbol")
+    expected = compute_dislocation_metrics(final_chains).sort_by("symbol")
+    mismatched = []
+    for name in expected.column_names[2:]:
+        actual = pc.cast(live[name], pa.float64()).to_numpy(zero_copy_only=False)
+        wanted = pc.cast(expected[name], pa.float64()).to_numpy(zero_copy_only=False)
+        if not np.allclose(actual, wanted, rtol=1e-9, equal_nan=True):
+            mismatched.append(name)
+    if mismatched:
+        print(f"Incremental live metrics differ from a full recompute: {', '.join(mismatched)}")
+        return 1
+    print("Incremental live metrics match a full recompute")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Memory and slicing cost of the compact OptionChain against plain chains.
+
+Builds synthetic chains for --symbols x --days, then reports the in-memory
+size of the full OPTIONS_SCHEMA table and of the metric columns
+(CHAIN_COLUMNS) in plain and compact form, the time to build an OptionChain
+and to select by (date, expiration, type), and checks that the dislocation
+metrics of the compact chain match the plain ones. Exits non-zero if they
+differ or a selection copies data.
+
+    python -m benchmarks.bench_option_chain --symbols 50 --days 3 --contracts-per-day 2000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from benchmarks.synthetic_chains import synthetic_rows
+from utilities.columnar import parse_options_rows
+from utilities.dislocation_metrics import CHAIN_COLUMNS, compute_dislocation_metrics
+from utilities.option_chain import OptionChain, compact_table
+
+
+def _shares_buffers(selection, chain):
+    """Whether every chunk of selection's strike column points into chain's strike buffer."""
+    base = chain.table['strike'].chunk(0).buffers()[1]
+    for chunk in selection.table['strike'].chunks:
+        address = chunk.buffers()[1].address
+        if not base.address <= address < base.address + base.size:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--contracts-per-day", type=int, default=2000)
+    args = parser.parse_args()
+
+    dates = pd.bdate_range("2025-05-01", periods=args.days).strftime("%Y-%m-%d")
+    symbols = [f"S{i:03d}" for i in range(args.symbols)]
+    plain = pa.concat_tables([parse_options_rows(synthetic_rows(s, d, args.contracts_per_day), s, d)
+                              for s in symbols for d in dates]).combine_chunks()
+    metric_columns = plain.select(CHAIN_COLUMNS)
+    print(f"{plain.num_rows:,} contracts ({args.symbols} symbols x {args.days} days)")
+    print(f"Full schema:   plain {plain.nbytes / 1e6:.1f} MB, compact {compact_table(plain).nbytes / 1e6:.1f} MB")
+    print(f"CHAIN_COLUMNS: plain {metric_columns.nbytes / 1e6:.1f} MB, "
+          f"compact {compact_table(metric_columns).nbytes / 1e6:.1f} MB")
+
+    started = time.perf_counter()
+    chain = OptionChain.from_table(plain)
+    print(f"OptionChain.from_table: {time.perf_counter() - started:.2f}s, {chain.nbytes / 1e6:.1f} MB, "
+          f"{chain.groups.num_rows} (symbol, date, expiration, type) groups")
+
+    expiration = chain.expirations(symbols[0], dates[0])[2]
+    started = time.perf_counter()
+    cross_section = chain.select(date=dates[0], expiration=expiration, type="put")
+    one_symbol = chain.select(symbol=symbols[-1], date=dates[-1])
+    elapsed = time.perf_counter() - started
+    print(f"Two selections in {elapsed * 1000:.1f} ms: {cross_section.num_rows} puts expiring {expiration} "
+          f"across the universe, {one_symbol.num_rows} contracts of {symbols[-1]}")
+    if not (_shares_buffers(cross_section, chain) and _shares_buffers(one_symbol, chain)):
+        print("A selection copied its rows")
+        return 1
+
+    expected = compute_dislocation_metrics(plain)
+    actual = compute_dislocation_metrics(chain.table)
+    mismatched = []
+    # float32 deltas carry ~1e-7 relative error per contract, so the signed delta
+    # volume is held to that share of its gross (absolute) size
+    gross = pc.cast(expected['delta_adjusted_volume'], pa.float64()).to_numpy(zero_copy_only=False)
+    for name in expected.column_names[2:]:
+        wanted = pc.cast(expected[name], pa.float64()).to_numpy(zero_copy_only=False)
+        got = pc.cast(actual[name], pa.float64()).to_numpy(zero_copy_only=False)
+        atol = 1e-6 * gross if name == 'net_delta_volume' else 1e-8
+        if not np.all(np.isclose(got, wanted, rtol=1e-6, atol=atol, equal_nan=True)):
+            mismatched.append(name)
+    if mismatched:
+        print(f"Compact chain metrics differ: {', '.join(mismatched)}")
+        return 1
+    print("Dislocation metrics of the compact chain match the plain chain")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Cold start and per-symbol setup cost of the service.
+
+Reports the time to `import app` in a fresh interpreter and which heavy
+libraries that import pulls in, then starts `python app.py` on a free port
+--runs times and reports the median time until GET / first answers 200.
+Per-symbol setup is the config parse and the Secret Manager and BigQuery
+clients each symbol or chunk needs: it is timed built from scratch per
+symbol (as before utilities.resources) and through the resources cache.
+Clients use anonymous credentials, so no GCP access is needed. Exits
+non-zero if the service does not answer or app imports a heavy library.
+
+    python -m benchmarks.bench_startup --runs 5 --symbols 100
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import yaml
+
+from utilities import resources
+
+HEAVY_MODULES = ["pandas", "pyarrow", "numpy", "google.cloud.bigquery", "google.cloud.secretmanager"]
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import():
+    """(seconds, heavy modules loaded) for `import app` in a fresh interpreter."""
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], result["loaded"]
+
+
+def time_first_response(timeout=30):
+    """Seconds from starting app.py until GET / answers 200, or None if it never does."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "app.py"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.005)
+            if process.poll() is not None:
+                return None
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def time_per_symbol(setup, symbols):
+    """Mean milliseconds of setup() over symbols calls."""
+    started = time.perf_counter()
+    for _ in range(symbols):
+        setup()
+    return (time.perf_counter() - started) * 1000 / symbols
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=100)
+    args = parser.parse_args()
+
+    import_seconds, loaded = time_import()
+    print(f"import app: {import_seconds:.2f}s, heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+    timings = [time_first_response() for _ in range(args.runs)]
+    answered = [t for t in timings if t is not None]
+    if not answered:
+        print("app.py never answered GET /")
+        return 1
+    print(f"Time to first response: median {statistics.median(answered):.2f}s, "
+          f"min {min(answered):.2f}s over {len(answered)}/{args.runs} runs")
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import bigquery, secretmanager
+
+    project_id = "startup-benchmark"
+
+    def build_bigquery():
+        return bigquery.Client(project=project_id, credentials=AnonymousCredentials())
+
+    def build_secret_manager():
+        return secretmanager.SecretManagerServiceClient(credentials=AnonymousCredentials())
+
+    def uncached():
+        with open(resources.CONFIG_PATH, "r") as f:
+            yaml.safe_load(f)
+        build_secret_manager()
+        build_bigquery()
+
+    def cached():
+        resources.get_config()
+        resources.shared_client("benchmark-secretmanager", None, build_secret_manager)
+        resources.shared_client("benchmark-bigquery", project_id, build_bigquery)
+
+    uncached_ms = time_per_symbol(uncached, args.symbols)
+    cached_ms = time_per_symbol(cached, args.symbols)
+    print(f"Per-symbol setup (config + Secret Manager + BigQuery clients) over {args.symbols} symbols: "
+          f"{uncached_ms:.2f} ms uncached, {cached_ms:.3f} ms through utilities.resources")
+
+    if len(answered) < args.runs:
+        print("app.py did not answer on every run")
+        return 1
+    if loaded:
+        print(f"import app loads {', '.join(loaded)} at startup")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Peak-memory check for the streaming ingestion path.
+
+Feeds several synthetic 50k-contract-per-day responses through the same parse
+and flush code the loader uses, once with the streaming parser and a flush
+budget and once the old way (whole-document json.loads, one batch for the
+whole range). Each mode runs in its own subprocess so ru_maxrss is clean.
+Exits non-zero if the streaming peak RSS growth exceeds --ceiling-mb.
+
+    python -m benchmarks.bench_streaming_memory --days 5 --ceiling-mb 64
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic_chains import iter_response_bytes
+from utilities.columnar import concat_batches, parse_options_rows
+from utilities.streaming import BatchBuffer, iter_response_tables
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode, days, contracts_per_day, flush_rows):
+    dates = pd.bdate_range("2025-05-01", periods=days).strftime("%Y-%m-%d")
+    flushed = []
+    baseline = _peak_rss_mb()
+
+    if mode == "streaming":
+        buffer = BatchBuffer(lambda batch: flushed.append(batch.num_rows) or batch.num_rows, max_rows=flush_rows)
+        for date in dates:
+            for table in iter_response_tables(iter_response_bytes("BENCH", date, contracts_per_day), "BENCH", date):
+                buffer.add(table)
+        buffer.flush()
+    else:
+        batch = []
+        for date in dates:
+            data = json.loads(b"".join(iter_response_bytes("BENCH", date, contracts_per_day)))
+            batch.append(parse_options_rows(data["data"], "BENCH", date))
+            del data
+        flushed.append(concat_batches(batch).num_rows)
+
+    return {
+        "mode": mode,
+        "rows": sum(flushed),
+        "flushes": len(flushed),
+        "peak_rss_growth_mb": _peak_rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--contracts-per-day", type=int, default=50000)
+    parser.add_argument("--flush-rows", type=int, default=50000)
+    parser.add_argument("--ceiling-mb", type=float, default=64.0)
+    parser.add_argument("--mode", choices=["streaming", "buffered"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.days, args.contracts_per_day, args.flush_rows)))
+        return 0
+
+    results = {}
+    for mode in ("buffered", "streaming"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_streaming_memory", "--mode", mode,
+             "--days", str(args.days), "--contracts-per-day", str(args.contracts_per_day),
+             "--flush-rows", str(args.flush_rows)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+        r = results[mode]
+        print(f"{mode:>9}: {r['rows']} rows in {r['flushes']} flushes, peak RSS growth {r['peak_rss_growth_mb']:.1f} MB")
+
+    streaming_peak = results["streaming"]["peak_rss_growth_mb"]
+    if streaming_peak > args.ceiling_mb:
+        print(f"FAIL: streaming peak RSS growth {streaming_peak:.1f} MB exceeds ceiling of {args.ceiling_mb:.0f} MB")
+        return 1
+    print(f"OK: streaming peak RSS growth is under the {args.ceiling_mb:.0f} MB ceiling")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Local stand-in for the Alpha Vantage HISTORICAL_OPTIONS endpoint.
+
+Serves synthetic chains (benchmarks.synthetic_chains) over HTTP with
+configurable chain size, response latency and 429/503 injection, and counts
+the requests it receives so the achieved call rate can be measured.
+
+REALTIME_OPTIONS serves today's synthetic chain for the symbol, with a
+realtime_change_rate share of its contracts trading (volume and quotes
+moving) between consecutive requests.
+
+    python -m benchmarks.mock_alpha_vantage --port 8765 --contracts-per-day 5000
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic_chains import iter_response_bytes, synthetic_rows
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections at shutdown are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class MockAlphaVantage:
+    def __init__(self, host="127.0.0.1", port=0, contracts_per_day=2000, latency=0.0,
+                 error_rate_429=0.0, error_rate_503=0.0, seed=0, realtime_change_rate=0.05):
+        self.contracts_per_day = contracts_per_day
+        self.realtime_change_rate = realtime_change_rate
+        self.realtime_chains = {}
+        self.latency = latency
+        self.error_rate_429 = error_rate_429
+        self.error_rate_503 = error_rate_503
+        self.rng = random.Random(seed)
+        self.request_times = []
+        self.status_counts = {}
+        self._lock = threading.Lock()
+        self.server = _QuietServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/query"
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                mock.handle(self)
+
+        return Handler
+
+    def _record(self, status):
+        with self._lock:
+            self.request_times.append(time.monotonic())
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def handle(self, request):
+        params = {k: v[0] for k, v in parse_qs(urlparse(request.path).query).items()}
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            roll = self.rng.random()
+        if roll < self.error_rate_429:
+            return self._send_error(request, 429, "Too Many Requests")
+        if roll < self.error_rate_429 + self.error_rate_503:
+            return self._send_error(request, 503, "Service Unavailable")
+        if params.get("function") == "REALTIME_OPTIONS" and "symbol" in params:
+            return self._send_realtime(request, params["symbol"])
+        if params.get("function") != "HISTORICAL_OPTIONS" or "symbol" not in params:
+            return self._send_error(request, 400, "Bad Request")
+
+        symbol = params["symbol"]
+        date = params.get("date") or datetime.date.today().isoformat()
+        # Weekends have no chain, like the real API
+        n_contracts = 0 if datetime.date.fromisoformat(date).weekday() >= 5 else self.contracts_per_day
+        self._record(200)
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Transfer-Encoding", "chunked")
+        request.end_headers()
+        for chunk in iter_response_bytes(symbol, date, n_contracts):
+            request.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+        request.wfile.write(b"0\r\n\r\n")
+
+    def _send_realtime(self, request, symbol):
+        with self._lock:
+            rows = self.realtime_chains.get(symbol)
+            if rows is None:
+                rows = self.realtime_chains[symbol] = synthetic_rows(symbol, datetime.date.today().isoformat(),
+                                                                     self.contracts_per_day)
+            else:
+                for row in self.rng.sample(rows, int(len(rows) * self.realtime_change_rate)):
+                    mark = float(row['mark']) * (1 + self.rng.uniform(-0.05, 0.05))
+                    row['volume'] = str(int(row['volume']) + self.rng.randint(1, 50))
+                    row['mark'] = row['last'] = f"{mark:.2f}"
+                    row['bid'], row['ask'] = f"{mark * 0.98:.2f}", f"{mark * 1.02:.2f}"
+            body = json.dumps({"endpoint": "Realtime Options", "message": "success", "data": rows}).encode()
+        self._record(200)
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _send_error(self, request, status, message):
+        self._record(status)
+        body = message.encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "text/plain")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def calls_per_minute(self):
+        """Average request rate between the first and last request received."""
+        with self._lock:
+            times = list(self.request_times)
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0]) * 60.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--contracts-per-day", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-503", type=float, default=0.0)
+    args = parser.parse_args()
+    mock = MockAlphaVantage(port=args.port, contracts_per_day=args.contracts_per_day, latency=args.latency,
+                            error_rate_429=args.error_rate_429, error_rate_503=args.error_rate_503)
+    print(f"Serving synthetic HISTORICAL_OPTIONS on {mock.url}")
+    mock.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+End-to-end ingestion benchmark against the mock Alpha Vantage server and an
+in-memory warehouse.
+
+Runs the real loader main() (token bucket, worker pool, streaming parser,
+buffering, storage writes) for a synthetic universe and reports contracts/s,
+API calls/min, peak RSS and load-job count. Results are written as JSON under
+benchmarks/results/ so runs can be compared over time.
+
+    python -m benchmarks.run_pipeline_benchmark --symbols 8 --days 10
+    python -m benchmarks.run_pipeline_benchmark --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.mock_alpha_vantage import MockAlphaVantage
+from utilities import load_historical_options_data as loader
+from utilities.metrics import METRICS
+from utilities.storage import MemoryStorage
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    symbols = [f"SYM{i:03d}" for i in range(args.symbols)]
+    dates = pd.bdate_range(args.start, periods=args.days)
+    config = {
+        "project_id": "benchmark",
+        "date_start": dates[0].strftime("%Y-%m-%d"),
+        "date_end": dates[-1].strftime("%Y-%m-%d"),
+        "api_calls_per_minute": args.calls_per_minute,
+        "max_workers": args.workers,
+        "streaming": not args.no_streaming,
+        "flush_rows": args.flush_rows,
+        "cache_enabled": False,
+        "summary_path": None,
+    }
+    storage = MemoryStorage(keep_data=False)
+    baseline_rss = _peak_rss_mb()
+
+    with MockAlphaVantage(contracts_per_day=args.contracts_per_day, latency=args.latency,
+                          error_rate_429=args.error_rate_429, error_rate_503=args.error_rate_503) as mock:
+        config["alpha_vantage_url"] = mock.url
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with output:
+            summary = loader.main(config=config, symbols=symbols, api_key="benchmark", storage=storage)
+        elapsed = time.perf_counter() - started
+        server_calls_per_minute = mock.calls_per_minute()
+        status_counts = dict(mock.status_counts)
+
+    stages = summary["metrics"]["stages"]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": _git_revision(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("compare", "verbose", "output")},
+        "contracts": storage.rows_written,
+        "elapsed_seconds": round(elapsed, 3),
+        "contracts_per_second": round(storage.rows_written / elapsed, 1),
+        "api_calls": summary["api_calls"],
+        "api_calls_per_minute": summary["api_calls_per_minute"],
+        "server_calls_per_minute": round(server_calls_per_minute, 1),
+        "server_status_counts": {str(k): v for k, v in status_counts.items()},
+        "quota_utilization": round(server_calls_per_minute / args.calls_per_minute, 3),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_rss_growth_mb": round(_peak_rss_mb() - baseline_rss, 1),
+        "load_jobs": storage.write_count,
+        "failed_symbols": len(summary["failed_symbols"]),
+        "stage_seconds": {stage: stats["seconds"] for stage, stats in stages.items()},
+    }
+
+
+def compare(current, previous):
+    print(f"\nCompared with {previous.get('timestamp')} ({previous.get('git_revision')}):")
+    for key in ("contracts_per_second", "api_calls_per_minute", "peak_rss_mb", "load_jobs", "elapsed_seconds"):
+        before, after = previous.get(key), current.get(key)
+        if before in (None, 0) or after is None:
+            continue
+        print(f"  {key:>22}: {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=8)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--start", default="2025-05-01")
+    parser.add_argument("--contracts-per-day", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds the mock server waits per request")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-503", type=float, default=0.0)
+    parser.add_argument("--calls-per-minute", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=loader.DEFAULT_MAX_WORKERS)
+    parser.add_argument("--flush-rows", type=int, default=50000)
+    parser.add_argument("--no-streaming", action="store_true")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/pipeline-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the loader's own output")
+    args = parser.parse_args()
+
+    METRICS.start_run()
+    result = run_benchmark(args)
+    for key in ("contracts", "contracts_per_second", "api_calls", "api_calls_per_minute", "server_calls_per_minute",
+                "quota_utilization", "peak_rss_mb", "load_jobs", "elapsed_seconds"):
+        print(f"{key:>24}: {result[key]}")
+    print(f"{'stage_seconds':>24}: {result['stage_seconds']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
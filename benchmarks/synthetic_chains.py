@@ -0,0 +1,66 @@
+"""
+Synthetic HISTORICAL_OPTIONS chains shaped like Alpha Vantage responses
+(every field is a string, as the API returns them).
+"""
+import datetime
+import json
+import random
+
+
+def synthetic_rows(symbol, date, n_contracts, seed=0):
+    """Return the `data` array for one (symbol, date) with n_contracts contracts."""
+    return list(iter_synthetic_rows(symbol, date, n_contracts, seed))
+
+
+def iter_synthetic_rows(symbol, date, n_contracts, seed=0):
+    """Generate the contracts of one (symbol, date) chain one at a time."""
+    rng = random.Random(f"{symbol}:{date}:{seed}")
+    trade_date = datetime.date.fromisoformat(date)
+    spot = 50 + rng.random() * 450
+    expirations = [trade_date + datetime.timedelta(days=d) for d in (2, 9, 16, 30, 58, 93, 184, 366, 730)]
+    per_expiration = max(1, n_contracts // (2 * len(expirations)))
+    for i in range(n_contracts):
+        expiration = expirations[(i // (2 * per_expiration)) % len(expirations)]
+        option_type = 'call' if i % 2 == 0 else 'put'
+        strike = round(spot * (0.5 + (i // 2 % per_expiration) / per_expiration), 2)
+        iv = 0.15 + rng.random() * 0.6
+        mark = max(0.01, rng.random() * spot * 0.1)
+        yield {
+            'contractID': f"{symbol}{expiration:%y%m%d}{option_type[0].upper()}{int(strike * 1000):08d}",
+            'symbol': symbol,
+            'expiration': expiration.isoformat(),
+            'strike': f"{strike:.2f}",
+            'type': option_type,
+            'last': f"{mark:.2f}",
+            'mark': f"{mark:.2f}",
+            'bid': f"{mark * 0.98:.2f}",
+            'bid_size': str(rng.randint(0, 500)),
+            'ask': f"{mark * 1.02:.2f}",
+            'ask_size': str(rng.randint(0, 500)),
+            'volume': str(rng.randint(0, 5000)),
+            'open_interest': str(rng.randint(0, 50000)),
+            'date': date,
+            'implied_volatility': f"{iv:.5f}",
+            'delta': f"{(rng.random() if option_type == 'call' else -rng.random()):.5f}",
+            'gamma': f"{rng.random() * 0.05:.5f}",
+            'theta': f"{-rng.random():.5f}",
+            'vega': f"{rng.random():.5f}",
+            'rho': f"{rng.random() * 0.1:.5f}",
+        }
+
+
+def iter_response_bytes(symbol, date, n_contracts, seed=0, rows_per_chunk=200):
+    """
+    Yield a full HISTORICAL_OPTIONS JSON response as byte chunks without ever
+    holding the whole document, like a streamed HTTP body.
+    """
+    yield b'{"endpoint": "Historical Options", "message": "success", "data": ['
+    pending = []
+    for i, row in enumerate(iter_synthetic_rows(symbol, date, n_contracts, seed)):
+        pending.append(("," if i else "") + json.dumps(row))
+        if len(pending) >= rows_per_chunk:
+            yield "".join(pending).encode()
+            pending = []
+    if pending:
+        yield "".join(pending).encode()
+    yield b"]}"
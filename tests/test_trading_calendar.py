@@ -0,0 +1,37 @@
+from utilities.trading_calendar import ListingWindows, trading_days
+
+
+def _has_data_through(last_published, calls):
+    def has_data(day):
+        calls.append(day)
+        return day <= last_published
+    return has_data
+
+
+def test_probe_before_publication_is_not_a_delisting(tmp_path):
+    windows = ListingWindows(str(tmp_path / "windows.json"))
+    day1 = trading_days("2025-05-01", "2025-06-10")
+    # Day 1: the run's last day is not published yet when it is probed
+    calls = []
+    assert windows.trim("AAA", day1, _has_data_through(day1[-2], calls), today=day1[-1]) == day1
+    assert not windows.get("AAA")["delisted"]
+
+    # Day 2: everything is published; no day may be dropped
+    day2 = trading_days("2025-05-01", "2025-06-11")
+    calls = []
+    assert windows.trim("AAA", day2, _has_data_through(day2[-1], calls), today=day2[-1]) == day2
+    assert calls == []
+
+
+def test_unconfirmed_end_is_probed_again_once_settled(tmp_path):
+    windows = ListingWindows(str(tmp_path / "windows.json"))
+    days = trading_days("2025-05-01", "2025-06-10")
+    delisted_after = days[-2]
+    windows.trim("AAA", days, _has_data_through(delisted_after, []), today=days[-1])
+
+    later = trading_days("2025-05-01", "2025-06-20")
+    calls = []
+    trimmed = windows.trim("AAA", later, _has_data_through(delisted_after, calls), today=later[-1])
+    assert calls
+    assert trimmed == [d for d in later if d <= delisted_after]
+    assert windows.get("AAA")["delisted"]
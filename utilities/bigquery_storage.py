@@ -0,0 +1,354 @@
+"""
+BigQuery implementation of the options storage interface.
+"""
+import threading
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+
+from utilities.columnar import OPTIONS_SCHEMA, concat_batches, split_by_bytes, to_parquet_buffer
+from utilities.metrics import METRICS
+from utilities.resources import bigquery_client
+from utilities.storage import COVERAGE_SCHEMA, MERGE_KEYS, OPTIONS_DATASET, OptionsStorage, dedupe_batch, table_layout
+
+DEFAULT_MAX_LOAD_BYTES = 512 * 1024 * 1024  # upper bound on the arrow data behind one load job
+STAGING_TABLE_EXPIRATION_MS = 24 * 60 * 60 * 1000  # staging tables left behind by a crash expire after a day
+
+OPTIONS_BQ_SCHEMA = [
+    bigquery.SchemaField('contractID', 'STRING'),
+    bigquery.SchemaField('symbol', 'STRING'),
+    bigquery.SchemaField('expiration', 'DATE'),
+    bigquery.SchemaField('strike', 'FLOAT'),
+    bigquery.SchemaField('type', 'STRING'),
+    bigquery.SchemaField('last', 'FLOAT'),
+    bigquery.SchemaField('mark', 'FLOAT'),
+    bigquery.SchemaField('bid', 'FLOAT'),
+    bigquery.SchemaField('bid_size', 'INTEGER'),
+    bigquery.SchemaField('ask', 'FLOAT'),
+    bigquery.SchemaField('ask_size', 'INTEGER'),
+    bigquery.SchemaField('volume', 'INTEGER'),
+    bigquery.SchemaField('open_interest', 'INTEGER'),
+    bigquery.SchemaField('date', 'DATE'),
+    bigquery.SchemaField('implied_volatility', 'FLOAT'),
+    bigquery.SchemaField('delta', 'FLOAT'),
+    bigquery.SchemaField('gamma', 'FLOAT'),
+    bigquery.SchemaField('theta', 'FLOAT'),
+    bigquery.SchemaField('vega', 'FLOAT'),
+    bigquery.SchemaField('rho', 'FLOAT'),
+    bigquery.SchemaField('collected_date', 'DATE'),
+    bigquery.SchemaField('greeks_source', 'STRING'),
+]
+
+
+def bq_schema_from_arrow(schema):
+    """BigQuery schema fields for an arrow schema of strings, numbers, dates and timestamps."""
+    fields = []
+    for field in schema:
+        if pa.types.is_string(field.type) or pa.types.is_dictionary(field.type):
+            field_type = 'STRING'
+        elif pa.types.is_floating(field.type):
+            field_type = 'FLOAT'
+        elif pa.types.is_integer(field.type):
+            field_type = 'INTEGER'
+        elif pa.types.is_date(field.type):
+            field_type = 'DATE'
+        elif pa.types.is_timestamp(field.type):
+            field_type = 'TIMESTAMP'
+        elif pa.types.is_boolean(field.type):
+            field_type = 'BOOLEAN'
+        else:
+            raise ValueError(f"No BigQuery type for column {field.name} ({field.type})")
+        fields.append(bigquery.SchemaField(field.name, field_type))
+    return fields
+
+
+def bq_schema_for(table_id):
+    if table_id.split('.')[0] == OPTIONS_DATASET:
+        return OPTIONS_BQ_SCHEMA
+    return bq_schema_from_arrow(table_layout(table_id)["schema"])
+
+
+def create_options_table_if_not_exists(table_id, project_id):
+    client = bigquery_client(project_id)
+    dataset_id, table_name = table_id.split('.')
+    
+    # First ensure dataset exists
+    dataset_ref = client.dataset(dataset_id)
+    try:
+        client.get_dataset(dataset_ref)
+        print(f"Dataset {dataset_id} exists.")
+    except Exception:
+        dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
+        dataset = client.create_dataset(dataset, exists_ok=True)
+        print(f"Created dataset {dataset_id}")
+    
+    # Then create table if it doesn't exist
+    table_ref = dataset_ref.table(table_name)
+    table = bigquery.Table(table_ref, schema=bq_schema_for(table_id))
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=getattr(bigquery.TimePartitioningType, table_layout(table_id)["bq_partition"]),
+        field="date"
+    )
+    table.clustering_fields = list(table_layout(table_id)["cluster_by"])
+    try:
+        existing = client.get_table(table_ref)
+        print(f"Table {table_id} already exists.")
+        # Columns added to the schema since the table was created (all nullable)
+        names = {field.name for field in existing.schema}
+        added = [field for field in table.schema if field.name not in names]
+        if added:
+            existing.schema = list(existing.schema) + added
+            client.update_table(existing, ["schema"])
+            print(f"Added columns {', '.join(field.name for field in added)} to {table_id}")
+    except NotFound:
+        client.create_table(table)
+        print(f"Created table {table_id} with partitioning and clustering.")
+
+def push_batch_to_bq(batch, table_id, project_id, max_load_bytes=DEFAULT_MAX_LOAD_BYTES):
+    """
+    Helper function to push a batch of data to BigQuery.
+    
+    batch is a pyarrow Table (or a list of Tables) with the columnar OPTIONS_SCHEMA
+    (or the schema registered for the table's dataset).
+    It is written as Parquet and loaded with a single load job, unless it is
+    larger than max_load_bytes, in which case it is split into byte-sized slices.
+    """
+    if isinstance(batch, list):
+        with METRICS.timer("transform"):
+            batch = concat_batches(batch)
+    if batch.num_rows == 0:
+        print("Warning: Empty batch received, skipping upload")
+        return 0
+    
+    try:
+        print(f"\nPreparing to insert {batch.num_rows} rows ({batch.nbytes / 1e6:.1f} MB) into {table_id}...")
+        
+        client = bigquery_client(project_id)
+        dataset_id, table_name = table_id.split('.')
+        table_ref = client.dataset(dataset_id).table(table_name)
+        job_config = bigquery.LoadJobConfig(
+            schema=bq_schema_for(table_id),
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition="WRITE_APPEND"
+        )
+        
+        total_processed = 0
+        for job_number, piece in enumerate(split_by_bytes(batch, max_load_bytes), 1):
+            with METRICS.timer("transform"):
+                buffer = to_parquet_buffer(piece)
+            with METRICS.timer("load"):
+                job = client.load_table_from_file(buffer, table_ref, job_config=job_config)
+                job.result()
+            METRICS.inc("load_jobs")
+            METRICS.inc("rows_loaded", piece.num_rows)
+            total_processed += piece.num_rows
+            print(f"Load job {job_number} finished, total rows so far: {total_processed}")
+            del buffer
+        
+        return total_processed
+        
+    except Exception as e:
+        print(f"\nFailed to insert batch into {table_id}")
+        print(f"Error type: {type(e).__name__}")
+        print(f"Error message: {str(e)}")
+        import traceback
+        print("\nFull error traceback:")
+        traceback.print_exc()
+        return 0
+
+def get_existing_dates(symbol, table_id, project_id):
+    """
+    Query BigQuery to get the dates that already have data for a given symbol.
+    Returns a set of dates in YYYY-MM-DD format.
+    """
+    client = bigquery_client(project_id)
+    query = f"""
+    SELECT DISTINCT date
+    FROM `{table_id}`
+    WHERE symbol = @symbol
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("symbol", "STRING", symbol)
+        ]
+    )
+    
+    try:
+        query_job = client.query(query, job_config=job_config)
+        existing_dates = {row.date.strftime('%Y-%m-%d') for row in query_job}
+        print(f"Found {len(existing_dates)} existing dates for {symbol}")
+        return existing_dates
+    except NotFound:
+        return set()
+    except Exception as e:
+        # An empty set here would refetch every date, so the caller must give up instead
+        print(f"Error querying existing dates: {str(e)}")
+        raise
+
+
+class BigQueryStorage(OptionsStorage):
+    """Options tables stored in BigQuery, one load job per batch."""
+
+    def __init__(self, project_id, max_load_bytes=DEFAULT_MAX_LOAD_BYTES):
+        self.project_id = project_id
+        self.max_load_bytes = max_load_bytes
+        # Tables already checked or created by this process, so the shared
+        # consolidated table costs one round of metadata calls, not one per symbol
+        self._ensured = set()
+        self._lock = threading.Lock()
+
+    def ensure_table(self, table_id):
+        with self._lock:
+            if table_id in self._ensured:
+                return
+        create_options_table_if_not_exists(table_id, self.project_id)
+        with self._lock:
+            self._ensured.add(table_id)
+
+    def write_batch(self, batch, table_id):
+        return push_batch_to_bq(batch, table_id, self.project_id, self.max_load_bytes)
+
+    def merge_batch(self, batch, table_id, keys=MERGE_KEYS):
+        """
+        Load batch into a staging table (in <dataset>_staging, whose tables
+        expire after a day), then MERGE it into table_id on keys. The MERGE is
+        limited to the batch's dates and symbols so only those partitions and
+        clusters are scanned.
+        """
+        if isinstance(batch, list):
+            with METRICS.timer("transform"):
+                batch = concat_batches(batch)
+        batch = dedupe_batch(batch, keys)
+        if batch.num_rows == 0:
+            return 0
+        dataset_id, table_name = table_id.split('.')
+        staging_dataset = f"{dataset_id}_staging"
+        staging_id = f"{staging_dataset}.{table_name}_{uuid.uuid4().hex[:12]}"
+        client = bigquery_client(self.project_id)
+        try:
+            with self._lock:
+                ensured = staging_dataset in self._ensured
+            if not ensured:
+                dataset = bigquery.Dataset(f"{self.project_id}.{staging_dataset}")
+                dataset.default_table_expiration_ms = STAGING_TABLE_EXPIRATION_MS
+                client.create_dataset(dataset, exists_ok=True)
+                with self._lock:
+                    self._ensured.add(staging_dataset)
+            staged = push_batch_to_bq(batch, staging_id, self.project_id, self.max_load_bytes)
+            if staged != batch.num_rows:
+                print(f"Staging load into {staging_id} failed, nothing merged into {table_id}")
+                return 0
+
+            columns = [field.name for field in bq_schema_for(table_id)]
+            on = " AND ".join(f"T.`{key}` = S.`{key}`" for key in keys)
+            updates = ", ".join(f"`{name}` = S.`{name}`" for name in columns if name not in keys)
+            names = ", ".join(f"`{name}`" for name in columns)
+            values = ", ".join(f"S.`{name}`" for name in columns)
+            dates = batch['date']
+            sql = f"""
+            MERGE `{table_id}` T
+            USING `{staging_id}` S
+            ON {on} AND T.date BETWEEN @min_date AND @max_date AND T.symbol IN UNNEST(@symbols)
+            WHEN MATCHED THEN UPDATE SET {updates}
+            WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})
+            """
+            params = [
+                bigquery.ScalarQueryParameter("min_date", "DATE", pc.min(dates).as_py()),
+                bigquery.ScalarQueryParameter("max_date", "DATE", pc.max(dates).as_py()),
+                bigquery.ArrayQueryParameter("symbols", "STRING", pc.unique(batch['symbol']).to_pylist()),
+            ]
+            with METRICS.timer("load"):
+                job = client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
+                job.result()
+            print(f"Merged {batch.num_rows} rows into {table_id} ({job.num_dml_affected_rows} inserted or updated)")
+            return batch.num_rows
+        except Exception as e:
+            print(f"\nFailed to merge batch into {table_id}: {type(e).__name__}: {e}")
+            return 0
+        finally:
+            client.delete_table(staging_id, not_found_ok=True)
+
+    def existing_dates(self, symbol, table_id):
+        return get_existing_dates(symbol, table_id, self.project_id)
+
+    def read_table(self, table_id, symbol=None, start=None, end=None, columns=None):
+        conditions = []
+        params = []
+        if symbol is not None:
+            conditions.append("symbol = @symbol")
+            params.append(bigquery.ScalarQueryParameter("symbol", "STRING", symbol))
+        if start is not None:
+            conditions.append("date >= @start")
+            params.append(bigquery.ScalarQueryParameter("start", "DATE", start))
+        if end is not None:
+            conditions.append("date <= @end")
+            params.append(bigquery.ScalarQueryParameter("end", "DATE", end))
+        select = ", ".join(columns) if columns else "*"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.query(f"SELECT {select} FROM `{table_id}` {where}", params)
+
+    def list_tables(self, dataset_id):
+        client = bigquery_client(self.project_id)
+        try:
+            return sorted(f"{dataset_id}.{table.table_id}" for table in client.list_tables(dataset_id))
+        except NotFound:
+            return []
+
+    def symbols(self, table_id):
+        try:
+            table = self.query(f"SELECT DISTINCT symbol FROM `{table_id}`")
+        except NotFound:
+            return set()
+        return set(table["symbol"].to_pylist())
+
+    def coverage(self, table_ids):
+        """One query for all tables: a wildcard over the per-symbol tables, or the consolidated table itself."""
+        select = ("SELECT symbol, CAST(date AS STRING) AS date, COUNT(*) AS row_count, "
+                  "CAST(MAX(collected_date) AS STRING) AS loaded_at")
+        if len(table_ids) == 1:
+            sql, params = f"{select} FROM `{table_ids[0]}` GROUP BY symbol, date", []
+        else:
+            datasets = {table_id.split('.')[0] for table_id in table_ids}
+            if len(datasets) != 1:
+                return super().coverage(table_ids)
+            sql = f"{select} FROM `{datasets.pop()}.*` WHERE _TABLE_SUFFIX IN UNNEST(@tables) GROUP BY symbol, date"
+            params = [bigquery.ArrayQueryParameter("tables", "STRING", [t.split('.')[1] for t in table_ids])]
+        try:
+            return self.query(sql, params).cast(COVERAGE_SCHEMA)
+        except NotFound:
+            # Nothing loaded yet
+            return COVERAGE_SCHEMA.empty_table()
+
+    def copy_into(self, source_ids, target_id, dates=None):
+        """
+        Copy the source tables with a single INSERT ... SELECT, without moving
+        data through this process, limited to dates[source_id] where given.
+        """
+        columns = ", ".join(f"`{name}`" for name in OPTIONS_SCHEMA.names)
+        selects = []
+        params = []
+        for i, source_id in enumerate(source_ids):
+            wanted = (dates or {}).get(source_id)
+            if wanted is None:
+                selects.append(f"SELECT {columns} FROM `{source_id}`")
+            else:
+                selects.append(f"SELECT {columns} FROM `{source_id}` WHERE date IN UNNEST(@dates_{i})")
+                params.append(bigquery.ArrayQueryParameter(f"dates_{i}", "DATE", sorted(wanted)))
+        client = bigquery_client(self.project_id)
+        job_config = bigquery.QueryJobConfig(query_parameters=params)
+        with METRICS.timer("load"):
+            job = client.query(f"INSERT INTO `{target_id}` ({columns}) {' UNION ALL '.join(selects)}",
+                               job_config=job_config)
+            job.result()
+        METRICS.inc("load_jobs")
+        copied = job.num_dml_affected_rows or 0
+        METRICS.inc("rows_loaded", copied)
+        return copied
+
+    def query(self, sql, params=None):
+        client = bigquery_client(self.project_id)
+        job_config = bigquery.QueryJobConfig(query_parameters=params or [])
+        return client.query(sql, job_config=job_config).to_arrow()
@@ -0,0 +1,147 @@
+"""
+Columnar parsing of Alpha Vantage HISTORICAL_OPTIONS responses.
+
+Each response's `data` array is turned straight into a typed pyarrow Table
+(one array per column) instead of one Python dict per contract, and batches
+are serialized to Parquet for loading.
+"""
+import io
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+STRING_COLUMNS = ['contractID', 'symbol', 'type', 'greeks_source']
+FLOAT_COLUMNS = ['strike', 'last', 'mark', 'bid', 'ask', 'implied_volatility',
+                 'delta', 'gamma', 'theta', 'vega', 'rho']
+INT_COLUMNS = ['bid_size', 'ask_size', 'volume', 'open_interest']
+DATE_COLUMNS = ['expiration', 'date', 'collected_date']
+
+# Column order matches the BigQuery table schema
+OPTIONS_SCHEMA = pa.schema([
+    ('contractID', pa.string()),
+    ('symbol', pa.string()),
+    ('expiration', pa.date32()),
+    ('strike', pa.float64()),
+    ('type', pa.string()),
+    ('last', pa.float64()),
+    ('mark', pa.float64()),
+    ('bid', pa.float64()),
+    ('bid_size', pa.int64()),
+    ('ask', pa.float64()),
+    ('ask_size', pa.int64()),
+    ('volume', pa.int64()),
+    ('open_interest', pa.int64()),
+    ('date', pa.date32()),
+    ('implied_volatility', pa.float64()),
+    ('delta', pa.float64()),
+    ('gamma', pa.float64()),
+    ('theta', pa.float64()),
+    ('vega', pa.float64()),
+    ('rho', pa.float64()),
+    ('collected_date', pa.date32()),
+    # Null when implied_volatility and the Greeks are the vendor's; set by black_scholes.backfill_greeks
+    ('greeks_source', pa.string()),
+])
+
+# Rows missing any of these are dropped before loading
+CRITICAL_COLUMNS = ['symbol', 'date', 'strike', 'type']
+
+
+def _coerce_value(value, arrow_type):
+    """Slow path for a single value that the vectorized cast rejected."""
+    try:
+        if pa.types.is_integer(arrow_type):
+            return int(float(value))
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        return pa.scalar(str(value)).cast(arrow_type).as_py()
+    except (TypeError, ValueError, pa.ArrowInvalid):
+        return None
+
+
+def _to_typed_array(values, arrow_type):
+    """
+    Convert a list of raw JSON values (strings, numbers or None) into an arrow
+    array of arrow_type. Unparseable values become null, like pd.to_numeric(errors='coerce').
+    """
+    try:
+        raw = pa.array(values, type=pa.string())
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        raw = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if arrow_type == pa.string():
+        return raw
+    raw = pc.if_else(pc.equal(raw, ''), pa.scalar(None, pa.string()), raw)
+    try:
+        return raw.cast(arrow_type)
+    except pa.ArrowInvalid:
+        return pa.array([None if v is None else _coerce_value(v, arrow_type)
+                         for v in raw.to_pylist()], type=arrow_type)
+
+
+def parse_options_rows(rows, symbol, date):
+    """
+    Parse the `data` array of one HISTORICAL_OPTIONS response into a pyarrow
+    Table with OPTIONS_SCHEMA. Missing symbol/date values default to the
+    requested symbol and date, and collected_date is set to date.
+    Rows missing critical columns are dropped.
+    """
+    if not rows:
+        return OPTIONS_SCHEMA.empty_table()
+    columns = []
+    for field in OPTIONS_SCHEMA:
+        if field.name == 'collected_date':
+            columns.append(pa.array([date] * len(rows), type=pa.string()).cast(pa.date32()))
+            continue
+        array = _to_typed_array([row.get(field.name) for row in rows], field.type)
+        if field.name == 'symbol':
+            array = pc.fill_null(array, pa.scalar(symbol, pa.string()))
+        elif field.name == 'date':
+            array = pc.fill_null(array, pa.scalar(date, pa.string()).cast(pa.date32()))
+        columns.append(array)
+    table = pa.Table.from_arrays(columns, schema=OPTIONS_SCHEMA)
+    return drop_incomplete_rows(table)
+
+
+def drop_incomplete_rows(table):
+    """Remove rows with missing critical data, reporting how many were dropped."""
+    mask = None
+    for name in CRITICAL_COLUMNS:
+        valid = pc.is_valid(table[name])
+        mask = valid if mask is None else pc.and_(mask, valid)
+    filtered = table.filter(mask)
+    dropped = table.num_rows - filtered.num_rows
+    if dropped > 0:
+        print(f"Warning: Dropped {dropped} rows with missing critical data")
+    return filtered
+
+
+def concat_batches(tables):
+    """Concatenate parsed tables into a single Table with OPTIONS_SCHEMA."""
+    tables = [t for t in tables if t.num_rows]
+    if not tables:
+        return OPTIONS_SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def split_by_bytes(table, max_bytes):
+    """
+    Yield slices of table whose in-memory size stays under max_bytes.
+    Slicing is zero-copy, so this only decides where load job boundaries fall.
+    """
+    if table.num_rows == 0:
+        return
+    if table.nbytes <= max_bytes:
+        yield table
+        return
+    rows_per_slice = max(1, int(table.num_rows * max_bytes / table.nbytes))
+    for offset in range(0, table.num_rows, rows_per_slice):
+        yield table.slice(offset, rows_per_slice)
+
+
+def to_parquet_buffer(table):
+    """Serialize a Table to an in-memory Parquet file positioned at the start."""
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='snappy')
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,209 @@
+"""
+Universe-wide index of which (symbol, date) option chains are loaded.
+
+Instead of one SELECT DISTINCT date query per symbol before fetching, the
+loader builds this index with a single coverage query over every options
+table (storage.coverage), caches it under .cache/ and appends each committed
+batch to a small journal next to it. The planner then computes all missing
+(symbol, date) work items at startup from memory.
+
+If the coverage cannot be read, CoverageIndexError is raised and the run
+stops: treating a failed lookup as "nothing loaded" would refetch the whole
+universe.
+"""
+import datetime
+import json
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DEFAULT_COVERAGE_INDEX_PATH = ".cache/coverage_index.json"
+DEFAULT_COVERAGE_MAX_AGE_HOURS = 24
+
+
+class CoverageIndexError(Exception):
+    """The warehouse coverage could not be determined, so no work can be planned safely."""
+
+
+def coverage_source(config):
+    """Identifies the warehouse an index describes, so a cached index is never reused for another one."""
+    backend = config.get("storage_backend", "bigquery")
+    location = config.get("local_storage_dir") if backend == "local" else config.get("project_id")
+    mode = config.get("options_table_mode", "per_symbol")
+    return f"{backend}:{location}:{mode}"
+
+
+class CoverageIndex:
+    """
+    symbol -> {date: [row_count, loaded_at]} for the scanned symbols, kept as
+    a JSON snapshot plus an append-only journal of commits since the snapshot.
+    """
+
+    def __init__(self, path=DEFAULT_COVERAGE_INDEX_PATH, source=None):
+        self.path = path
+        self.source = source
+        self.entries = {}
+        self.scanned = set()
+        self.built_at = None
+        # (symbol, date) merged during this run, whose counts were reset by their first batch
+        self._merged = set()
+        self._lock = threading.Lock()
+
+    @property
+    def journal_path(self):
+        return f"{self.path}.log"
+
+    def load(self):
+        """Read the cached snapshot and journal. Returns False when there is no usable cache."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+            if stored.get("source") != self.source:
+                print(f"Coverage index at {self.path} describes {stored.get('source')}, not {self.source}")
+                return False
+            entries = stored["symbols"]
+            scanned = set(stored["scanned"])
+            built_at = datetime.datetime.fromisoformat(stored["built_at"])
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "r") as f:
+                    for line in f:
+                        # A torn last line from a crash is ignored
+                        try:
+                            symbol, date, row_count, loaded_at, *replaced = json.loads(line)
+                        except ValueError:
+                            continue
+                        entry = entries.setdefault(symbol, {}).setdefault(date, [0, loaded_at])
+                        entry[0] = row_count if replaced and replaced[0] else entry[0] + row_count
+                        entry[1] = max(entry[1] or "", loaded_at)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not read coverage index from {self.path}: {e}")
+            return False
+        with self._lock:
+            self.entries, self.scanned, self.built_at = entries, scanned, built_at
+        return True
+
+    def age_hours(self):
+        if self.built_at is None:
+            return None
+        return (datetime.datetime.now() - self.built_at).total_seconds() / 3600
+
+    def build(self, storage, symbols):
+        """Scan the coverage of symbols' option tables with one storage.coverage call."""
+        symbols = list(symbols)
+        table_ids = sorted({storage.options_table_id(symbol) for symbol in symbols})
+        print(f"Building coverage index for {len(symbols)} symbols over {len(table_ids)} tables...")
+        try:
+            coverage = storage.coverage(table_ids)
+        except Exception as e:
+            raise CoverageIndexError(f"Coverage query failed: {e}") from e
+        wanted = set(symbols)
+        entries = {symbol: {} for symbol in symbols}
+        for symbol, date, row_count, loaded_at in zip(coverage['symbol'].to_pylist(), coverage['date'].to_pylist(),
+                                                      coverage['row_count'].to_pylist(),
+                                                      coverage['loaded_at'].to_pylist()):
+            if symbol in wanted:
+                entries[symbol][date] = [row_count, loaded_at]
+        with self._lock:
+            self.entries.update(entries)
+            self.scanned.update(symbols)
+            self.built_at = datetime.datetime.now()
+        print(f"Coverage index holds {sum(len(d) for d in entries.values())} loaded symbol-dates")
+        self.save()
+
+    def dates(self, symbol):
+        with self._lock:
+            if symbol not in self.scanned:
+                raise CoverageIndexError(f"{symbol} is not in the coverage index")
+            return set(self.entries.get(symbol, {}))
+
+    def missing(self, symbols, dates, committed=None, reload=None):
+        """
+        symbol -> dates not loaded yet, for every symbol with any work left.
+        committed(symbol, loaded), when given, returns further dates to treat as
+        loaded (the load journal's, which include dates that returned no rows),
+        and reload(symbol) dates to load again even though they have rows.
+        """
+        work = {}
+        for symbol in symbols:
+            loaded = self.dates(symbol)
+            if committed is not None:
+                loaded |= committed(symbol, loaded)
+            if reload is not None:
+                loaded -= reload(symbol)
+            pending = [date for date in dates if date not in loaded]
+            if pending:
+                work[symbol] = pending
+        return work
+
+    def record(self, symbol, batch, merged=False):
+        """
+        Count a committed batch's rows per date, journaling them so a crash does
+        not lose them. Appended rows add to a date's count. Merged rows replace
+        the date's rows, so the first merged batch of a date in this run sets
+        its count and later batches of the same date add to it.
+        """
+        counts = batch.group_by("date").aggregate([("date", "count")])
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        lines = []
+        with self._lock:
+            symbol_entries = self.entries.setdefault(symbol, {})
+            for date, row_count in zip(pc.cast(counts['date'], pa.string()).to_pylist(),
+                                       counts['date_count'].to_pylist()):
+                entry = symbol_entries.setdefault(date, [0, now])
+                replaced = merged and (symbol, date) not in self._merged
+                if merged:
+                    self._merged.add((symbol, date))
+                entry[0] = row_count if replaced else entry[0] + row_count
+                entry[1] = now
+                lines.append(json.dumps([symbol, date, row_count, now, replaced]) + "\n")
+            if self.path:
+                with open(self.journal_path, "a") as f:
+                    f.writelines(lines)
+
+    def save(self):
+        """Write the snapshot atomically and start an empty journal."""
+        if not self.path:
+            return
+        with self._lock:
+            payload = {"source": self.source, "built_at": self.built_at.isoformat(),
+                       "scanned": sorted(self.scanned), "symbols": self.entries}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+
+def open_coverage_index(config, storage, symbols, rebuild=False):
+    """
+    The cached index when it matches this warehouse and is fresh enough,
+    scanning only symbols it has not seen; otherwise a full rebuild. Replay
+    and --rebuild always rescan, since the tables may have been dropped or
+    rebuilt since the index was cached. Raises CoverageIndexError if the warehouse cannot be scanned.
+    """
+    path = config.get("coverage_index_path", DEFAULT_COVERAGE_INDEX_PATH)
+    if config.get("storage_backend") == "memory":
+        # An in-memory warehouse starts empty every run; a cached index would be wrong
+        path = None
+    index = CoverageIndex(path, coverage_source(config))
+    max_age = config.get("coverage_index_max_age_hours", DEFAULT_COVERAGE_MAX_AGE_HOURS)
+    rebuild = rebuild or config.get("rebuild") or config.get("offline")
+    if not rebuild and index.load():
+        if max_age is None or index.age_hours() <= max_age:
+            unseen = [symbol for symbol in symbols if symbol not in index.scanned]
+            if unseen:
+                index.build(storage, unseen)
+            print(f"Using coverage index from {index.path} ({index.age_hours():.1f}h old)")
+            return index
+        print(f"Coverage index is {index.age_hours():.1f}h old, rebuilding")
+    index = CoverageIndex(index.path, index.source)
+    index.build(storage, symbols)
+    return index
@@ -0,0 +1,185 @@
+"""
+Compact per-(symbol, date) summary table maintained after each load.
+
+analytics.daily_metrics holds one row per symbol and date with the
+dislocation metrics (ATM IV, skew, term slope, volume / OI, delta-adjusted
+volume, ...), excess volume against the trailing history, and percentile
+ranks of the key metrics within each symbol's trailing year. Dashboards and
+the screener read this table instead of the raw chains: a whole-universe
+ranking for one date touches one date partition of ~500 rows.
+
+Dates that are loaded but not yet summarized are computed, and so are dates
+the loader has just (re)written, replacing their rows. Later dates whose
+excess volume and ranks look back over a recomputed date are recomputed with
+it; the rest of the trailing history is read back from the summary table.
+
+    python -m utilities.daily_aggregates
+"""
+import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.dislocation_metrics import CHAIN_COLUMNS, add_excess_volume, compute_dislocation_metrics
+from utilities.storage import register_table_layout
+
+DAILY_METRICS_TABLE = "analytics.daily_metrics"
+PERCENTILE_WINDOW = 252  # trading days of history each date is ranked against
+EXCESS_VOLUME_WINDOW = 20
+MIN_HISTORY = 5
+SUMMARY_KEYS = ("symbol", "date")
+RANKED_METRICS = ['atm_iv_short', 'skew_25d', 'term_structure_slope', 'volume_oi_ratio',
+                  'delta_adjusted_volume', 'total_volume']
+# Calendar days to read back so the trailing window is covered
+_HISTORY_LOOKBACK_DAYS = PERCENTILE_WINDOW * 7 // 5 + 10
+
+_METRICS_SCHEMA = add_excess_volume(compute_dislocation_metrics(pa.table({
+    'symbol': pa.array([], pa.string()),
+    'date': pa.array([], pa.date32()),
+    'expiration': pa.array([], pa.date32()),
+    'type': pa.array([], pa.string()),
+    'strike': pa.array([], pa.float64()),
+    'volume': pa.array([], pa.int64()),
+    'open_interest': pa.array([], pa.int64()),
+    'delta': pa.array([], pa.float64()),
+    'implied_volatility': pa.array([], pa.float64()),
+}))).schema
+DAILY_METRICS_SCHEMA = pa.schema(list(_METRICS_SCHEMA)
+                                 + [(f"{name}_pct", pa.float64()) for name in RANKED_METRICS])
+
+# One partition per date: a cross-sectional screen reads a single small partition
+register_table_layout(DAILY_METRICS_TABLE, DAILY_METRICS_SCHEMA, partition_by=("date",),
+                      cluster_by=("symbol",))
+
+
+def trailing_percentile(values, new_mask, window=PERCENTILE_WINDOW, min_history=MIN_HISTORY):
+    """
+    For each position in new_mask, the fraction of the previous `window`
+    finite values that are <= the current one. values are one symbol's
+    history in date order.
+    """
+    ranks = np.full(len(values), np.nan)
+    for i in np.flatnonzero(new_mask):
+        if not np.isfinite(values[i]):
+            continue
+        history = values[max(0, i - window):i]
+        history = history[np.isfinite(history)]
+        if history.size >= min_history:
+            ranks[i] = np.count_nonzero(history <= values[i]) / history.size
+    return ranks
+
+
+def summarize(chain, history=None):
+    """
+    Summary rows for every (symbol, date) in chain. history is a Table of
+    earlier summary rows for the same symbols, used for excess volume and
+    percentile ranks; only the rows for chain's dates are returned.
+    """
+    metrics = compute_dislocation_metrics(chain)
+    if metrics.num_rows == 0:
+        return DAILY_METRICS_SCHEMA.empty_table()
+    new_keys = set(zip(metrics['symbol'].to_pylist(), metrics['date'].to_pylist()))
+    if history is not None and history.num_rows:
+        history = history.select(metrics.column_names).cast(metrics.schema)
+        combined = pa.concat_tables([history, metrics])
+    else:
+        combined = metrics
+    combined = add_excess_volume(combined, window=EXCESS_VOLUME_WINDOW, min_periods=MIN_HISTORY)
+
+    symbols = combined['symbol'].to_pylist()
+    is_new = np.array([key in new_keys for key in zip(symbols, combined['date'].to_pylist())])
+    codes = np.unique(np.array(symbols, dtype=object), return_inverse=True)[1]
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(codes)]))
+    for name in RANKED_METRICS:
+        values = pc.cast(combined[name], pa.float64()).to_numpy(zero_copy_only=False)
+        ranks = np.full(len(values), np.nan)
+        for start, end in zip(starts, ends):
+            ranks[start:end] = trailing_percentile(values[start:end], is_new[start:end])
+        combined = combined.append_column(f"{name}_pct", pa.array(ranks, from_pandas=True))
+    return combined.filter(pa.array(is_new)).cast(DAILY_METRICS_SCHEMA)
+
+
+def affected_dates(loaded, changed, window=PERCENTILE_WINDOW):
+    """changed plus the loaded dates whose trailing window of `window` dates reaches back over one of them."""
+    ordered = sorted(loaded)
+    position = {date: i for i, date in enumerate(ordered)}
+    affected = set()
+    for date in changed:
+        if date in position:
+            affected.update(ordered[position[date]:position[date] + window + 1])
+    return affected
+
+
+def materialize_symbol(storage, symbol, table_id=None, dates=()):
+    """
+    Summarize the dates that are loaded for symbol but not yet in the
+    summary table, plus dates (those just written), replacing their rows,
+    and the later dates ranked against them. Returns the number of summary
+    rows written.
+    """
+    table_id = table_id or storage.options_table_id(symbol)
+    storage.ensure_table(DAILY_METRICS_TABLE)
+    loaded = storage.existing_dates(symbol, table_id)
+    summarized = storage.existing_dates(symbol, DAILY_METRICS_TABLE)
+    pending = sorted(affected_dates(loaded, (loaded - summarized) | (set(dates) & loaded)))
+    if not pending:
+        return 0
+    chain = storage.read_table(table_id, symbol=symbol, start=pending[0], end=pending[-1], columns=CHAIN_COLUMNS)
+    chain = chain.filter(pc.is_in(chain['date'].cast(pa.string()), pa.array(pending)))
+    history_start = (datetime.date.fromisoformat(pending[0]) - datetime.timedelta(days=_HISTORY_LOOKBACK_DAYS))
+    history = storage.read_table(DAILY_METRICS_TABLE, symbol=symbol, start=history_start.isoformat(),
+                                 end=pending[-1])
+    # Stale rows of the dates being recomputed must not count as their history
+    history = history.filter(pc.invert(pc.is_in(history['date'].cast(pa.string()), pa.array(pending))))
+    summary = summarize(chain, history)
+    if summary.num_rows == 0:
+        return 0
+    replaced = summarized.intersection(pending)
+    if replaced:
+        written = storage.merge_batch(summary, DAILY_METRICS_TABLE, keys=SUMMARY_KEYS)
+    else:
+        written = storage.write_batch(summary, DAILY_METRICS_TABLE)
+    print(f"Summarized {written} dates for {symbol} ({len(replaced)} of them recomputed)")
+    return written
+
+
+def read_daily_metrics(storage, date=None, symbol=None, start=None, end=None, columns=None):
+    """Rows of the summary table for one date (screener) or one symbol's history."""
+    if date is not None:
+        start = end = date
+    return storage.read_table(DAILY_METRICS_TABLE, symbol=symbol, start=start, end=end, columns=columns)
+
+
+def screen(storage, date, metric="excess_volume_z", top=25, ascending=False):
+    """The top symbols on date ranked by metric, read from the summary table only."""
+    table = read_daily_metrics(storage, date=date)
+    table = table.filter(pc.is_valid(table[metric])).filter(pc.is_finite(table[metric]))
+    order = "ascending" if ascending else "descending"
+    return table.sort_by([(metric, order)]).slice(0, top)
+
+
+def main(config=None, symbols=None, storage=None):
+    """Bring the summary table up to date for every symbol."""
+    import pandas as pd
+    from utilities.load_historical_options_data import get_config
+    from utilities.storage import get_storage
+
+    config = dict(config) if config is not None else get_config()
+    if symbols is None:
+        symbols = pd.read_csv("org_files/S&P 500 Constituents.csv")['Symbol'].tolist()
+    storage = storage or get_storage(config)
+    total = 0
+    for symbol in symbols:
+        try:
+            total += materialize_symbol(storage, symbol)
+        except Exception as e:
+            print(f"Failed to summarize {symbol}: {e}")
+    print(f"Summarized {total} new symbol-dates")
+    return total
+
+
+if __name__ == "__main__":
+    main()
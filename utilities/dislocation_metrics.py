@@ -0,0 +1,279 @@
+"""
+Vectorized volatility dislocation metrics over stored option chains.
+
+All metrics are computed per (symbol, date) with NumPy group reductions
+(np.bincount over a dense group index), so a whole day of the S&P 500
+universe is processed in one pass without any per-row Python or pandas apply.
+The group reductions are additive sums (dislocation_sums) turned into metrics
+by metrics_from_sums, so live chains can update them from changed contracts.
+
+Metrics (see README "Analyze"):
+- total/call/put volume and open interest, volume / open interest
+- call / put volume ratio and the share of volume in short-dated options
+- ATM implied vol for short and long tenors and their difference (term structure)
+- 25-delta put minus 25-delta call implied vol (skew)
+- delta-adjusted volume (shares-equivalent) and net delta volume
+- normalized and excess volume against each symbol's trailing history
+  (add_excess_volume)
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.option_chain import compact_table
+
+CONTRACT_MULTIPLIER = 100
+SHORT_DATED_DAYS = 14  # "short-dated" activity: expiring within two weeks
+ATM_DELTA = (0.4, 0.6)  # |delta| band treated as at-the-money
+WING_DELTA = (0.2, 0.3)  # |delta| band treated as 25-delta
+# Band edges are widened by this much: above float32 rounding (compact chains), below the API's 1e-5 resolution
+DELTA_TOLERANCE = 1e-6
+SHORT_TENOR_DAYS = (7, 45)
+LONG_TENOR_DAYS = (60, 180)
+SKEW_TENOR_DAYS = (7, 90)
+
+CHAIN_COLUMNS = ['symbol', 'date', 'expiration', 'type', 'strike', 'volume',
+                 'open_interest', 'delta', 'implied_volatility']
+
+
+def _days(array):
+    """date32 arrow array -> int64 days since epoch (nulls become -1)."""
+    return pc.fill_null(array.cast(pa.int32()), -1).to_numpy().astype(np.int64)
+
+
+def _floats(array):
+    return pc.cast(array, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _chain_arrays(chain):
+    """Extract the NumPy arrays the metrics need from a pyarrow Table."""
+    chain = chain.combine_chunks()
+    symbols = chain['symbol'].combine_chunks().dictionary_encode()
+    return {
+        'symbol_codes': symbols.indices.to_numpy(zero_copy_only=False).astype(np.int64),
+        'symbol_names': symbols.dictionary,
+        'date': _days(chain['date']),
+        'expiration': _days(chain['expiration']),
+        'is_call': pc.fill_null(pc.equal(chain['type'], 'call'), False).to_numpy(zero_copy_only=False),
+        'is_put': pc.fill_null(pc.equal(chain['type'], 'put'), False).to_numpy(zero_copy_only=False),
+        'volume': np.nan_to_num(_floats(chain['volume'])),
+        'open_interest': np.nan_to_num(_floats(chain['open_interest'])),
+        'delta': _floats(chain['delta']),
+        'iv': _floats(chain['implied_volatility']),
+    }
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), np.nan)
+
+
+def _mean(sums, counts):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+# Additive per-(symbol, date) sums every metric is derived from. Sums over
+# disjoint sets of contracts add up, so a chain's metrics can be kept current
+# by adding the sums of changed contracts and subtracting their old versions.
+SUM_COLUMNS = ['contracts', 'total_volume', 'total_open_interest', 'call_volume', 'put_volume', 'short_volume',
+               'atm_short_iv_sum', 'atm_short_count', 'atm_long_iv_sum', 'atm_long_count',
+               'put_25d_iv_sum', 'put_25d_count', 'call_25d_iv_sum', 'call_25d_count',
+               'delta_adjusted_volume', 'net_delta_volume']
+
+
+def dislocation_sums(chain):
+    """
+    The SUM_COLUMNS (as float64) per (symbol, date) of a chain Table with at
+    least CHAIN_COLUMNS, one row per (symbol, date) sorted by both.
+    """
+    if chain.num_rows == 0:
+        return pa.table({'symbol': pa.array([], pa.string()), 'date': pa.array([], pa.date32()),
+                         **{name: pa.array([], pa.float64()) for name in SUM_COLUMNS}})
+    a = _chain_arrays(chain)
+
+    # Dense group id per (symbol, date)
+    key = a['symbol_codes'] << 32 | (a['date'] & 0xFFFFFFFF)
+    unique_keys, group = np.unique(key, return_inverse=True)
+    n = len(unique_keys)
+
+    volume, oi, delta, iv = a['volume'], a['open_interest'], a['delta'], a['iv']
+    is_call, is_put = a['is_call'], a['is_put']
+    dte = a['expiration'] - a['date']
+    abs_delta = np.abs(delta)
+    has_iv = np.isfinite(iv) & (iv > 0)
+    has_delta = np.isfinite(delta)
+
+    def total(weights, mask=None):
+        if mask is None:
+            return np.bincount(group, weights=weights, minlength=n)
+        return np.bincount(group[mask], weights=weights[mask], minlength=n)
+
+    def count(mask):
+        return np.bincount(group[mask], minlength=n).astype(np.float64)
+
+    def band(values, low, high):
+        # float32 deltas of compact chains land a few 1e-8 off edges like 0.3
+        return has_delta & (values >= low - DELTA_TOLERANCE) & (values <= high + DELTA_TOLERANCE)
+
+    atm = has_iv & band(abs_delta, *ATM_DELTA)
+    atm_short = atm & (dte >= SHORT_TENOR_DAYS[0]) & (dte <= SHORT_TENOR_DAYS[1])
+    atm_long = atm & (dte >= LONG_TENOR_DAYS[0]) & (dte <= LONG_TENOR_DAYS[1])
+    wing = has_iv & band(abs_delta, *WING_DELTA) & (dte >= SKEW_TENOR_DAYS[0]) & (dte <= SKEW_TENOR_DAYS[1])
+    delta_clean = np.where(has_delta, delta, 0.0)
+
+    symbol_codes = (unique_keys >> 32).astype(np.int64)
+    dates = (unique_keys & 0xFFFFFFFF).astype(np.int32)
+    return pa.table({
+        'symbol': a['symbol_names'].take(pa.array(symbol_codes)),
+        'date': pa.array(dates, type=pa.int32()).cast(pa.date32()),
+        'contracts': np.bincount(group, minlength=n).astype(np.float64),
+        'total_volume': total(volume),
+        'total_open_interest': total(oi),
+        'call_volume': total(volume, is_call),
+        'put_volume': total(volume, is_put),
+        'short_volume': total(volume, (dte >= 0) & (dte <= SHORT_DATED_DAYS)),
+        'atm_short_iv_sum': total(iv, atm_short),
+        'atm_short_count': count(atm_short),
+        'atm_long_iv_sum': total(iv, atm_long),
+        'atm_long_count': count(atm_long),
+        'put_25d_iv_sum': total(iv, wing & is_put),
+        'put_25d_count': count(wing & is_put),
+        'call_25d_iv_sum': total(iv, wing & is_call),
+        'call_25d_count': count(wing & is_call),
+        'delta_adjusted_volume': total(volume * np.abs(delta_clean) * CONTRACT_MULTIPLIER),
+        'net_delta_volume': total(volume * delta_clean * CONTRACT_MULTIPLIER),
+    })
+
+
+def metrics_from_sums(sums):
+    """Dislocation metrics from a dislocation_sums Table, one row per (symbol, date)."""
+    s = {name: pc.cast(sums[name], pa.float64()).to_numpy(zero_copy_only=False) for name in SUM_COLUMNS}
+    total_volume, total_oi = s['total_volume'], s['total_open_interest']
+    call_volume, put_volume = s['call_volume'], s['put_volume']
+    atm_iv_short = _mean(s['atm_short_iv_sum'], s['atm_short_count'])
+    atm_iv_long = _mean(s['atm_long_iv_sum'], s['atm_long_count'])
+    put_25d_iv = _mean(s['put_25d_iv_sum'], s['put_25d_count'])
+    call_25d_iv = _mean(s['call_25d_iv_sum'], s['call_25d_count'])
+    return pa.table({
+        'symbol': sums['symbol'],
+        'date': sums['date'],
+        'contracts': s['contracts'].astype(np.int64),
+        'total_volume': total_volume.astype(np.int64),
+        'total_open_interest': total_oi.astype(np.int64),
+        'call_volume': call_volume.astype(np.int64),
+        'put_volume': put_volume.astype(np.int64),
+        'volume_oi_ratio': _ratio(total_volume, total_oi),
+        'call_put_volume_ratio': _ratio(call_volume, put_volume),
+        'short_dated_volume_share': _ratio(s['short_volume'], total_volume),
+        'atm_iv_short': atm_iv_short,
+        'atm_iv_long': atm_iv_long,
+        'term_structure_slope': atm_iv_short - atm_iv_long,
+        'put_25d_iv': put_25d_iv,
+        'call_25d_iv': call_25d_iv,
+        'skew_25d': put_25d_iv - call_25d_iv,
+        'delta_adjusted_volume': s['delta_adjusted_volume'],
+        'net_delta_volume': s['net_delta_volume'],
+    }).sort_by([('symbol', 'ascending'), ('date', 'ascending')])
+
+
+def compute_dislocation_metrics(chain):
+    """
+    Compute the per-(symbol, date) dislocation metrics for a chain Table with
+    at least CHAIN_COLUMNS (any number of symbols and dates).
+    Returns a pyarrow Table with one row per (symbol, date), sorted by both.
+    """
+    if chain.num_rows == 0:
+        return _empty_metrics()
+    return metrics_from_sums(dislocation_sums(chain))
+
+
+def _empty_metrics():
+    return compute_dislocation_metrics(pa.table({
+        'symbol': pa.array(['_'], pa.string()),
+        'date': pa.array([0], pa.int32()).cast(pa.date32()),
+        'expiration': pa.array([0], pa.int32()).cast(pa.date32()),
+        'type': pa.array(['call']),
+        'strike': pa.array([0.0]),
+        'volume': pa.array([0], pa.int64()),
+        'open_interest': pa.array([0], pa.int64()),
+        'delta': pa.array([0.0]),
+        'implied_volatility': pa.array([0.0]),
+    })).slice(0, 0)
+
+
+def _rolling_group_stats(values, group_start, window):
+    """
+    Trailing mean and standard deviation over the previous `window` rows of the
+    same group (excluding the current row), using cumulative sums.
+    Rows must be sorted by group; group_start[i] is the index of the first row
+    of row i's group.
+    """
+    n = len(values)
+    idx = np.arange(n)
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    csq = np.concatenate(([0.0], np.cumsum(values * values)))
+    start = np.maximum(idx - window, group_start)
+    count = idx - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (csum[idx] - csum[start]) / count
+        var = (csq[idx] - csq[start]) / count - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    mean[count == 0] = np.nan
+    std[count < 2] = np.nan
+    return mean, std, count
+
+
+def add_excess_volume(metrics, window=20, min_periods=5):
+    """
+    Add normalized_volume (volume / trailing mean) and excess_volume_z
+    ((volume - trailing mean) / trailing std) to a metrics table holding a
+    history of dates per symbol. The trailing window excludes the current date.
+    """
+    metrics = metrics.sort_by([('symbol', 'ascending'), ('date', 'ascending')]).combine_chunks()
+    if metrics.num_rows == 0:
+        return metrics.append_column('normalized_volume', pa.array([], pa.float64())) \
+                      .append_column('excess_volume_z', pa.array([], pa.float64()))
+    codes = metrics['symbol'].dictionary_encode().combine_chunks().indices.to_numpy().astype(np.int64)
+    new_group = np.concatenate(([True], codes[1:] != codes[:-1]))
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(codes)), 0))
+
+    volume = metrics['total_volume'].to_numpy().astype(np.float64)
+    mean, std, count = _rolling_group_stats(volume, group_start, window)
+    enough = count >= min_periods
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normalized = np.where(enough & (mean > 0), volume / mean, np.nan)
+        excess_z = np.where(enough & (std > 0), (volume - mean) / std, np.nan)
+    return metrics.append_column('normalized_volume', pa.array(normalized)) \
+                  .append_column('excess_volume_z', pa.array(excess_z))
+
+
+def load_universe_chains(storage, symbols, start, end=None, table_id_fn=None):
+    """
+    Read the chain columns needed for the metrics for every symbol over
+    [start, end], in compact form (utilities.option_chain) so several days
+    of the whole universe fit in memory.
+    """
+    if table_id_fn is None and storage.consolidated_table:
+        # One date-pruned scan of the consolidated table instead of a read per symbol
+        table = storage.read_table(storage.consolidated_table, start=start, end=end or start, columns=CHAIN_COLUMNS)
+        table = table.filter(pc.is_in(table['symbol'], pa.array(list(symbols), pa.string())))
+        return compact_table(table) if table.num_rows else None
+    table_id_fn = table_id_fn or storage.options_table_id
+    tables = []
+    for symbol in symbols:
+        table = storage.read_table(table_id_fn(symbol), symbol=symbol, start=start,
+                                   end=end or start, columns=CHAIN_COLUMNS)
+        if table.num_rows:
+            tables.append(compact_table(table))
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
+
+
+def compute_universe_metrics(storage, symbols, start, end=None, table_id_fn=None):
+    """Dislocation metrics for every (symbol, date) in [start, end] across the universe."""
+    chains = load_universe_chains(storage, symbols, start, end, table_id_fn)
+    if chains is None:
+        return _empty_metrics()
+    return compute_dislocation_metrics(chains)
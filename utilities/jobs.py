@@ -0,0 +1,194 @@
+"""
+In-process registry for loader jobs started from the Flask app.
+
+Only one job runs at a time (single-flight); the others are rejected with a
+reference to the running one. Each job exposes live progress and can be
+cancelled cooperatively: the loader checks job.cancelled between API calls.
+Per-symbol state is written to a JSON file so a restarted container can skip
+symbols that were already completed.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+DEFAULT_JOB_STATE_PATH = ".cache/job_state.json"
+
+
+class JobStateStore:
+    """Per-symbol progress persisted as one JSON document, rewritten atomically."""
+
+    def __init__(self, path=DEFAULT_JOB_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.symbols = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.symbols = json.load(f).get("symbols", {})
+            except (OSError, ValueError) as e:
+                print(f"Could not read job state from {path}: {e}")
+
+    def get(self, symbol):
+        with self._lock:
+            return dict(self.symbols.get(symbol, {}))
+
+    def update(self, symbol, **fields):
+        with self._lock:
+            state = self.symbols.setdefault(symbol, {})
+            state.update(fields, updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            self._save()
+
+    def completed_through(self, symbol):
+        """Last date_end for which symbol finished successfully, or None."""
+        state = self.get(symbol)
+        return state.get("completed_through") if state.get("status") == "done" else None
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"symbols": self.symbols}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Job:
+    def __init__(self, name, state_store=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.state_store = state_store
+        self.symbols_total = 0
+        self.symbols_done = 0
+        self.symbols_skipped = 0
+        self.rows = 0
+        self.current_symbols = set()
+        self.rate_limiter = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def set_total(self, symbols_total, rate_limiter=None):
+        self.symbols_total = symbols_total
+        self.rate_limiter = rate_limiter
+
+    def symbol_started(self, symbol):
+        with self._lock:
+            self.current_symbols.add(symbol)
+        if self.state_store is not None:
+            self.state_store.update(symbol, status="running", job_id=self.id)
+
+    def symbol_finished(self, symbol, rows, status="done", completed_through=None):
+        with self._lock:
+            self.current_symbols.discard(symbol)
+            self.symbols_done += 1
+        if self.state_store is not None:
+            fields = {"status": status, "rows": rows, "job_id": self.id}
+            if completed_through is not None:
+                fields["completed_through"] = completed_through
+            self.state_store.update(symbol, **fields)
+
+    def symbol_skipped(self, symbol):
+        with self._lock:
+            self.symbols_done += 1
+            self.symbols_skipped += 1
+
+    def add_rows(self, rows):
+        with self._lock:
+            self.rows += rows
+
+    def to_dict(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        worked = self.symbols_done - self.symbols_skipped
+        remaining = self.symbols_total - self.symbols_done
+        eta = None
+        if self.status == "running" and worked > 0:
+            eta = remaining * elapsed / worked
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "cancel_requested": self.cancelled,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed_seconds": round(elapsed, 1),
+            "symbols_total": self.symbols_total,
+            "symbols_done": self.symbols_done,
+            "symbols_skipped": self.symbols_skipped,
+            "current_symbols": sorted(self.current_symbols),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else 0.0,
+            "api_calls": self.rate_limiter.total_acquired if self.rate_limiter else 0,
+            "api_calls_per_minute": round(self.rate_limiter.observed_calls_per_minute(), 1) if self.rate_limiter else 0.0,
+            "eta_seconds": round(eta) if eta is not None else None,
+        }
+
+
+class JobManager:
+    """Runs at most one job at a time in a background thread and keeps the job history."""
+
+    def __init__(self, state_path=DEFAULT_JOB_STATE_PATH, max_history=50):
+        self.state_store = JobStateStore(state_path)
+        self.max_history = max_history
+        self.jobs = {}
+        self.active = None
+        self._lock = threading.Lock()
+
+    def start(self, name, target):
+        """
+        Start target(job) in a background thread unless a job is already running.
+        Returns (job, created): the new job, or the running one with created=False.
+        """
+        with self._lock:
+            if self.active is not None and self.active.status in ("queued", "running"):
+                return self.active, False
+            job = Job(name, self.state_store)
+            self.jobs[job.id] = job
+            self.active = job
+            self._trim_history()
+        thread = threading.Thread(target=self._run, args=(job, target), name=f"job-{job.id}", daemon=True)
+        thread.start()
+        return job, True
+
+    def _run(self, job, target):
+        job.status = "running"
+        job.started = time.time()
+        print(f"[Job {job.id}] {job.name} started.", flush=True)
+        try:
+            target(job)
+            job.status = "cancelled" if job.cancelled else "succeeded"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            job.finished = time.time()
+            print(f"[Job {job.id}] {job.name} finished with status {job.status}.", flush=True)
+
+    def _trim_history(self):
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for job in sorted(finished, key=lambda j: j.created)[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        return sorted(self.jobs.values(), key=lambda j: j.created, reverse=True)
@@ -0,0 +1,288 @@
+"""
+Intraday polling of REALTIME_OPTIONS that stores only what changed.
+
+The last snapshot of every watched chain is kept in memory. Each poll is
+compared with it by contractID, and only contracts that are new or whose
+quote, volume, open interest or IV moved are appended to live.option_quotes
+(with the poll time in snapshot_at). The dislocation metrics of each chain
+are kept as running sums (dislocation_sums), updated by adding the changed
+contracts and subtracting the versions they replace, and a row is appended
+to analytics.live_metrics only for symbols whose chain changed. Storage and
+load volume therefore follow market activity, not poll frequency.
+
+analytics.daily_metrics is left to the end-of-day loader: it holds settled
+summaries ranked against history, so the intraday running values go to
+analytics.live_metrics instead, where the latest row of a symbol is its
+value so far today.
+
+The first poll of a day (or after a restart) stores every contract once, as
+the baseline the later deltas apply to.
+
+    python -m utilities.live_snapshot            # poll until the close
+    python -m utilities.live_snapshot --polls 3
+"""
+import argparse
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import requests
+
+from utilities.columnar import OPTIONS_SCHEMA, parse_options_rows
+from utilities.daily_aggregates import (DAILY_METRICS_SCHEMA, EXCESS_VOLUME_WINDOW, MIN_HISTORY,
+                                        read_daily_metrics)
+from utilities.dislocation_metrics import SUM_COLUMNS, add_excess_volume, dislocation_sums, metrics_from_sums
+from utilities.metrics import METRICS
+from utilities.storage import dedupe_batch, register_table_layout
+from utilities.trading_calendar import is_trading_day
+
+LIVE_QUOTES_TABLE = "live.option_quotes"
+LIVE_METRICS_TABLE = "analytics.live_metrics"
+DEFAULT_POLL_SECONDS = 60
+# A contract is stored again when any of these differ from its last stored version
+TRACKED_COLUMNS = ['last', 'mark', 'bid', 'ask', 'bid_size', 'ask_size', 'volume', 'open_interest',
+                   'implied_volatility']
+NEW_YORK = ZoneInfo("America/New_York")
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(16, 0)
+
+LIVE_QUOTES_SCHEMA = OPTIONS_SCHEMA.append(pa.field('snapshot_at', pa.timestamp('us', tz='UTC')))
+LIVE_METRICS_SCHEMA = pa.schema([field for field in DAILY_METRICS_SCHEMA if not field.name.endswith('_pct')]
+                                + [pa.field('snapshot_at', pa.timestamp('us', tz='UTC'))])
+_METRIC_COLUMNS = [field.name for field in LIVE_METRICS_SCHEMA if field.name != 'snapshot_at']
+
+register_table_layout(LIVE_QUOTES_TABLE, LIVE_QUOTES_SCHEMA, partition_by=("date", "symbol"),
+                      cluster_by=("symbol", "contractID"))
+register_table_layout(LIVE_METRICS_TABLE, LIVE_METRICS_SCHEMA, partition_by=("date",), cluster_by=("symbol",))
+
+
+def market_open(now=None):
+    """Whether the regular NYSE session is open at now (default: current time)."""
+    now = now or datetime.datetime.now(NEW_YORK)
+    return is_trading_day(now.date()) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def diff_snapshot(previous, current, columns=TRACKED_COLUMNS):
+    """
+    (changed, replaced): the rows of current that are new or differ from
+    previous in any of columns, and the rows of previous they replace plus
+    the contracts no longer in current. Contracts are matched by contractID.
+    """
+    current = current.combine_chunks()
+    if previous is None or previous.num_rows == 0:
+        return current, current.schema.empty_table()
+    position = pc.index_in(current['contractID'], value_set=previous['contractID'])
+    changed = pc.is_null(position)
+    aligned = previous.take(pc.fill_null(position, 0))
+    for name in columns:
+        new, old = current[name], aligned[name]
+        differs = pc.or_(pc.fill_null(pc.not_equal(new, old), False), pc.xor(pc.is_null(new), pc.is_null(old)))
+        changed = pc.or_(changed, differs)
+    gone = pc.invert(pc.is_in(previous['contractID'], value_set=current['contractID']))
+    replaced = pa.concat_tables([aligned.filter(pc.and_(changed, pc.is_valid(position))), previous.filter(gone)])
+    return current.filter(changed), replaced
+
+
+def _sum_vector(chain):
+    """SUM_COLUMNS of a one-symbol, one-date chain as a vector."""
+    sums = dislocation_sums(chain)
+    return np.array([pc.sum(sums[name]).as_py() or 0.0 for name in SUM_COLUMNS])
+
+
+class LiveChains:
+    """
+    Last snapshot and running metric sums of each watched chain for the
+    current day. diff() does not change anything; the caller commit()s a
+    symbol's update once its changed rows are stored, so a failed write is
+    diffed again on the next poll.
+    """
+
+    def __init__(self, history=None):
+        self.snapshots = {}
+        # symbol -> (date, SUM_COLUMNS vector)
+        self.sums = {}
+        # symbol -> earlier daily_metrics rows, for excess volume
+        self.history = history or {}
+
+    def diff(self, symbol, snapshot, date):
+        """(changed rows, new sums vector, or None when nothing changed) for symbol's new snapshot."""
+        previous = self.snapshots.get(symbol)
+        day, vector = self.sums.get(symbol, (None, None))
+        if day != date:
+            # New day (or first poll): the whole chain is the baseline
+            previous, vector = None, np.zeros(len(SUM_COLUMNS))
+        changed, replaced = diff_snapshot(previous, snapshot)
+        if changed.num_rows == 0 and replaced.num_rows == 0:
+            return changed, None
+        return changed, vector + _sum_vector(changed) - _sum_vector(replaced)
+
+    def commit(self, symbol, snapshot, date, vector):
+        self.snapshots[symbol] = snapshot
+        if vector is not None:
+            self.sums[symbol] = (date, vector)
+
+    def metrics(self, symbol, date, vector):
+        """The live metrics row for symbol, with excess volume against its daily history."""
+        sums = pa.table({'symbol': pa.array([symbol]), 'date': pa.array([date]).cast(pa.date32()),
+                         **{name: pa.array([value]) for name, value in zip(SUM_COLUMNS, vector)}})
+        metrics = metrics_from_sums(sums)
+        history = self.history.get(symbol)
+        if history is not None and history.num_rows:
+            metrics = pa.concat_tables([history.select(metrics.column_names).cast(metrics.schema), metrics])
+        metrics = add_excess_volume(metrics, window=EXCESS_VOLUME_WINDOW, min_periods=MIN_HISTORY)
+        return metrics.slice(metrics.num_rows - 1).select(_METRIC_COLUMNS)
+
+
+def load_history(storage, symbols, date):
+    """symbol -> daily_metrics rows of the trading weeks before date (empty if unreadable)."""
+    start = (datetime.date.fromisoformat(date) - datetime.timedelta(days=EXCESS_VOLUME_WINDOW * 2)).isoformat()
+    end = (datetime.date.fromisoformat(date) - datetime.timedelta(days=1)).isoformat()
+    try:
+        table = read_daily_metrics(storage, start=start, end=end)
+    except Exception as e:
+        print(f"Could not read daily metrics history, live excess volume unavailable: {e}")
+        return {}
+    history = {}
+    for symbol in symbols:
+        rows = table.filter(pc.equal(table['symbol'], symbol))
+        if rows.num_rows:
+            history[symbol] = rows
+    return history
+
+
+def fetch_realtime_chain(session, symbol, date, api_key, base_url):
+    """One REALTIME_OPTIONS snapshot as an OPTIONS_SCHEMA Table, or None if none could be fetched."""
+    from utilities.load_historical_options_data import API_MESSAGE_KEYS
+
+    url = f"{base_url}?function=REALTIME_OPTIONS&symbol={symbol}&require_greeks=true&apikey={api_key}"
+    try:
+        with METRICS.timer("fetch"):
+            response = session.get(url)
+        if response.status_code != 200:
+            METRICS.inc("http_errors")
+            print(f"Error: Unable to fetch realtime options for {symbol}. Status code: {response.status_code}")
+            return None
+        payload = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Realtime options request for {symbol} failed: {e}")
+        return None
+    for key in API_MESSAGE_KEYS:
+        if key in payload:
+            METRICS.inc("api_messages")
+            print(f"API message for {symbol}: {payload[key]}")
+            return None
+    if not payload.get("data"):
+        # An empty chain is treated as unavailable, not as every contract disappearing
+        return None
+    with METRICS.timer("parse"):
+        # Snapshots are diffed by contractID, so each contract must appear once
+        return dedupe_batch(parse_options_rows(payload["data"], symbol, date))
+
+
+def poll_once(chains, symbols, storage, fetch, date, snapshot_at, max_workers=4):
+    """
+    Fetch every symbol's snapshot, store the changed contracts and the
+    updated metrics rows, and commit the new snapshots. Returns poll stats.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        snapshots = dict(zip(symbols, executor.map(fetch, symbols)))
+    stamp = pa.scalar(snapshot_at, LIVE_QUOTES_SCHEMA.field('snapshot_at').type)
+    updates, deltas, metric_rows = {}, [], []
+    contracts = 0
+    with METRICS.timer("transform"):
+        for symbol, snapshot in snapshots.items():
+            if snapshot is None or snapshot.num_rows == 0:
+                continue
+            contracts += snapshot.num_rows
+            changed, vector = chains.diff(symbol, snapshot, date)
+            updates[symbol] = (snapshot, vector)
+            if changed.num_rows:
+                deltas.append(changed.append_column('snapshot_at', pa.array([stamp.as_py()] * changed.num_rows,
+                                                                            stamp.type)))
+            if vector is not None:
+                metric_rows.append(chains.metrics(symbol, date, vector))
+    stats = {"symbols": len(updates), "contracts": contracts, "changed": sum(t.num_rows for t in deltas),
+             "metric_rows": 0}
+    if deltas:
+        delta_rows = pa.concat_tables(deltas)
+        if storage.write_batch(delta_rows, LIVE_QUOTES_TABLE) == 0:
+            print(f"Writing {delta_rows.num_rows} changed contracts failed; they will be diffed again next poll")
+            return dict(stats, changed=0)
+    for symbol, (snapshot, vector) in updates.items():
+        chains.commit(symbol, snapshot, date, vector)
+    if metric_rows:
+        metrics = pa.concat_tables(metric_rows)
+        metrics = metrics.append_column('snapshot_at', pa.array([stamp.as_py()] * metrics.num_rows, stamp.type))
+        stats["metric_rows"] = storage.write_batch(metrics.cast(LIVE_METRICS_SCHEMA), LIVE_METRICS_TABLE)
+    return stats
+
+
+def main(config=None, symbols=None, storage=None, api_key=None, polls=None):
+    """
+    Poll the live_symbols watchlist (default: the S&P 500 constituents) every
+    live_poll_seconds until the market closes, or for `polls` polls.
+    Returns the totals over all polls.
+    """
+    import pandas as pd
+    from utilities.cred_retrieval import get_secret
+    from utilities.load_historical_options_data import (ALPHA_VANTAGE_URL, DEFAULT_CALLS_PER_MINUTE, DEFAULT_MAX_WORKERS,
+                                                        create_session_with_retries, get_config)
+    from utilities.rate_limiter import TokenBucket
+    from utilities.storage import get_storage
+
+    config = dict(config) if config is not None else get_config()
+    if symbols is None:
+        symbols = config.get("live_symbols") or pd.read_csv("org_files/S&P 500 Constituents.csv")['Symbol'].tolist()
+    storage = storage or get_storage(config)
+    api_key = api_key or get_secret("alpha_vantage_api_key")
+    base_url = config.get("alpha_vantage_url", ALPHA_VANTAGE_URL)
+    poll_seconds = config.get("live_poll_seconds", DEFAULT_POLL_SECONDS)
+    rate_limiter = TokenBucket(config.get("api_calls_per_minute", DEFAULT_CALLS_PER_MINUTE))
+    session = create_session_with_retries()
+    storage.ensure_table(LIVE_QUOTES_TABLE)
+    storage.ensure_table(LIVE_METRICS_TABLE)
+
+    today = datetime.datetime.now(NEW_YORK).date().isoformat()
+    chains = LiveChains(load_history(storage, symbols, today))
+    totals = {"polls": 0, "contracts": 0, "changed": 0, "metric_rows": 0}
+    print(f"Polling {len(symbols)} chains every {poll_seconds}s at up to {rate_limiter.calls_per_minute} calls/minute")
+    while polls is None or totals["polls"] < polls:
+        now = datetime.datetime.now(NEW_YORK)
+        if polls is None and not market_open(now):
+            if not is_trading_day(now.date()) or now.time() >= MARKET_CLOSE:
+                print("Market closed, stopping")
+                break
+            time.sleep(min(poll_seconds, 60))
+            continue
+        date = now.date().isoformat()
+
+        def fetch(symbol):
+            METRICS.observe("sleep", rate_limiter.acquire())
+            METRICS.inc("api_calls")
+            return fetch_realtime_chain(session, symbol, date, api_key, base_url)
+
+        started = time.monotonic()
+        stats = poll_once(chains, symbols, storage, fetch, date, datetime.datetime.now(datetime.timezone.utc),
+                          config.get("max_workers", DEFAULT_MAX_WORKERS))
+        for key in ("contracts", "changed", "metric_rows"):
+            totals[key] += stats[key]
+        totals["polls"] += 1
+        elapsed = time.monotonic() - started
+        share = stats["changed"] / stats["contracts"] if stats["contracts"] else 0.0
+        print(f"Poll {totals['polls']}: {stats['symbols']} chains, {stats['contracts']} contracts, "
+              f"{stats['changed']} changed ({share:.1%}) stored, {stats['metric_rows']} metric rows, {elapsed:.1f}s")
+        if polls is None or totals["polls"] < polls:
+            time.sleep(max(0.0, poll_seconds - elapsed))
+    print(f"Stored {totals['changed']} of {totals['contracts']} polled contracts over {totals['polls']} polls")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=None, help="stop after this many polls (default: at the close)")
+    args = parser.parse_args()
+    main(polls=args.polls)
@@ -1,70 +1,51 @@
+from utilities import resources
 from utilities.cred_retrieval import get_secret
+from utilities.rate_limiter import TokenBucket
+from utilities.metrics import METRICS
+from utilities.columnar import parse_options_rows
+from utilities.black_scholes import DEFAULT_RISK_FREE_RATE, backfill_greeks, load_spot_closes, spot_for_rows
+from utilities.daily_aggregates import materialize_symbol
+from utilities.coverage_index import CoverageIndexError, open_coverage_index
+from utilities.load_journal import get_load_journal
+from utilities.trading_calendar import (DEFAULT_LISTING_WINDOWS_PATH, DEFAULT_SETTLE_DAYS, ListingWindows,
+                                       trading_days)
+from utilities.storage import get_storage
+from utilities.response_cache import get_response_cache
+from utilities.streaming import (BatchBuffer, iter_response_tables, READ_CHUNK_BYTES, DEFAULT_CHUNK_ROWS,
+                                 DEFAULT_FLUSH_ROWS, DEFAULT_FLUSH_BYTES)
+import pyarrow as pa
 import requests
-from google.cloud import bigquery
 import time
-import pandas as pd
-import yaml
-import random
+import datetime
+import gzip
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib3.util import Retry
 from requests.adapters import HTTPAdapter
 
-def get_config():
-    print("Loading config.yaml...")
-    with open("config.yaml", "r") as f:
-        config = yaml.safe_load(f)
-    return config
+ALPHA_VANTAGE_URL = "https://www.alphavantage.co/query"
+DEFAULT_CALLS_PER_MINUTE = 75  # Alpha Vantage Pro plan quota
+DEFAULT_MAX_WORKERS = 4  # symbols fetched concurrently
+DEFAULT_SUMMARY_PATH = "data_collection_summary.json"
 
-def create_options_table_if_not_exists(table_id, project_id):
-    client = bigquery.Client(project=project_id)
-    dataset_id, table_name = table_id.split('.')
-    
-    # First ensure dataset exists
-    dataset_ref = client.dataset(dataset_id)
-    try:
-        client.get_dataset(dataset_ref)
-        print(f"Dataset {dataset_id} exists.")
-    except Exception:
-        dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
-        dataset = client.create_dataset(dataset, exists_ok=True)
-        print(f"Created dataset {dataset_id}")
-    
-    # Then create table if it doesn't exist
-    table_ref = dataset_ref.table(table_name)
-    schema = [
-        bigquery.SchemaField('contractID', 'STRING'),
-        bigquery.SchemaField('symbol', 'STRING'),
-        bigquery.SchemaField('expiration', 'DATE'),
-        bigquery.SchemaField('strike', 'FLOAT'),
-        bigquery.SchemaField('type', 'STRING'),
-        bigquery.SchemaField('last', 'FLOAT'),
-        bigquery.SchemaField('mark', 'FLOAT'),
-        bigquery.SchemaField('bid', 'FLOAT'),
-        bigquery.SchemaField('bid_size', 'INTEGER'),
-        bigquery.SchemaField('ask', 'FLOAT'),
-        bigquery.SchemaField('ask_size', 'INTEGER'),
-        bigquery.SchemaField('volume', 'INTEGER'),
-        bigquery.SchemaField('open_interest', 'INTEGER'),
-        bigquery.SchemaField('date', 'DATE'),
-        bigquery.SchemaField('implied_volatility', 'FLOAT'),
-        bigquery.SchemaField('delta', 'FLOAT'),
-        bigquery.SchemaField('gamma', 'FLOAT'),
-        bigquery.SchemaField('theta', 'FLOAT'),
-        bigquery.SchemaField('vega', 'FLOAT'),
-        bigquery.SchemaField('rho', 'FLOAT'),
-        bigquery.SchemaField('collected_date', 'DATE')
-    ]
-    table = bigquery.Table(table_ref, schema=schema)
-    table.time_partitioning = bigquery.TimePartitioning(
-        type_=bigquery.TimePartitioningType.DAY,
-        field="date"
-    )
-    table.clustering_fields = ["symbol", "expiration", "type"]
-    try:
-        client.get_table(table_ref)
-        print(f"Table {table_id} already exists.")
-    except Exception:
-        client.create_table(table)
-        print(f"Created table {table_id} with partitioning and clustering.")
+# Callbacks run as callback(symbol, dates) once a symbol's new dates are written
+_load_listeners = []
+
+def add_load_listener(callback):
+    """Call callback(symbol, dates) whenever a load finishes writing new dates for a symbol."""
+    _load_listeners.append(callback)
+
+def notify_loaded(symbol, dates):
+    for callback in list(_load_listeners):
+        try:
+            callback(symbol, dates)
+        except Exception as e:
+            print(f"Load listener failed for {symbol}: {e}")
+
+def get_config():
+    """A copy of config.yaml, parsed once per process (utilities.resources)."""
+    return dict(resources.get_config())
 
 def create_session_with_retries():
     session = requests.Session()
@@ -78,144 +59,6 @@ def create_session_with_retries():
     session.mount("http://", adapter)
     return session
 
-def push_batch_to_bq(rows, table_id, project_id):
-    """Helper function to push a batch of data to BigQuery"""
-    if not rows:
-        print("Warning: Empty batch received, skipping upload")
-        return 0
-    
-    try:
-        print(f"\nPreparing to insert {len(rows)} rows into {table_id}...")
-        
-        # Process in smaller chunks to manage memory
-        chunk_size = 1000  # Adjust this based on your memory constraints
-        total_processed = 0
-        
-        for i in range(0, len(rows), chunk_size):
-            chunk = rows[i:i + chunk_size]
-            
-            # Convert chunk to DataFrame and handle data types
-            df = pd.DataFrame(chunk)
-            
-            # Validate required columns
-            required_columns = ['symbol', 'date', 'collected_date']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                print(f"Warning: Skipping chunk due to missing columns: {missing_columns}")
-                continue
-            
-            # Convert numeric columns to appropriate types
-            float_cols = ['strike', 'last', 'mark', 'bid', 'ask', 'implied_volatility', 'delta', 'gamma', 'theta', 'vega', 'rho']
-            int_cols = ['bid_size', 'ask_size', 'volume', 'open_interest']
-            
-            for col in float_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            for col in int_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
-            
-            # Convert date columns to YYYY-MM-DD format
-            date_columns = ['expiration', 'date', 'collected_date']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d')
-            
-            # Remove rows with missing critical data
-            critical_cols = ['symbol', 'date', 'strike', 'type']
-            initial_rows = len(df)
-            df = df.dropna(subset=critical_cols)
-            dropped_rows = initial_rows - len(df)
-            
-            if dropped_rows > 0:
-                print(f"Warning: Dropped {dropped_rows} rows with missing critical data in current chunk")
-            
-            if len(df) == 0:
-                print("Warning: No valid rows to insert after data cleaning in current chunk")
-                continue
-            
-            # Convert to records and free DataFrame memory
-            records = df.to_dict('records')
-            del df  # Explicitly free DataFrame memory
-            
-            client = bigquery.Client(project=project_id)
-            dataset_id, table_name = table_id.split('.')
-            dataset_ref = client.dataset(dataset_id)
-            table_ref = dataset_ref.table(table_name)
-            
-            job_config = bigquery.LoadJobConfig(
-                schema=[
-                    bigquery.SchemaField('contractID', 'STRING'),
-                    bigquery.SchemaField('symbol', 'STRING'),
-                    bigquery.SchemaField('expiration', 'DATE'),
-                    bigquery.SchemaField('strike', 'FLOAT'),
-                    bigquery.SchemaField('type', 'STRING'),
-                    bigquery.SchemaField('last', 'FLOAT'),
-                    bigquery.SchemaField('mark', 'FLOAT'),
-                    bigquery.SchemaField('bid', 'FLOAT'),
-                    bigquery.SchemaField('bid_size', 'INTEGER'),
-                    bigquery.SchemaField('ask', 'FLOAT'),
-                    bigquery.SchemaField('ask_size', 'INTEGER'),
-                    bigquery.SchemaField('volume', 'INTEGER'),
-                    bigquery.SchemaField('open_interest', 'INTEGER'),
-                    bigquery.SchemaField('date', 'DATE'),
-                    bigquery.SchemaField('implied_volatility', 'FLOAT'),
-                    bigquery.SchemaField('delta', 'FLOAT'),
-                    bigquery.SchemaField('gamma', 'FLOAT'),
-                    bigquery.SchemaField('theta', 'FLOAT'),
-                    bigquery.SchemaField('vega', 'FLOAT'),
-                    bigquery.SchemaField('rho', 'FLOAT'),
-                    bigquery.SchemaField('collected_date', 'DATE')
-                ],
-                write_disposition="WRITE_APPEND"
-            )
-            
-            job = client.load_table_from_json(records, table_ref, job_config=job_config)
-            result = job.result()
-            total_processed += len(records)
-            print(f"Processed chunk {i//chunk_size + 1}, total rows so far: {total_processed}")
-            
-            # Free memory
-            del records
-        
-        return total_processed
-        
-    except Exception as e:
-        print(f"\nFailed to insert batch into {table_id}")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
-        import traceback
-        print("\nFull error traceback:")
-        traceback.print_exc()
-        return 0
-
-def get_existing_dates(symbol, table_id, project_id):
-    """
-    Query BigQuery to get the dates that already have data for a given symbol.
-    Returns a set of dates in YYYY-MM-DD format.
-    """
-    client = bigquery.Client(project=project_id)
-    query = f"""
-    SELECT DISTINCT date
-    FROM `{table_id}`
-    WHERE symbol = @symbol
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("symbol", "STRING", symbol)
-        ]
-    )
-    
-    try:
-        query_job = client.query(query, job_config=job_config)
-        existing_dates = {row.date.strftime('%Y-%m-%d') for row in query_job}
-        print(f"Found {len(existing_dates)} existing dates for {symbol}")
-        return existing_dates
-    except Exception as e:
-        print(f"Error querying existing dates: {str(e)}")
-        return set()  # Return empty set on error to be safe
-
 def filter_date_range(date_range, existing_dates):
     """
     Filter out dates that already exist in the database.
@@ -225,20 +68,141 @@ def filter_date_range(date_range, existing_dates):
     skipped_count = len(date_range) - len(new_date_range)
     return new_date_range, skipped_count
 
-def fetch_historical_options(symbol, date_range, table_id, project_id):
+API_MESSAGE_KEYS = ('Information', 'Note', 'Error Message')
+
+def iter_response_batches(chunks, symbol, date, streaming=False, chunk_rows=DEFAULT_CHUNK_ROWS, meta=None):
     """
-    Fetch historical options data from Alpha Vantage API and store in BigQuery.
+    Yield arrow tables parsed from one HISTORICAL_OPTIONS response body, given
+    as an iterator of byte chunks (from the network or the response cache).
     
-    This function implements Pro API rate limiting:
-    - Maximum 74 calls per minute
-    - 0.81 seconds between calls (60/74 ≈ 0.81)
-    - Automatic pause when limit is reached
+    With streaming enabled the `data` array is decoded incrementally and parsed
+    chunk_rows contracts at a time, so the full JSON document is never
+    materialized. Top-level keys other than `data` are stored in meta.
+    """
+    meta = {} if meta is None else meta
+    if streaming:
+        yield from iter_response_tables(chunks, symbol, date, chunk_rows, meta)
+    else:
+        data = json.loads(b"".join(chunks))
+        meta.update((key, value) for key, value in data.items() if key != 'data')
+        if data.get('data'):
+            yield parse_options_rows(data['data'], symbol, date)
+    for key in API_MESSAGE_KEYS:
+        if key in meta:
+            print(f"API message for {symbol} on {date}: {meta[key]}")
+
+def make_listing_probe(symbol, rate_limiter, api_key=None, config=None, cache=None, known_dates=(), probed=None):
+    """
+    has_data(date) for listing-window detection: True if symbol has option data
+    on date, False if the response is empty, None if it could not be told
+    (HTTP error or an API notice). Dates in known_dates need no call, and good
+    responses go into the response cache so the fetch itself reuses them.
+    Without a cache, the gzip-compressed bodies are kept in probed
+    ({date: bytes}) for fetch_historical_options to use instead.
+    """
+    config = config or {}
+    base_url = config.get("alpha_vantage_url", ALPHA_VANTAGE_URL)
+    session = create_session_with_retries()
+    known_dates = set(known_dates)
+
+    def has_data(date):
+        if date in known_dates:
+            return True
+        chunks = cache.iter_chunks(symbol, date) if cache is not None else None
+        try:
+            if chunks is not None:
+                body = b"".join(chunks)
+            else:
+                METRICS.observe("sleep", rate_limiter.acquire())
+                METRICS.inc("api_calls")
+                METRICS.inc("listing_probes")
+                key = api_key or get_secret("alpha_vantage_api_key")
+                with METRICS.timer("fetch"):
+                    response = session.get(f"{base_url}?function=HISTORICAL_OPTIONS&symbol={symbol}&date={date}&apikey={key}")
+                if response.status_code != 200:
+                    return None
+                body = response.content
+            payload = json.loads(body)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Listing probe for {symbol} on {date} failed: {e}")
+            return None
+        if any(key in payload for key in API_MESSAGE_KEYS):
+            return None
+        if chunks is None:
+            if cache is not None:
+                cache.put(symbol, date, body)
+            elif probed is not None:
+                probed[date] = gzip.compress(body, compresslevel=1)
+        return bool(payload.get("data"))
+
+    return has_data
+
+def fetch_historical_options(symbol, date_range, table_id, project_id, rate_limiter=None, api_key=None, config=None,
+                             cache=None, storage=None, job=None, written_dates=None, coverage=None, journal=None,
+                             failed_dates=None, probed=None):
     """
-    print("Fetching historical options with Pro API rate limit (70 calls/minute)...")
-    create_options_table_if_not_exists(table_id, project_id)
+    Fetch historical options data from Alpha Vantage API and write it to storage
+    (an OptionsStorage backend, BigQuery unless config selects another one).
+    
+    Every API call first takes a token from rate_limiter, a TokenBucket that is
+    shared by all symbols being fetched concurrently, so the process as a whole
+    stays at the Pro plan limit without sleeping between calls on its own.
+    
+    Parsed contracts are buffered and pushed whenever the pending batch reaches
+    flush_rows or flush_bytes (from config), so memory stays bounded by that
+    budget rather than by the size of a month of chains.
+    
+    Raw responses are read from and written to cache (a ResponseCache) when one
+    is given. Bodies kept by the listing probe (probed, see make_listing_probe)
+    are used once instead of calling the API again. With offline set in config, only cached dates are processed and
+    no network calls are made.
+    
+    When run inside a Job, rows are reported to it as they are written and the
+    loop stops before the next date once the job is cancelled.
+    
+    With backfill_greeks set in config, implied vols and Greeks the vendor left
+    null are filled in from the option price and the stored underlying close
+    before each batch is written.
+
+    The dates of every written row are added to written_dates when a set is given,
+    and dates that could not be fetched, parsed or written to failed_dates.
+
+    With a coverage index (utilities.coverage_index), the dates already loaded
+    come from it instead of a query, and every written batch is recorded in it.
+
+    With load_mode: merge in config, batches are merged on (contractID, date)
+    instead of appended, so reloading a date never duplicates contracts. With
+    a journal (utilities.load_journal), each date is recorded once all of its
+    rows are written, and journaled dates are skipped on the next run.
+    
+    When a date fails part way, its rows still in the buffer are dropped. If
+    some were already written it is journaled as partial: merge mode loads it
+    again on the next run, append mode never does (that would duplicate rows).
+    """
+    config = config or {}
+    if storage is None:
+        storage = get_storage({**config, "project_id": project_id})
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(DEFAULT_CALLS_PER_MINUTE)
+    offline = config.get("offline", False)
+    streaming = config.get("streaming", False)
+    merge = config.get("load_mode", "append") == "merge"
+    chunk_rows = config.get("stream_chunk_rows", DEFAULT_CHUNK_ROWS)
+    base_url = config.get("alpha_vantage_url", ALPHA_VANTAGE_URL)
+    print(f"Fetching historical options for {symbol} at up to {rate_limiter.calls_per_minute:g} calls/minute...")
+    storage.ensure_table(table_id)
     
     # Check existing data first
-    existing_dates = get_existing_dates(symbol, table_id, project_id)
+    existing_dates = coverage.dates(symbol) if coverage is not None else storage.existing_dates(symbol, table_id)
+    if journal is not None and not (config.get("rebuild") or offline):
+        existing_dates = existing_dates | journal.committed(symbol, table_id, existing_dates)
+        partial = journal.partial_dates(symbol, table_id)
+        if partial and merge:
+            print(f"Reloading {len(partial)} partially written dates for {symbol}")
+            existing_dates = existing_dates - partial
+        elif partial:
+            print(f"Not reloading {len(partial)} partially appended dates for {symbol} "
+                  f"({', '.join(sorted(partial))}); rerun them with load_mode: merge")
     filtered_date_range, skipped_dates = filter_date_range(date_range, existing_dates)
     
     if skipped_dates > 0:
@@ -248,143 +212,232 @@ def fetch_historical_options(symbol, date_range, table_id, project_id):
         print("No new dates to process - all dates already exist in the database")
         return 0
     
+    if offline:
+        cached = set(cache.cached_dates(symbol)) if cache is not None else set()
+        filtered_date_range = [date for date in filtered_date_range if date in cached]
+        print(f"Offline replay: {len(filtered_date_range)} new dates available in the response cache")
+        if not filtered_date_range:
+            return 0
+    
     print(f"Processing {len(filtered_date_range)} new dates")
     
-    alpha_vantage_key = get_secret("alpha_vantage_api_key")
-    calls_in_last_minute = 0
-    last_call_time = time.time()
-    current_batch = []
-    total_rows_inserted = 0
-    session = create_session_with_retries()
-    current_month = None
+    if not offline:
+        alpha_vantage_key = api_key or get_secret("alpha_vantage_api_key")
+        session = create_session_with_retries()
+    
+    spot_closes = load_spot_closes(storage, symbol) if config.get("backfill_greeks") else {}
+    risk_free_rate = config.get("risk_free_rate", DEFAULT_RISK_FREE_RATE)
+    if failed_dates is None:
+        failed_dates = set()
+    # Dates read completely whose rows are all in the buffer or written, not journaled yet
+    completed_dates = {}
+    write_failed = [False]
+    
+    def commit_completed():
+        if journal is not None and completed_dates and not write_failed[0]:
+            journal.commit(symbol, table_id, dict(completed_dates))
+        completed_dates.clear()
+    
+    def flush(batch):
+        if spot_closes:
+            with METRICS.timer("transform"):
+                batch, recomputed = backfill_greeks(batch, spot_for_rows(batch, spot_closes), risk_free_rate)
+            METRICS.inc("greeks_backfilled", recomputed)
+        print(f"\nPushing {batch.num_rows} records for {symbol} to {table_id}...")
+        rows_inserted = storage.merge_batch(batch, table_id) if merge else storage.write_batch(batch, table_id)
+        if rows_inserted == 0:
+            # Nothing after a failed write may be journaled, or its dates would be skipped next time
+            write_failed[0] = True
+            failed_dates.update(batch['date'].cast(pa.string()).unique().to_pylist())
+        commit_completed()
+        if coverage is not None and rows_inserted:
+            coverage.record(symbol, batch, merged=merge)
+        if written_dates is not None:
+            written_dates.update(batch['date'].cast(pa.string()).unique().to_pylist())
+        if job is not None:
+            job.add_rows(rows_inserted)
+        print(f"Inserted {rows_inserted} rows for {symbol}. Total rows so far: {buffer.flushed_rows + rows_inserted}")
+        return rows_inserted
+    
+    buffer = BatchBuffer(
+        flush,
+        max_rows=config.get("flush_rows", DEFAULT_FLUSH_ROWS),
+        max_bytes=config.get("flush_bytes", DEFAULT_FLUSH_BYTES)
+    )
 
-    for idx, date in enumerate(filtered_date_range):
-        current_date = pd.to_datetime(date)
-        
-        # Check if we're starting a new month
-        date_month = current_date.strftime('%Y-%m')
-        if current_month is None:
-            current_month = date_month
-            print(f"\nStarting month {current_month}")
-        elif date_month != current_month:
-            # Push the current month's batch before starting a new month
-            if current_batch:
-                print(f"\nCompleted month {current_month}, pushing {len(current_batch)} records to BigQuery...")
-                rows_inserted = push_batch_to_bq(current_batch, table_id, project_id)
-                total_rows_inserted += rows_inserted
-                print(f"Inserted {rows_inserted} rows for {current_month}. Total rows so far: {total_rows_inserted}")
-                current_batch = []  # Reset batch for new month
-            current_month = date_month
-            print(f"\nStarting month {current_month}")
-        
-        # Add rate limiting delay if needed
-        elapsed = time.time() - last_call_time
-        if elapsed < 0.81:  # 60/74 seconds between calls
-            time.sleep(0.81 - elapsed)
-        
-        url = f"https://www.alphavantage.co/query?function=HISTORICAL_OPTIONS&symbol={symbol}&date={date}&apikey={alpha_vantage_key}"
-        print(f"Fetching data for {symbol} on {date}...")
-        
+    def fetch_date(date):
+        """
+        Fetch (or read from cache), parse and buffer one date, recording per-stage
+        timings. Dates read completely are added to completed_dates.
+        """
+        chunks = cache.iter_chunks(symbol, date) if cache is not None else None
+        if chunks is None and probed and date in probed:
+            print(f"Reusing the listing probe's response for {symbol} on {date}...")
+            METRICS.inc("probe_reuses")
+            chunks = iter([gzip.decompress(probed.pop(date))])
+        elif chunks is not None:
+            print(f"Reading cached response for {symbol} on {date}...")
+            METRICS.inc("cache_hits")
+        response = None
+        writer = None
+        mark = None
+        meta = {}
+        # Time spent reading the body and flushing is subtracted to get the parse time
+        io_seconds = [0.0]
         try:
-            response = session.get(url)
-            last_call_time = time.time()  # Update last call time
-            
-            if response.status_code == 503:
-                print(f"Service unavailable for {symbol} on {date}. Will retry automatically...")
-            elif response.status_code != 200:
-                print(f"Error: Unable to fetch data for {symbol} on {date}. Status code: {response.status_code}")
-                print("API Response:", response.text)
-                continue
+            if chunks is not None:
+                chunks = METRICS.timed_iter(chunks, "cache", io_seconds)
+            else:
+                METRICS.observe("sleep", rate_limiter.acquire())
+                METRICS.inc("api_calls")
+                url = f"{base_url}?function=HISTORICAL_OPTIONS&symbol={symbol}&date={date}&apikey={alpha_vantage_key}"
+                print(f"Fetching data for {symbol} on {date}...")
+                requested = time.perf_counter()
+                response = session.get(url, stream=True)
+                # Time to the headers and to the end of the body is one fetch observation
+                request_seconds = time.perf_counter() - requested
+                
+                if response.status_code != 200:
+                    METRICS.observe("fetch", request_seconds)
+                    METRICS.inc("http_errors")
+                    print(f"Error: Unable to fetch data for {symbol} on {date}. Status code: {response.status_code}")
+                    print("API Response:", response.text)
+                    failed_dates.add(date)
+                    return
+                
+                chunks = METRICS.timed_iter(response.iter_content(READ_CHUNK_BYTES), "fetch", io_seconds,
+                                            request_seconds)
+                if cache is not None:
+                    writer = cache.writer(symbol, date)
+                    chunks = writer.tee(chunks)
             
-            data = response.json()
-            if 'data' in data and data['data']:
-                record_count = len(data['data'])
-                print(f"Found {record_count} records for {symbol} on {date}")
-                if record_count == 0:
-                    print("Warning: Empty data array returned from API")
-                for row in data['data']:
-                    current_batch.append({
-                        'contractID': row.get('contractID'),
-                        'symbol': row.get('symbol', symbol),
-                        'expiration': row.get('expiration'),
-                        'strike': float(row.get('strike')) if row.get('strike') is not None else None,
-                        'type': row.get('type'),
-                        'last': float(row.get('last')) if row.get('last') is not None else None,
-                        'mark': float(row.get('mark')) if row.get('mark') is not None else None,
-                        'bid': float(row.get('bid')) if row.get('bid') is not None else None,
-                        'bid_size': int(row.get('bid_size')) if row.get('bid_size') is not None else None,
-                        'ask': float(row.get('ask')) if row.get('ask') is not None else None,
-                        'ask_size': int(row.get('ask_size')) if row.get('ask_size') is not None else None,
-                        'volume': int(row.get('volume')) if row.get('volume') is not None else None,
-                        'open_interest': int(row.get('open_interest')) if row.get('open_interest') is not None else None,
-                        'date': row.get('date', date),
-                        'implied_volatility': float(row.get('implied_volatility')) if row.get('implied_volatility') is not None else None,
-                        'delta': float(row.get('delta')) if row.get('delta') is not None else None,
-                        'gamma': float(row.get('gamma')) if row.get('gamma') is not None else None,
-                        'theta': float(row.get('theta')) if row.get('theta') is not None else None,
-                        'vega': float(row.get('vega')) if row.get('vega') is not None else None,
-                        'rho': float(row.get('rho')) if row.get('rho') is not None else None,
-                        'collected_date': date
-                    })
+            record_count = 0
+            mark = buffer.mark()
+            flushed_before = buffer.flush_seconds
+            started = time.perf_counter()
+            for table in iter_response_batches(chunks, symbol, date, streaming, chunk_rows, meta):
+                record_count += table.num_rows
+                buffer.add(table)
+            METRICS.observe("parse", time.perf_counter() - started - io_seconds[0] - (buffer.flush_seconds - flushed_before))
+            METRICS.inc("rows_parsed", record_count)
+            if writer is not None:
+                # Rate-limit and error notices must be fetched again, not replayed
+                if any(key in meta for key in API_MESSAGE_KEYS):
+                    writer.abort()
                 else:
-                    print(f"No data for {symbol} on {date}")
-        except requests.exceptions.RequestException as e:
+                    writer.commit()
+                writer = None
+            if any(key in meta for key in API_MESSAGE_KEYS):
+                METRICS.inc("api_messages")
+                failed_dates.add(date)
+            else:
+                completed_dates[date] = record_count
+            if record_count:
+                print(f"Found {record_count} records for {symbol} on {date}")
+            else:
+                print(f"No data for {symbol} on {date}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            METRICS.inc("request_failures")
             print(f"Request failed after all retries for {symbol} on {date}: {e}")
-            continue
+            failed_dates.add(date)
+            # Rows of a failed date must not reach the warehouse with later dates
+            if mark is not None and not buffer.rollback(mark):
+                print(f"Some rows for {symbol} on {date} were already written")
+                if journal is not None:
+                    journal.mark_partial(symbol, table_id, date)
+        finally:
+            if writer is not None:
+                writer.abort()
+            if response is not None:
+                response.close()
 
-        calls_in_last_minute += 1
-        
-        # Rate limiting logic
-        current_time = time.time()
-        if current_time - last_call_time >= 60:
-            print(f"Resetting rate limit counter. Made {calls_in_last_minute} calls in the last minute.")
-            calls_in_last_minute = 0
-            last_call_time = current_time
-        
-        if calls_in_last_minute >= 74:  # Pro API limit
-            wait_time = 60 - (current_time - last_call_time)
-            if wait_time > 0:
-                print(f"Reached rate limit (70 calls/minute). Waiting {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
-                calls_in_last_minute = 0
-                last_call_time = time.time()
-        elif idx < len(date_range) - 1:
-            time.sleep(0.81)  # Enforcing the delay explicitly
+    for date in filtered_date_range:
+        if job is not None and job.cancelled:
+            print(f"Job cancelled, stopping {symbol} before {date}")
+            break
+        with METRICS.labels(symbol=symbol, date=date):
+            fetch_date(date)
 
-    # Push the final month's batch
-    if current_batch:
-        print(f"\nPushing final batch for {current_month} to BigQuery...")
-        rows_inserted = push_batch_to_bq(current_batch, table_id, project_id)
-        total_rows_inserted += rows_inserted
-        print(f"Inserted {rows_inserted} rows for final month. Total rows: {total_rows_inserted}")
+    # Push whatever is left in the buffer
+    with METRICS.labels(symbol=symbol):
+        buffer.flush()
+    # Dates with no rows never pass through flush
+    commit_completed()
+    total_rows_inserted = buffer.flushed_rows
     
     if total_rows_inserted > 0:
-        print(f"\nCompleted all data collection and uploads. Total rows inserted: {total_rows_inserted}")
+        print(f"\nCompleted all data collection and uploads for {symbol}. Total rows inserted: {total_rows_inserted}")
         return total_rows_inserted
     else:
-        print("No data was collected or inserted.")
+        print(f"No data was collected or inserted for {symbol}.")
         return 0
 
-def process_symbol(symbol, project_id, date_start, date_end=None):
-    """Process a single symbol and upload its data to BigQuery"""
+def update_aggregates(symbol, storage, dates=()):
+    """Summarize the dates just written (and any not summarized yet); a failure here never fails the load itself."""
+    try:
+        with METRICS.labels(symbol=symbol):
+            materialize_symbol(storage, symbol, dates=dates)
+    except Exception as e:
+        print(f"Failed to update daily aggregates for {symbol}: {e}")
+
+def process_symbol(symbol, project_id, date_start, date_end=None, rate_limiter=None, api_key=None, config=None,
+                   cache=None, storage=None, job=None, coverage=None, journal=None, listing_windows=None):
+    """
+    Process a single symbol and write its data to the configured storage backend.
+    Only NYSE trading days are requested, trimmed to the symbol's listing window
+    when listing_windows (utilities.trading_calendar.ListingWindows) is given.
+    config's listing_probe_range ([start, end]), set by sharded month units,
+    widens the probe to the whole backfill so a symbol is probed only once.
+    The symbol is recorded as done through date_end only when every date was
+    fetched and written; otherwise it is left "partial" and retried next run.
+    """
     if date_end is None:
-        date_end = pd.Timestamp.today().strftime("%Y-%m-%d")
+        date_end = datetime.date.today().isoformat()
+    if job is not None:
+        if job.cancelled:
+            job.symbol_skipped(symbol)
+            return 0
+        job.symbol_started(symbol)
+    status = "failed"
     
-    table_id = f"historical_data.{symbol.lower()}"
-    # Generate date range and exclude weekends
-    date_range = pd.date_range(start=date_start, end=date_end)
-    # Monday = 0, Sunday = 6
-    trading_days = date_range[date_range.weekday < 5].strftime("%Y-%m-%d").tolist()
+    storage = storage or get_storage({**(config or {}), "project_id": project_id})
+    table_id = storage.options_table_id(symbol)
+    days = trading_days(date_start, date_end)
     
     print(f"\n{'='*80}")
     print(f"Processing {symbol} from {date_start} to {date_end}")
-    print(f"Will fetch {len(trading_days)} trading days (excluding weekends)")
+    # Probe responses with data, reused by the fetch when there is no response cache
+    probed = {}
+    if listing_windows is not None:
+        known = coverage.dates(symbol) if coverage is not None else ()
+        probe_range = (config or {}).get("listing_probe_range")
+        days = listing_windows.trim(symbol, days,
+                                    make_listing_probe(symbol, rate_limiter, api_key, config, cache, known, probed),
+                                    probe_days=trading_days(*probe_range) if probe_range else None)
+    print(f"Will fetch {len(days)} NYSE trading days")
     print(f"{'='*80}")
     
+    rows_inserted = 0
+    written_dates = set()
+    failed_dates = set()
     try:
-        rows_inserted = fetch_historical_options(symbol, trading_days, table_id, project_id)
+        rows_inserted = fetch_historical_options(
+            symbol, days, table_id, project_id,
+            rate_limiter=rate_limiter, api_key=api_key, config=config, cache=cache,
+            storage=storage, job=job, written_dates=written_dates, coverage=coverage,
+            journal=journal, failed_dates=failed_dates, probed=probed
+        )
+        if job is not None and job.cancelled:
+            status = "cancelled"
+        elif failed_dates:
+            status = "partial"
+            print(f"{len(failed_dates)} dates failed for {symbol}; it will be retried on the next run")
+        else:
+            status = "done"
         if rows_inserted > 0:
             print(f"Successfully completed {symbol}: {rows_inserted} rows inserted")
+            if config and config.get("materialize_aggregates"):
+                update_aggregates(symbol, storage, written_dates)
         else:
             print(f"No data inserted for {symbol}")
         return rows_inserted
@@ -395,23 +448,53 @@ def process_symbol(symbol, project_id, date_start, date_end=None):
         traceback.print_exc()
         return 0
     finally:
+        # Anything written (even before a failure) makes cached reads of this symbol stale
+        if written_dates:
+            notify_loaded(symbol, sorted(written_dates))
+        if job is not None:
+            job.symbol_finished(symbol, rows_inserted if status != "failed" else 0, status,
+                                completed_through=date_end if status == "done" else None)
         print(f"Finished processing {symbol}")
         print(f"{'='*80}")
 
-def main():
-    config = get_config()
+def main(offline=None, job=None, config=None, symbols=None, api_key=None, storage=None, rate_limiter=None,
+         rebuild=None):
+    """
+    Load the whole S&P 500 universe. With offline=True (or offline: true in
+    config.yaml) tables are rebuilt from the response cache without any API calls.
+    With rebuild=True every date missing from the tables is loaded again, even
+    if the load journal has it. Offline replay ignores the journal as well.
+    
+    job is the utilities.jobs.Job this run belongs to when started from the app.
+    Symbols its state store marks as completed through today are skipped.
+    
+    config, symbols, api_key and storage default to config.yaml, the S&P 500
+    constituents file, Secret Manager and the configured backend; benchmarks
+    pass their own. rate_limiter defaults to a TokenBucket at
+    api_calls_per_minute; sharded workers pass one shared between processes.
+    
+    Raises CoverageIndexError when the coverage index cannot be built, so the
+    job (or shard) running it is marked failed rather than succeeded.
+    """
+    config = dict(config) if config is not None else get_config()
+    if offline is not None:
+        config["offline"] = offline
+    if rebuild is not None:
+        config["rebuild"] = rebuild
     project_id = config["project_id"]
     date_start = config["date_start"]
     
     # Read S&P 500 constituents
     sp500_file = "org_files/S&P 500 Constituents.csv"
-    try:
-        df_sp500 = pd.read_csv(sp500_file)
-        symbols = df_sp500['Symbol'].tolist()
-        print(f"Successfully loaded {len(symbols)} symbols from {sp500_file}")
-    except Exception as e:
-        print(f"Error reading {sp500_file}: {str(e)}")
-        return
+    if symbols is None:
+        try:
+            import pandas as pd
+            df_sp500 = pd.read_csv(sp500_file)
+            symbols = df_sp500['Symbol'].tolist()
+            print(f"Successfully loaded {len(symbols)} symbols from {sp500_file}")
+        except Exception as e:
+            print(f"Error reading {sp500_file}: {str(e)}")
+            return
 
     total_symbols = len(symbols)
     total_rows_inserted = 0
@@ -419,31 +502,103 @@ def main():
     failed_symbols = []
     empty_symbols = []
     
+    calls_per_minute = config.get("api_calls_per_minute", DEFAULT_CALLS_PER_MINUTE)
+    max_workers = config.get("max_workers", DEFAULT_MAX_WORKERS)
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(calls_per_minute)
+    calls_per_minute = rate_limiter.calls_per_minute
+    if config.get("offline"):
+        # Replay reads the response cache even where caching new responses is off
+        config["cache_enabled"] = True
+    cache = get_response_cache(config)
+    if storage is None:
+        storage = get_storage(config)
+    date_end = str(config.get("date_end") or datetime.date.today().isoformat())
+    if job is not None:
+        job.set_total(total_symbols, rate_limiter)
+        already_done = {s for s in symbols if (job.state_store.completed_through(s) or "") >= date_end}
+        if already_done:
+            print(f"Skipping {len(already_done)} symbols already completed through {date_end}")
+            for symbol in already_done:
+                job.symbol_skipped(symbol)
+            symbols = [s for s in symbols if s not in already_done]
+    journal = get_load_journal(config)
+    listing_windows = None
+    if config.get("listing_probe") and not config.get("offline"):
+        listing_windows = ListingWindows(config.get("listing_windows_path", DEFAULT_LISTING_WINDOWS_PATH),
+                                         config.get("listing_settle_days", DEFAULT_SETTLE_DAYS))
+    coverage = None
+    up_to_date_symbols = []
+    if config.get("coverage_index"):
+        try:
+            coverage = open_coverage_index(config, storage, symbols)
+        except CoverageIndexError as e:
+            # Without knowing what is loaded every date would be refetched; raising fails the job
+            print(f"Aborting: {e}")
+            raise
+        committed = reload = None
+        if journal is not None and not (config.get("rebuild") or config.get("offline")):
+            committed = lambda s, loaded: journal.committed(s, storage.options_table_id(s), loaded)
+            if config.get("load_mode", "append") == "merge":
+                # Partially written dates are completed by merging them again
+                reload = lambda s: journal.partial_dates(s, storage.options_table_id(s))
+        work = coverage.missing(symbols, trading_days(date_start, date_end), committed, reload)
+        print(f"Planned {sum(len(dates) for dates in work.values())} missing symbol-dates "
+              f"across {len(work)} symbols")
+        up_to_date_symbols = [s for s in symbols if s not in work]
+        for symbol in up_to_date_symbols:
+            if job is not None:
+                job.symbol_skipped(symbol)
+        symbols = [s for s in symbols if s in work]
+    if api_key is None and not config.get("offline") and symbols:
+        api_key = get_secret("alpha_vantage_api_key")
+    
     print(f"\nStarting data collection for {total_symbols} symbols")
     print(f"Start date: {date_start}")
     print(f"Project ID: {project_id}")
+    print(f"Storage backend: {config.get('storage_backend', 'bigquery')}")
+    print(f"Rate limit: {calls_per_minute:g} calls/minute shared by {max_workers} workers")
+    if config.get("offline"):
+        print("Offline replay mode: reading responses from the cache only")
     print(f"{'='*80}")
     
-    for idx, symbol in enumerate(symbols, 1):
-        print(f"\nProcessing symbol {idx}/{total_symbols}: {symbol}")
-        try:
-            rows = process_symbol(symbol, project_id, date_start)
-            
-            if rows > 0:
-                total_rows_inserted += rows
-                successful_symbols.append(symbol)
-                print(f"Progress: {idx}/{total_symbols} symbols processed")
-                print(f"Current total rows: {total_rows_inserted}")
-            else:
-                empty_symbols.append(symbol)
-                print(f"No data found for {symbol}")
-        except KeyboardInterrupt:
-            print("\nProcess interrupted by user!")
-            break
-        except Exception as e:
-            print(f"Error processing {symbol}: {str(e)}")
-            failed_symbols.append(symbol)
-            continue
+    METRICS.start_run()
+    started = time.time()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        executor.submit(process_symbol, symbol, project_id, date_start, date_end,
+                        rate_limiter=rate_limiter, api_key=api_key,
+                        config=config, cache=cache, storage=storage, job=job, coverage=coverage,
+                        journal=journal, listing_windows=listing_windows): symbol
+        for symbol in symbols
+    }
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            symbol = futures[future]
+            try:
+                rows = future.result()
+                
+                if rows > 0:
+                    total_rows_inserted += rows
+                    successful_symbols.append(symbol)
+                    print(f"Progress: {done}/{total_symbols} symbols processed")
+                    print(f"Current total rows: {total_rows_inserted}")
+                else:
+                    empty_symbols.append(symbol)
+                    print(f"No data found for {symbol}")
+            except Exception as e:
+                print(f"Error processing {symbol}: {str(e)}")
+                failed_symbols.append(symbol)
+                continue
+    except KeyboardInterrupt:
+        print("\nProcess interrupted by user!")
+        for future in futures:
+            future.cancel()
+    finally:
+        executor.shutdown(wait=True)
+        if coverage is not None:
+            coverage.save()
+    elapsed = time.time() - started
     
     # Print summary
     print(f"\n{'='*80}")
@@ -452,8 +607,18 @@ def main():
     print(f"Total symbols attempted: {total_symbols}")
     print(f"Successful symbols: {len(successful_symbols)}")
     print(f"Empty symbols: {len(empty_symbols)}")
+    if coverage is not None:
+        print(f"Already up to date: {len(up_to_date_symbols)}")
     print(f"Failed symbols: {len(failed_symbols)}")
     print(f"Total rows inserted: {total_rows_inserted}")
+    print(f"API calls made: {rate_limiter.total_acquired} in {elapsed:.0f}s "
+          f"({rate_limiter.observed_calls_per_minute():.1f} calls/minute)")
+    if cache is not None:
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses, {cache.total_bytes / 1e6:.1f} MB on disk")
+    
+    stage_seconds = {stage: stats["seconds"] for stage, stats in METRICS.summary(include_dates=False)["stages"].items()}
+    print("Time by stage (seconds, summed over workers): " +
+          ", ".join(f"{stage}={seconds:.1f}" for stage, seconds in sorted(stage_seconds.items())))
     
     if successful_symbols:
         avg_rows = total_rows_inserted/len(successful_symbols)
@@ -475,25 +640,38 @@ def main():
         for symbol in successful_symbols:
             print(f"- {symbol}")
     
-    # Save summary to file
-    summary_file = "data_collection_summary.txt"
-    try:
-        with open(summary_file, "w") as f:
-            f.write("Data Collection Summary\n")
-            f.write(f"Date: {pd.Timestamp.now()}\n")
-            f.write(f"Start date: {date_start}\n")
-            f.write(f"Total symbols: {total_symbols}\n")
-            f.write(f"Total rows: {total_rows_inserted}\n")
-            f.write(f"Successful symbols: {', '.join(successful_symbols)}\n")
-            f.write(f"Empty symbols: {', '.join(empty_symbols)}\n")
-            f.write(f"Failed symbols: {', '.join(failed_symbols)}\n")
-        print(f"\nSummary saved to {summary_file}")
-    except Exception as e:
-        print(f"Failed to save summary file: {e}")
+    # Save a structured summary with the per-stage, per-symbol and per-date timings
+    summary_file = config.get("summary_path", DEFAULT_SUMMARY_PATH)
+    summary = {
+        "date": datetime.datetime.now().isoformat(),
+        "start_date": str(date_start),
+        "end_date": date_end,
+        "total_symbols": total_symbols,
+        "total_rows": total_rows_inserted,
+        "elapsed_seconds": round(elapsed, 2),
+        "api_calls": rate_limiter.total_acquired,
+        "api_calls_per_minute": round(rate_limiter.observed_calls_per_minute(), 1),
+        "successful_symbols": successful_symbols,
+        "empty_symbols": empty_symbols,
+        "failed_symbols": failed_symbols,
+        "up_to_date_symbols": up_to_date_symbols,
+        "metrics": METRICS.summary(),
+    }
+    if summary_file:
+        try:
+            with open(summary_file, "w") as f:
+                json.dump(summary, f, indent=2)
+            print(f"\nSummary saved to {summary_file}")
+        except Exception as e:
+            print(f"Failed to save summary file: {e}")
+    return summary
 
 # Only run main if executed as a script, not on import
 if __name__ == "__main__":
-    main()
+    # --replay rebuilds the tables from the response cache with zero network calls;
+    # --rebuild reloads every date the tables are missing, ignoring the load journal
+    main(offline=True if "--replay" in sys.argv[1:] else None,
+         rebuild=True if "--rebuild" in sys.argv[1:] else None)
 
 
 
@@ -0,0 +1,125 @@
+"""
+Durable local journal of committed (symbol, date) load units.
+
+A date is committed once every row fetched for it has been written (merged)
+into the warehouse. Each commit is appended as one JSON line and fsynced
+before the loader moves on, so after a crash or cancellation the next run
+skips exactly the dates that were committed and refetches the rest. Dates
+that came back empty are journaled too, so they are not asked for again,
+except within the last empty_settle_days trading days: Alpha Vantage may not
+have published those chains yet. A journaled date with rows only counts while
+the warehouse still holds it, so dropping or rebuilding a table reloads it.
+
+A date whose load failed after some of its rows were already written is
+journaled as partial. It is not committed: merge mode loads it again, while
+append mode leaves it alone, since appending it again would duplicate rows.
+
+    {"source": "bigquery:voldilsloc:per_symbol", "table": "historical_data.aapl",
+     "symbol": "AAPL", "date": "2025-05-01", "rows": 5120, "at": "2025-05-02T06:14:03"}
+"""
+import datetime
+import json
+import os
+import threading
+
+from utilities.coverage_index import coverage_source
+from utilities.trading_calendar import unsettled_from
+
+DEFAULT_LOAD_JOURNAL_PATH = ".cache/load_journal.jsonl"
+DEFAULT_EMPTY_SETTLE_DAYS = 3  # trading days
+
+
+class LoadJournal:
+    def __init__(self, path=DEFAULT_LOAD_JOURNAL_PATH, source=None, empty_settle_days=DEFAULT_EMPTY_SETTLE_DAYS):
+        self.path = path
+        self.source = source
+        self.empty_settle_days = empty_settle_days
+        # (table, symbol) -> {date: rows}
+        self.units = {}
+        # (table, symbol) -> dates partially written and not committed since
+        self.partial = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    # A torn last line from a crash is ignored
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("source") != self.source:
+                        continue
+                    key = (entry["table"], entry["symbol"])
+                    if entry.get("partial"):
+                        self.partial.setdefault(key, set()).add(entry["date"])
+                    else:
+                        self.units.setdefault(key, {})[entry["date"]] = entry["rows"]
+                        self.partial.get(key, set()).discard(entry["date"])
+        except (OSError, KeyError) as e:
+            print(f"Could not read load journal from {self.path}: {e}")
+
+    def committed(self, symbol, table_id, loaded=()):
+        """
+        Dates of symbol already committed to table_id: those that came back
+        empty, and those with rows that loaded (the dates the table or the
+        coverage index holds) confirms. A journaled date the table no longer
+        holds, e.g. after it was dropped or rebuilt, is loaded again.
+        """
+        with self._lock:
+            units = self.units.get((table_id, symbol), {})
+            return {date for date, rows in units.items() if not rows or date in loaded}
+
+    def partial_dates(self, symbol, table_id):
+        """Dates of symbol partially written to table_id and not committed since."""
+        with self._lock:
+            return set(self.partial.get((table_id, symbol), ()))
+
+    def commit(self, symbol, table_id, date_rows):
+        """
+        Durably record {date: rows} as committed for symbol. Empty dates within
+        the last empty_settle_days trading days are not recorded.
+        """
+        settled_before = unsettled_from(self.empty_settle_days)
+        date_rows = {date: rows for date, rows in date_rows.items()
+                     if rows or settled_before is None or date < settled_before}
+        if not date_rows:
+            return
+        self._append(table_id, symbol, [{"date": date, "rows": rows} for date, rows in sorted(date_rows.items())])
+        with self._lock:
+            self.units.setdefault((table_id, symbol), {}).update(date_rows)
+            self.partial.get((table_id, symbol), set()).difference_update(date_rows)
+
+    def mark_partial(self, symbol, table_id, date):
+        """Durably record that some but not all of date's rows were written."""
+        self._append(table_id, symbol, [{"date": date, "rows": None, "partial": True}])
+        with self._lock:
+            self.partial.setdefault((table_id, symbol), set()).add(date)
+
+    def _append(self, table_id, symbol, entries):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        lines = [json.dumps({"source": self.source, "table": table_id, "symbol": symbol, **entry, "at": now}) + "\n"
+                 for entry in entries]
+        with self._lock:
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+
+def get_load_journal(config):
+    """Build the load journal described by config, or None when it is disabled."""
+    if not config.get("load_journal"):
+        return None
+    # An in-memory warehouse starts empty every run, so its commits are not kept
+    path = None if config.get("storage_backend") == "memory" else \
+        config.get("load_journal_path", DEFAULT_LOAD_JOURNAL_PATH)
+    return LoadJournal(path, coverage_source(config),
+                       config.get("load_journal_empty_settle_days", DEFAULT_EMPTY_SETTLE_DAYS))
@@ -0,0 +1,181 @@
+"""
+Load daily underlying prices (Alpha Vantage TIME_SERIES_DAILY_ADJUSTED) next to
+the options tables and keep each symbol's realized volatility up to date.
+
+A symbol with no stored prices gets its full history in one call; after that
+only the compact (last 100 days) series is requested and new dates are
+appended. Realized vol is advanced incrementally from the persisted rolling
+state, so a daily run does O(1) work per symbol.
+
+    python -m utilities.load_underlying_prices
+"""
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+import requests
+
+from utilities.cred_retrieval import get_secret
+from utilities.load_historical_options_data import (ALPHA_VANTAGE_URL, API_MESSAGE_KEYS, DEFAULT_CALLS_PER_MINUTE,
+                                                    create_session_with_retries, get_config)
+from utilities.metrics import METRICS
+from utilities.rate_limiter import TokenBucket
+from utilities.realized_vol import (DEFAULT_RV_STATE_PATH, DEFAULT_WINDOWS, REALIZED_VOL_TABLE,
+                                    RealizedVolStateStore, register_realized_vol_layout, update_realized_vol)
+from utilities.storage import get_storage, register_table_layout
+
+PRICES_TABLE = "underlying.daily_prices"
+COMPACT_DAYS = 100  # trading days returned by outputsize=compact
+
+PRICES_SCHEMA = pa.schema([
+    ('symbol', pa.string()),
+    ('date', pa.date32()),
+    ('open', pa.float64()),
+    ('high', pa.float64()),
+    ('low', pa.float64()),
+    ('close', pa.float64()),
+    ('adjusted_close', pa.float64()),
+    ('volume', pa.int64()),
+    ('dividend_amount', pa.float64()),
+    ('split_coefficient', pa.float64()),
+])
+
+# One file set per symbol locally; a few thousand rows per symbol do not need date partitions
+register_table_layout(PRICES_TABLE, PRICES_SCHEMA, partition_by=("symbol",), bq_partition="MONTH")
+
+_PRICE_FIELDS = {
+    'open': '1. open',
+    'high': '2. high',
+    'low': '3. low',
+    'close': '4. close',
+    'adjusted_close': '5. adjusted close',
+    'volume': '6. volume',
+    'dividend_amount': '7. dividend amount',
+    'split_coefficient': '8. split coefficient',
+}
+
+
+def parse_daily_prices(payload, symbol):
+    """Turn a TIME_SERIES_DAILY_ADJUSTED response into a Table with PRICES_SCHEMA, sorted by date."""
+    series = payload.get("Time Series (Daily)") or {}
+    dates = sorted(series)
+    columns = {'symbol': [symbol] * len(dates), 'date': dates}
+    for column, key in _PRICE_FIELDS.items():
+        columns[column] = [series[date].get(key) for date in dates]
+    table = pa.table({name: pa.array(values, pa.string()) for name, values in columns.items()})
+    return table.cast(PRICES_SCHEMA)
+
+
+def fetch_daily_prices(symbol, session, api_key, rate_limiter, full=False, base_url=ALPHA_VANTAGE_URL):
+    """Fetch one symbol's daily series. Returns a Table, or None if the API returned no data."""
+    outputsize = "full" if full else "compact"
+    url = f"{base_url}?function=TIME_SERIES_DAILY_ADJUSTED&symbol={symbol}&outputsize={outputsize}&apikey={api_key}"
+    METRICS.observe("sleep", rate_limiter.acquire())
+    METRICS.inc("api_calls")
+    print(f"Fetching {outputsize} daily prices for {symbol}...")
+    with METRICS.timer("fetch"):
+        response = session.get(url)
+    if response.status_code != 200:
+        METRICS.inc("http_errors")
+        print(f"Error: Unable to fetch prices for {symbol}. Status code: {response.status_code}")
+        return None
+    payload = response.json()
+    for key in API_MESSAGE_KEYS:
+        if key in payload:
+            METRICS.inc("api_messages")
+            print(f"API message for {symbol} prices: {payload[key]}")
+            return None
+    with METRICS.timer("parse"):
+        return parse_daily_prices(payload, symbol)
+
+
+def process_symbol_prices(symbol, storage, state_store, rate_limiter, session, api_key, config=None):
+    """
+    Append new daily prices for symbol and the realized vol for those dates.
+    The rolling state is only kept once both writes succeeded: after a failed
+    price write it is left as it was, after a failed realized vol write it is
+    dropped and rebuilt from the stored prices on the next run.
+    Returns (price rows written, realized vol rows written).
+    """
+    config = config or {}
+    existing = storage.existing_dates(symbol, PRICES_TABLE)
+    stale_before = (datetime.date.today() - datetime.timedelta(days=COMPACT_DAYS)).isoformat()
+    full = not existing or max(existing) < stale_before
+    prices = fetch_daily_prices(symbol, session, api_key, rate_limiter, full,
+                                config.get("alpha_vantage_url", ALPHA_VANTAGE_URL))
+    if prices is None:
+        return 0, 0
+    dates = [str(d) for d in prices['date'].to_pylist()]
+    new_prices = prices.filter(pa.array([d not in existing for d in dates]))
+    price_rows = storage.write_batch(new_prices, PRICES_TABLE) if new_prices.num_rows else 0
+    if price_rows != new_prices.num_rows:
+        # The prices are fetched again next run; the state must not move past them
+        print(f"Price write for {symbol} failed, realized vol not updated")
+        return price_rows, 0
+
+    try:
+        if state_store.last_date(symbol) is None and existing:
+            # No rolling state yet (first run or state lost): rebuild it from the stored history
+            print(f"Rebuilding realized vol state for {symbol} from stored prices")
+            feed = storage.read_table(PRICES_TABLE, symbol=symbol)
+        else:
+            feed = new_prices
+        realized = update_realized_vol(feed, state_store)
+        if realized.num_rows:
+            stored = storage.existing_dates(symbol, REALIZED_VOL_TABLE)
+            realized_dates = [str(d) for d in realized['date'].to_pylist()]
+            realized = realized.filter(pa.array([d not in stored for d in realized_dates]))
+        rv_rows = storage.write_batch(realized, REALIZED_VOL_TABLE) if realized.num_rows else 0
+    except BaseException:
+        # The state already moved past dates that were not written: forget it so the
+        # next run rebuilds it from the stored prices and writes them
+        state_store.reset(symbol)
+        raise
+    if rv_rows != realized.num_rows:
+        # Forget the state so the next run rebuilds it and rewrites the missing dates
+        state_store.reset(symbol)
+    return price_rows, rv_rows
+
+
+def main(config=None, symbols=None, api_key=None, storage=None):
+    """Load daily prices and realized vol for the S&P 500 universe."""
+    config = dict(config) if config is not None else get_config()
+    if symbols is None:
+        symbols = pd.read_csv("org_files/S&P 500 Constituents.csv")['Symbol'].tolist()
+    if storage is None:
+        storage = get_storage(config)
+    api_key = api_key or get_secret("alpha_vantage_api_key")
+    rate_limiter = TokenBucket(config.get("api_calls_per_minute", DEFAULT_CALLS_PER_MINUTE))
+    windows = config.get("realized_vol_windows", DEFAULT_WINDOWS)
+    state_store = RealizedVolStateStore(config.get("realized_vol_state_path", DEFAULT_RV_STATE_PATH), windows)
+    # The table's columns follow the configured windows, not the defaults
+    register_realized_vol_layout(windows)
+    session = create_session_with_retries()
+    storage.ensure_table(PRICES_TABLE)
+    storage.ensure_table(REALIZED_VOL_TABLE)
+
+    total_prices = 0
+    total_rv = 0
+    failed_symbols = []
+    for i, symbol in enumerate(symbols, 1):
+        try:
+            with METRICS.labels(symbol=symbol):
+                price_rows, rv_rows = process_symbol_prices(symbol, storage, state_store, rate_limiter,
+                                                            session, api_key, config)
+            total_prices += price_rows
+            total_rv += rv_rows
+            print(f"[{i}/{len(symbols)}] {symbol}: {price_rows} new prices, {rv_rows} realized vol rows")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            failed_symbols.append(symbol)
+            print(f"Failed to load prices for {symbol}: {e}")
+        finally:
+            state_store.save()
+
+    print(f"\nLoaded {total_prices} daily prices and {total_rv} realized vol rows for {len(symbols)} symbols")
+    if failed_symbols:
+        print(f"Failed symbols: {', '.join(failed_symbols)}")
+    return {"price_rows": total_prices, "realized_vol_rows": total_rv, "failed_symbols": failed_symbols}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Lightweight in-process instrumentation for the ingestion pipeline.
+
+Stages (fetch, cache, sleep, parse, transform, load) are timed with
+time.perf_counter and accumulated under one lock, so recording a sample costs a
+few microseconds and can stay on in production. Totals are exposed in the
+Prometheus text format for the app's /metrics route; per-symbol and per-date
+breakdowns of the current run feed the structured run summary.
+
+Timers pick up the symbol and date from METRICS.labels(...), which is
+thread-local, so storage backends and helpers do not need them passed in.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+MAX_DATE_ENTRIES = 20000  # per-(symbol, date) breakdowns kept for the run summary
+_DONE = object()
+
+
+class _StageStats:
+    __slots__ = ("count", "seconds", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+    def to_dict(self):
+        return {"count": self.count, "seconds": round(self.seconds, 4)}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages = {}
+        self.counters = {}
+        self.start_run()
+
+    def start_run(self):
+        """Reset the per-run breakdowns (process totals for /metrics keep accumulating)."""
+        with self._lock:
+            self.run_started = time.time()
+            self.run_stages = {}
+            self.run_counters = {}
+            self.symbol_stages = {}
+            self.symbol_counters = {}
+            self.date_stages = OrderedDict()
+
+    @contextmanager
+    def labels(self, **labels):
+        """Attach symbol/date labels to every sample recorded by this thread inside the block."""
+        previous = getattr(self._local, "labels", {})
+        self._local.labels = {**previous, **labels}
+        try:
+            yield
+        finally:
+            self._local.labels = previous
+
+    def _current(self):
+        labels = getattr(self._local, "labels", {})
+        return labels.get("symbol"), labels.get("date")
+
+    def observe(self, stage, seconds):
+        """Record seconds spent in stage for the current symbol and date."""
+        symbol, date = self._current()
+        with self._lock:
+            self.stages.setdefault(stage, _StageStats()).add(seconds)
+            self.run_stages.setdefault(stage, _StageStats()).add(seconds)
+            if symbol is not None:
+                per_symbol = self.symbol_stages.setdefault(symbol, {})
+                per_symbol[stage] = per_symbol.get(stage, 0.0) + seconds
+                if date is not None:
+                    key = (symbol, date)
+                    per_date = self.date_stages.get(key)
+                    if per_date is None:
+                        per_date = self.date_stages[key] = {}
+                        if len(self.date_stages) > MAX_DATE_ENTRIES:
+                            self.date_stages.popitem(last=False)
+                    per_date[stage] = per_date.get(stage, 0.0) + seconds
+
+    def inc(self, name, value=1):
+        """Increment a counter, in total and for the current symbol."""
+        symbol, _ = self._current()
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.run_counters[name] = self.run_counters.get(name, 0) + value
+            if symbol is not None:
+                per_symbol = self.symbol_counters.setdefault(symbol, {})
+                per_symbol[name] = per_symbol.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def timed_iter(self, iterable, stage, spent=None, base_seconds=0.0):
+        """
+        Wrap an iterator so the time spent producing its items is recorded under
+        stage as one observation (plus base_seconds, e.g. the time to the
+        response headers) once it is exhausted or closed. If spent (a
+        one-element list) is given, the time is also added to it as it accrues.
+        """
+        iterator = iter(iterable)
+        total = base_seconds
+        try:
+            while True:
+                started = time.perf_counter()
+                item = next(iterator, _DONE)
+                elapsed = time.perf_counter() - started
+                total += elapsed
+                if spent is not None:
+                    spent[0] += elapsed
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.observe(stage, total)
+
+    def render_prometheus(self, prefix="voldisloc"):
+        """Process-wide totals in the Prometheus text exposition format."""
+        with self._lock:
+            stages = {name: (s.count, s.seconds, list(s.buckets)) for name, s in self.stages.items()}
+            counters = dict(self.counters)
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each ingestion stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name in sorted(stages):
+            count, seconds, buckets = stages[name]
+            cumulative = 0
+            for bound, n in zip(HISTOGRAM_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {seconds:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {count}')
+        for name in sorted(counters):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {counters[name]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, include_dates=True):
+        """Structured breakdown of the current run by stage, symbol and (symbol, date)."""
+        with self._lock:
+            summary = {
+                "run_started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.run_started)),
+                "elapsed_seconds": round(time.time() - self.run_started, 1),
+                "stages": {name: s.to_dict() for name, s in self.run_stages.items()},
+                "counters": dict(self.run_counters),
+                "symbols": {
+                    symbol: {
+                        "stages": {k: round(v, 4) for k, v in self.symbol_stages.get(symbol, {}).items()},
+                        "counters": dict(self.symbol_counters.get(symbol, {})),
+                    }
+                    for symbol in sorted(set(self.symbol_stages) | set(self.symbol_counters))
+                },
+            }
+            if include_dates:
+                summary["dates"] = [
+                    {"symbol": symbol, "date": date, **{k: round(v, 4) for k, v in stages.items()}}
+                    for (symbol, date), stages in self.date_stages.items()
+                ]
+        return summary
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,100 @@
+"""
+Copy the per-symbol option tables (historical_data.<symbol>) into the single
+consolidated options table, partitioned by date and clustered by symbol,
+expiration and type.
+
+Tables are copied in groups: on BigQuery each group is one INSERT ... SELECT
+over a UNION ALL of its tables, so no data passes through this process.
+Pending work is decided per (symbol, date) from one coverage scan of the
+per-symbol tables and one of the target: only chains the target does not
+hold yet are copied, so an interrupted migration, or dates loaded into a
+per-symbol table after its symbol was migrated, are picked up by running it
+again. The per-symbol tables are left in place;
+drop them once the consolidated table has been checked and
+options_table_mode: consolidated is set in config.yaml.
+
+    python -m utilities.migrate_to_consolidated --tables-per-copy 50
+"""
+import argparse
+
+from utilities.storage import CONSOLIDATED_OPTIONS_TABLE, OPTIONS_DATASET, get_storage
+
+DEFAULT_TABLES_PER_COPY = 50
+
+
+def pending_dates(storage, target=CONSOLIDATED_OPTIONS_TABLE):
+    """
+    {per-symbol table: dates of it that target has no rows for yet}, for the
+    tables with any. A table none of whose dates are in target maps to None
+    and is copied whole.
+    """
+    sources = [table_id for table_id in storage.list_tables(OPTIONS_DATASET) if table_id != target]
+    if not sources:
+        return {}
+    migrated = storage.coverage([target])
+    migrated_dates = {}
+    for symbol, date in zip(migrated['symbol'].to_pylist(), migrated['date'].to_pylist()):
+        migrated_dates.setdefault(symbol, set()).add(date)
+    coverage = storage.coverage(sources)
+    loaded = {}
+    for symbol, date in zip(coverage['symbol'].to_pylist(), coverage['date'].to_pylist()):
+        loaded.setdefault(symbol, set()).add(date)
+    source_ids = set(sources)
+    pending = {}
+    for symbol, dates in sorted(loaded.items()):
+        table_id = storage.options_table_id(symbol)
+        if table_id not in source_ids:
+            continue
+        missing = dates - migrated_dates.get(symbol, set())
+        if missing:
+            pending[table_id] = sorted(missing) if symbol in migrated_dates else None
+    return pending
+
+
+def migrate(storage, target=CONSOLIDATED_OPTIONS_TABLE, tables_per_copy=DEFAULT_TABLES_PER_COPY, dry_run=False):
+    """Copy every pending (symbol, date) of the per-symbol tables into target. Returns the number of rows copied."""
+    storage.ensure_table(target)
+    pending = pending_dates(storage, target)
+    tables = list(pending)
+    print(f"{len(tables)} per-symbol tables with dates to migrate into {target}")
+    if dry_run:
+        for table_id in tables:
+            dates = pending[table_id]
+            print(f"Would copy {table_id} ({'all dates' if dates is None else f'{len(dates)} dates'})")
+        return 0
+    total = 0
+    for start in range(0, len(tables), tables_per_copy):
+        group = tables[start:start + tables_per_copy]
+        try:
+            # Tables created before a schema column was added get it first, so the copy can select it
+            for table_id in group:
+                storage.ensure_table(table_id)
+            copied = storage.copy_into(group, target, {table_id: pending[table_id] for table_id in group})
+        except Exception as e:
+            print(f"Failed to copy {group[0]} .. {group[-1]}: {e}")
+            print("Stopping; already migrated dates are skipped when this is run again")
+            break
+        total += copied
+        print(f"Copied {copied} rows from {len(group)} tables "
+              f"({min(start + tables_per_copy, len(tables))}/{len(tables)}), total {total}")
+    return total
+
+
+def main():
+    from utilities.load_historical_options_data import get_config
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="default: consolidated_options_table from config.yaml")
+    parser.add_argument("--tables-per-copy", type=int, default=DEFAULT_TABLES_PER_COPY)
+    parser.add_argument("--dry-run", action="store_true", help="only list the tables that would be copied")
+    args = parser.parse_args()
+    config = get_config()
+    target = args.target or config.get("consolidated_options_table", CONSOLIDATED_OPTIONS_TABLE)
+    # Read the per-symbol tables regardless of the configured mode
+    storage = get_storage({**config, "options_table_mode": "per_symbol"})
+    total = migrate(storage, target, args.tables_per_copy, args.dry_run)
+    print(f"Migrated {total} rows into {target}")
+
+
+if __name__ == "__main__":
+    main()
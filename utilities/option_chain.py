@@ -0,0 +1,187 @@
+"""
+Compact in-memory option chains.
+
+compact_table() turns an OPTIONS_SCHEMA table (or any subset of its columns)
+into its compact form: contractID, symbol, type and expiration are
+dictionary-encoded, the Greeks and implied vol are float32 and the size,
+volume and open interest columns int32. The metric columns of a chain take
+about a third less memory, and over several days each contractID, symbol and
+expiration string is stored once per read.
+
+OptionChain holds a compact table sorted by (symbol, date, expiration, type,
+strike) together with the offset and length of every (symbol, date,
+expiration, type) group, so selecting by any of those keys returns zero-copy
+slices of the same buffers. load_universe_chains returns compact tables; the
+loader's write path stays in OPTIONS_SCHEMA so stored Greeks are not rounded.
+
+    chain = OptionChain.from_table(storage.read_table(table_id, start=start, end=end))
+    puts = chain.select(date="2025-05-02", expiration="2025-06-20", type="put")
+    compute_dislocation_metrics(chain.table)
+"""
+import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.columnar import OPTIONS_SCHEMA
+
+DICTIONARY_COLUMNS = ['contractID', 'symbol', 'type', 'expiration']
+FLOAT32_COLUMNS = ['implied_volatility', 'delta', 'gamma', 'theta', 'vega', 'rho']
+INT32_COLUMNS = ['bid_size', 'ask_size', 'volume', 'open_interest']
+SORT_KEYS = ['symbol', 'date', 'expiration', 'type', 'strike']
+GROUP_KEYS = ['symbol', 'date', 'expiration', 'type']
+
+
+def compact_type(field):
+    """The compact arrow type for an OPTIONS_SCHEMA field."""
+    if field.name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), field.type)
+    if field.name in FLOAT32_COLUMNS:
+        return pa.float32()
+    if field.name in INT32_COLUMNS:
+        return pa.int32()
+    return field.type
+
+
+def compact_schema(schema=OPTIONS_SCHEMA):
+    return pa.schema([pa.field(field.name, compact_type(field)) for field in schema])
+
+
+def compact_table(table):
+    """table with its known option columns in compact form; other columns are kept as they are."""
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name in DICTIONARY_COLUMNS and not pa.types.is_dictionary(column.type):
+            column = pc.dictionary_encode(column)
+        elif name in FLOAT32_COLUMNS and column.type != pa.float32():
+            column = pc.cast(column, pa.float32(), safe=False)
+        elif name in INT32_COLUMNS and column.type != pa.int32():
+            # Sizes and volumes are far below 2**31
+            column = pc.cast(column, pa.int32())
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+
+def expand_table(table, schema=OPTIONS_SCHEMA):
+    """A compact table cast back to the plain types of schema (for writing), keeping its columns."""
+    fields = [schema.field(name) if name in schema.names else table.schema.field(name) for name in table.column_names]
+    return table.cast(pa.schema(fields))
+
+
+def _decoded(table):
+    """table with dictionary columns cast back to their value types."""
+    return table.cast(pa.schema([pa.field(field.name, field.type.value_type)
+                                 if pa.types.is_dictionary(field.type) else field for field in table.schema]))
+
+
+def _group_index(table):
+    """(symbol, date, expiration, type, offset, length) of each run of equal group keys in a sorted compact table."""
+    change = np.zeros(table.num_rows, dtype=bool)
+    if table.num_rows:
+        change[0] = True
+    for name in GROUP_KEYS:
+        column = table[name].combine_chunks()
+        values = column.indices if pa.types.is_dictionary(column.type) else column.cast(pa.int32())
+        values = pc.fill_null(values, -1).to_numpy(zero_copy_only=False)
+        change[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, table.num_rows))
+    heads = _decoded(table.select(GROUP_KEYS).take(pa.array(starts, pa.int64())))
+    return pa.table({
+        'symbol': heads['symbol'],
+        'date': heads['date'],
+        'expiration': heads['expiration'],
+        'type': heads['type'],
+        'offset': pa.array(starts, pa.int64()),
+        'length': pa.array(lengths, pa.int64()),
+    })
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    return value
+
+
+class OptionChain:
+    """
+    A compact chain table sorted by SORT_KEYS plus its group index. Build it
+    with from_table(); select() and concat() never copy the column buffers.
+    """
+
+    def __init__(self, table, groups):
+        self.table = table
+        self.groups = groups
+
+    @classmethod
+    def from_table(cls, table):
+        """Sort table (plain or compact) by SORT_KEYS and compact it. Needs the GROUP_KEYS columns."""
+        keys = [(name, 'ascending') for name in SORT_KEYS if name in table.column_names]
+        # Dictionary columns cannot be sort keys: sort the plain values, then encode
+        table = compact_table(_decoded(table).sort_by(keys).combine_chunks())
+        return cls(table, _group_index(table))
+
+    @classmethod
+    def concat(cls, chains):
+        """One chain over several (e.g. one per day or per symbol), sharing their buffers."""
+        chains = [chain for chain in chains if chain.num_rows]
+        if not chains:
+            return cls.from_table(compact_schema().empty_table())
+        groups, offset = [], 0
+        for chain in chains:
+            groups.append(chain.groups.set_column(
+                chain.groups.schema.get_field_index('offset'), 'offset',
+                pc.add(chain.groups['offset'], offset)))
+            offset += chain.num_rows
+        return cls(pa.concat_tables([chain.table for chain in chains], promote_options="permissive"),
+                   pa.concat_tables(groups))
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, name):
+        return self.table[name]
+
+    def select(self, symbol=None, date=None, expiration=None, type=None):
+        """The contracts matching every given key, as a chain of zero-copy slices."""
+        mask = None
+        for name, value in (('symbol', symbol), ('date', date), ('expiration', expiration), ('type', type)):
+            if value is None:
+                continue
+            if name in ('date', 'expiration'):
+                value = pa.scalar(_as_date(value), pa.date32())
+            match = pc.equal(self.groups[name], value)
+            mask = match if mask is None else pc.and_(mask, match)
+        groups = self.groups if mask is None else self.groups.filter(mask)
+        offsets = groups['offset'].to_numpy()
+        lengths = groups['length'].to_numpy()
+        if len(offsets) == 0:
+            return OptionChain(self.table.slice(0, 0), groups)
+        # Adjacent groups are merged into one slice
+        starts = np.concatenate(([True], offsets[1:] != offsets[:-1] + lengths[:-1]))
+        run_starts = np.flatnonzero(starts)
+        run_ends = np.append(run_starts[1:], len(offsets))
+        slices = [self.table.slice(offsets[s], int(offsets[e - 1] + lengths[e - 1] - offsets[s]))
+                  for s, e in zip(run_starts, run_ends)]
+        new_offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        groups = groups.set_column(groups.schema.get_field_index('offset'), 'offset', pa.array(new_offsets, pa.int64()))
+        table = slices[0] if len(slices) == 1 else pa.concat_tables(slices)
+        return OptionChain(table, groups)
+
+    def expirations(self, symbol=None, date=None):
+        """Sorted expirations listed for symbol on date (or anywhere in the chain)."""
+        groups = self.select(symbol=symbol, date=date).groups
+        return sorted(set(groups['expiration'].to_pylist()))
+
+    def to_table(self, schema=OPTIONS_SCHEMA):
+        """The contracts as a plain table with schema's types, e.g. for writing."""
+        return expand_table(self.table, schema)
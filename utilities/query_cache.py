@@ -0,0 +1,107 @@
+"""
+In-process LRU + TTL cache for the app's read endpoints.
+
+Responses are cached as serialized JSON bytes together with an ETag, so a
+dashboard refresh is answered from memory (or with 304 Not Modified) instead
+of a new warehouse query. Entries are tagged with the symbols and dates they
+cover; when a load writes new dates for a symbol, invalidate() drops every
+entry tagged with that symbol or one of those dates.
+"""
+import datetime
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from utilities.metrics import METRICS
+
+DEFAULT_QUERY_CACHE_ENTRIES = 512
+DEFAULT_QUERY_CACHE_TTL = 300  # seconds
+
+
+class CachedResponse:
+    def __init__(self, body, tags, ttl):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.tags = frozenset(tags)
+        self.expires = time.monotonic() + ttl
+
+
+class QueryCache:
+    def __init__(self, max_entries=DEFAULT_QUERY_CACHE_ENTRIES, ttl=DEFAULT_QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, tags=()):
+        entry = CachedResponse(body, tags, self.ttl)
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def get_or_compute(self, key, compute, tags=()):
+        """
+        Cached response for key, or compute() -> JSON-serializable value,
+        serialized and stored under tags.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            METRICS.inc("query_cache_hits")
+            return entry
+        METRICS.inc("query_cache_misses")
+        with METRICS.timer("query"):
+            body = to_json_bytes(compute())
+        return self.put(key, body, tags)
+
+    def invalidate(self, symbol=None, dates=()):
+        """Drop entries tagged with symbol or any of dates. Returns how many were dropped."""
+        tags = {f"symbol:{symbol}"} if symbol else set()
+        tags.update(f"date:{date}" for date in dates)
+        with self._lock:
+            stale = [key for key, entry in self.entries.items() if entry.tags & tags]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _clean(value):
+    # NaN and infinity are not valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _clean(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clean(v) for v in value]
+    return value
+
+
+def to_json_bytes(value):
+    return json.dumps(_clean(value), default=_json_default, separators=(",", ":")).encode()
+
@@ -0,0 +1,111 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every fetch worker.
+
+    Tokens refill continuously at (calls_per_minute - burst) / 60 per second, so
+    the number of calls made in any rolling 60 second window never exceeds
+    calls_per_minute even when the bucket starts full.
+    """
+
+    def __init__(self, calls_per_minute=75, burst=1):
+        if calls_per_minute <= burst:
+            raise ValueError("calls_per_minute must be larger than burst")
+        self.calls_per_minute = calls_per_minute
+        self.capacity = burst
+        self.rate = (calls_per_minute - burst) / 60.0
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.started = None
+        self.total_acquired = 0
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+
+    def _refill_and_take(self, tokens, last_refill, now):
+        """
+        The refill rule: (tokens left, seconds to wait) after trying to take one
+        token from a bucket that held tokens at last_refill. Waiting is 0 when
+        the token was taken.
+        """
+        tokens = min(self.capacity, tokens + max(0.0, now - last_refill) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def _take(self):
+        """Take a token if one is available. Returns 0 on success, else the seconds to wait."""
+        now = time.monotonic()
+        self.tokens, wait_time = self._refill_and_take(self.tokens, self.last_refill, now)
+        self.last_refill = now
+        return wait_time
+
+    def acquire(self):
+        """
+        Block until one token is available and take it.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait_time = self._take()
+                if wait_time == 0.0:
+                    if self.started is None:
+                        self.started = time.monotonic()
+                    self.total_acquired += 1
+                    self.total_wait += waited
+                    return waited
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def observed_calls_per_minute(self):
+        """Average call rate (of this process) since the first token was handed out."""
+        with self._lock:
+            if self.started is None or self.total_acquired < 2:
+                return 0.0
+            elapsed = time.monotonic() - self.started
+        if elapsed <= 0:
+            return 0.0
+        return (self.total_acquired - 1) / elapsed * 60.0
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a small JSON file guarded by an exclusive
+    flock, so separate worker processes on one machine draw from one shared
+    budget. Only the state storage differs from TokenBucket; the counters
+    cover this process only.
+    """
+
+    def __init__(self, path, calls_per_minute=75, burst=1):
+        super().__init__(calls_per_minute, burst)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _take(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Wall-clock time, since monotonic clocks are not comparable across processes
+            now = time.time()
+            raw = os.read(fd, 4096)
+            try:
+                state = json.loads(raw)
+                tokens, last_refill = float(state["tokens"]), float(state["last_refill"])
+            except (ValueError, KeyError, TypeError):
+                # A new file starts full; a torn one starts empty rather than risk a burst over the quota
+                tokens, last_refill = (float(self.capacity), now) if not raw else (0.0, now)
+            tokens, wait_time = self._refill_and_take(tokens, last_refill, now)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps({"tokens": tokens, "last_refill": now}).encode())
+            return wait_time
+        finally:
+            os.close(fd)
@@ -0,0 +1,218 @@
+"""
+Incremental realized volatility and volatility risk premium (VRP).
+
+Each symbol keeps a small rolling state (last close plus the squared log
+returns and squared log ranges inside the largest window, with running sums
+per window), so appending one new trading day costs O(1) per symbol instead
+of rescanning the price history. The state is persisted as JSON between runs.
+
+Estimators, annualized with 252 trading days:
+- close-to-close: sqrt(252 * mean(ln(C_t * split_t / C_t-1)^2)) (zero-mean
+  returns on raw closes, corrected on split days)
+- Parkinson range: sqrt(252 * mean(ln(H_t / L_t)^2) / (4 ln 2))
+"""
+import json
+import math
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.storage import register_table_layout
+
+DEFAULT_WINDOWS = (10, 21, 63)
+DEFAULT_RV_STATE_PATH = ".cache/realized_vol_state.json"
+TRADING_DAYS_PER_YEAR = 252
+PARKINSON_FACTOR = 1.0 / (4.0 * math.log(2.0))
+
+REALIZED_VOL_TABLE = "underlying.realized_vol"
+
+
+def _rv_columns(windows):
+    return [f"rv_cc_{w}" for w in windows] + [f"rv_pk_{w}" for w in windows]
+
+
+def realized_vol_schema(windows=DEFAULT_WINDOWS):
+    return pa.schema([('symbol', pa.string()), ('date', pa.date32())]
+                     + [(name, pa.float64()) for name in _rv_columns(windows)])
+
+
+def register_realized_vol_layout(windows=DEFAULT_WINDOWS):
+    """Declare the realized vol table with columns for windows (the configured realized_vol_windows)."""
+    register_table_layout(REALIZED_VOL_TABLE, realized_vol_schema(tuple(sorted(windows))), partition_by=("symbol",),
+                          bq_partition="MONTH")
+
+
+register_realized_vol_layout()
+
+
+class RollingRealizedVol:
+    """
+    Rolling close-to-close and Parkinson variance for one symbol.
+    update() is O(len(windows)) regardless of how much history was seen.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS):
+        self.windows = tuple(sorted(windows))
+        self.last_date = None
+        self.last_close = None
+        maxlen = self.windows[-1]
+        self.cc = deque(maxlen=maxlen)  # squared log returns
+        self.pk = deque(maxlen=maxlen)  # squared log high/low ranges
+        self.cc_sums = {w: 0.0 for w in self.windows}
+        self.pk_sums = {w: 0.0 for w in self.windows}
+
+    def _push(self, values, sums, value):
+        # Subtract the value leaving each window before appending the new one
+        n = len(values)
+        for w in self.windows:
+            if n >= w:
+                sums[w] -= values[n - w]
+            sums[w] += value
+        values.append(value)
+
+    def update(self, date, high, low, close, split=1.0):
+        """
+        Add one trading day (split is the day's split coefficient, e.g. 4.0 for 4:1).
+        Dates at or before the last one seen are ignored.
+        Returns the realized vols for date (None until a window is full).
+        """
+        if self.last_date is not None and date <= self.last_date:
+            return None
+        if self.last_close and close and close > 0:
+            self._push(self.cc, self.cc_sums, math.log(close * (split or 1.0) / self.last_close) ** 2)
+        if high and low and high > 0 and low > 0:
+            self._push(self.pk, self.pk_sums, math.log(high / low) ** 2 * PARKINSON_FACTOR)
+        self.last_date = date
+        if close and close > 0:
+            self.last_close = close
+        return self.current()
+
+    def current(self):
+        result = {}
+        for w in self.windows:
+            result[f"rv_cc_{w}"] = _annualize(self.cc_sums[w], w) if len(self.cc) >= w else None
+            result[f"rv_pk_{w}"] = _annualize(self.pk_sums[w], w) if len(self.pk) >= w else None
+        return result
+
+    def to_dict(self):
+        return {"windows": list(self.windows), "last_date": self.last_date, "last_close": self.last_close,
+                "cc": list(self.cc), "pk": list(self.pk)}
+
+    @classmethod
+    def from_dict(cls, state):
+        rv = cls(state["windows"])
+        rv.last_date = state["last_date"]
+        rv.last_close = state["last_close"]
+        # Recompute the sums from the stored values so rounding drift never persists
+        for value in state["cc"]:
+            rv._push(rv.cc, rv.cc_sums, value)
+        for value in state["pk"]:
+            rv._push(rv.pk, rv.pk_sums, value)
+        return rv
+
+
+def _annualize(sum_of_squares, window):
+    return math.sqrt(max(sum_of_squares, 0.0) / window * TRADING_DAYS_PER_YEAR)
+
+
+class RealizedVolStateStore:
+    """Per-symbol RollingRealizedVol state persisted as one JSON document, rewritten atomically."""
+
+    def __init__(self, path=DEFAULT_RV_STATE_PATH, windows=DEFAULT_WINDOWS):
+        self.path = path
+        self.windows = tuple(sorted(windows))
+        self._lock = threading.Lock()
+        self.states = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    stored = json.load(f).get("symbols", {})
+                self.states = {symbol: RollingRealizedVol.from_dict(state) for symbol, state in stored.items()
+                               if tuple(state["windows"]) == self.windows}
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not read realized vol state from {path}: {e}")
+
+    def get(self, symbol):
+        with self._lock:
+            return self.states.setdefault(symbol, RollingRealizedVol(self.windows))
+
+    def reset(self, symbol):
+        with self._lock:
+            self.states.pop(symbol, None)
+
+    def last_date(self, symbol):
+        with self._lock:
+            state = self.states.get(symbol)
+            return state.last_date if state is not None else None
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            payload = {"symbols": {symbol: state.to_dict() for symbol, state in self.states.items()}}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+
+def update_realized_vol(prices, state_store):
+    """
+    Feed new daily prices (a Table with symbol, date, high, low, close and
+    split_coefficient) through each symbol's rolling state.
+    Returns a Table with the realized vols of every new (symbol, date).
+    """
+    windows = state_store.windows
+    prices = prices.sort_by([('symbol', 'ascending'), ('date', 'ascending')])
+    rows = {name: [] for name in ['symbol', 'date'] + _rv_columns(windows)}
+    symbols = prices['symbol'].to_pylist()
+    dates = [str(d) for d in prices['date'].to_pylist()]
+    highs = prices['high'].to_pylist()
+    lows = prices['low'].to_pylist()
+    closes = prices['close'].to_pylist()
+    splits = prices['split_coefficient'].to_pylist()
+    for symbol, date, high, low, close, split in zip(symbols, dates, highs, lows, closes, splits):
+        result = state_store.get(symbol).update(date, high, low, close, split)
+        if result is None:
+            continue
+        rows['symbol'].append(symbol)
+        rows['date'].append(date)
+        for name, value in result.items():
+            rows[name].append(value)
+    table = pa.table({name: pa.array(values) for name, values in rows.items()})
+    return table.cast(realized_vol_schema(windows)) if table.num_rows else realized_vol_schema(windows).empty_table()
+
+
+def join_vrp(realized, metrics, short_window=21, long_window=63):
+    """
+    Join realized vol with the dislocation metrics' ATM implied vols on
+    (symbol, date): vrp_short = atm_iv_short - rv_cc_<short_window> (both about
+    one month), vrp_long = atm_iv_long - rv_cc_<long_window>.
+    """
+    joined = metrics.select(['symbol', 'date', 'atm_iv_short', 'atm_iv_long']).join(
+        realized.select(['symbol', 'date', f"rv_cc_{short_window}", f"rv_cc_{long_window}"]),
+        keys=['symbol', 'date'], join_type='inner')
+    short_rv = joined[f"rv_cc_{short_window}"].to_numpy(zero_copy_only=False).astype(np.float64)
+    long_rv = joined[f"rv_cc_{long_window}"].to_numpy(zero_copy_only=False).astype(np.float64)
+    short_iv = joined['atm_iv_short'].to_numpy(zero_copy_only=False).astype(np.float64)
+    long_iv = joined['atm_iv_long'].to_numpy(zero_copy_only=False).astype(np.float64)
+    return joined.append_column('vrp_short', pa.array(short_iv - short_rv, from_pandas=True)) \
+                 .append_column('vrp_long', pa.array(long_iv - long_rv, from_pandas=True)) \
+                 .sort_by([('symbol', 'ascending'), ('date', 'ascending')])
+
+
+def compute_vrp(storage, symbols, start, end=None):
+    """Daily VRP series for symbols over [start, end], from stored chains and realized vol."""
+    from utilities.dislocation_metrics import compute_universe_metrics
+
+    metrics = compute_universe_metrics(storage, symbols, start, end)
+    realized = storage.read_table(REALIZED_VOL_TABLE, start=start, end=end or start)
+    realized = realized.filter(pc.is_in(realized['symbol'], pa.array(list(symbols))))
+    return join_vrp(realized, metrics)
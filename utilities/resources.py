@@ -0,0 +1,95 @@
+"""
+Process-wide cache of configuration, secrets and warehouse clients.
+
+config.yaml is parsed once and re-read only when the file changes, each
+secret is fetched from Secret Manager once per secret_ttl_seconds, and one
+Secret Manager client and one BigQuery client per project are shared by every
+symbol, chunk and request in the process. The Google client libraries are
+imported on first use, so a service that never touches them does not pay
+for their import at startup.
+
+Clients are rebuilt after a fork (e.g. in ProcessPoolExecutor workers),
+since gRPC channels cannot be shared with a child process.
+"""
+import os
+import threading
+import time
+
+CONFIG_PATH = "config.yaml"
+DEFAULT_SECRET_TTL = 3600  # seconds a fetched secret is reused
+
+_lock = threading.RLock()
+_configs = {}  # path -> (mtime, config)
+_secrets = {}  # (project_id, secret_id) -> (fetched_at, value)
+_clients = {}  # (kind, project_id) -> (pid, client)
+
+
+def get_config(path=CONFIG_PATH):
+    """
+    The parsed config file, shared by the whole process (copy it before
+    changing it). Re-read only when its modification time changes.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _configs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        import yaml
+
+        print(f"Loading {path}...")
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+        _configs[path] = (mtime, config)
+        return config
+
+
+def shared_client(kind, project_id, build):
+    """One client of kind per project and process, created by build() on first use."""
+    key = (kind, project_id)
+    with _lock:
+        cached = _clients.get(key)
+        if cached is not None and cached[0] == os.getpid():
+            return cached[1]
+        client = build()
+        _clients[key] = (os.getpid(), client)
+        return client
+
+
+def bigquery_client(project_id):
+    """The process's BigQuery client for project_id."""
+    def build():
+        from google.cloud import bigquery
+        return bigquery.Client(project=project_id)
+
+    return shared_client("bigquery", project_id, build)
+
+
+def secret_manager_client():
+    def build():
+        from google.cloud import secretmanager
+        return secretmanager.SecretManagerServiceClient()
+
+    return shared_client("secretmanager", None, build)
+
+
+def get_secret(secret_id, project_id=None, ttl=None):
+    """
+    Latest version of a Secret Manager secret, fetched at most once per ttl
+    seconds (config secret_ttl_seconds, default DEFAULT_SECRET_TTL).
+    """
+    config = get_config()
+    project_id = project_id or config["project_id"]
+    ttl = ttl if ttl is not None else config.get("secret_ttl_seconds", DEFAULT_SECRET_TTL)
+    key = (project_id, secret_id)
+    with _lock:
+        cached = _secrets.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+    name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
+    response = secret_manager_client().access_secret_version(request={"name": name})
+    value = response.payload.data.decode("UTF-8")
+    print(f"Retrieved secret {secret_id} from Google Cloud Secret Manager.")
+    with _lock:
+        _secrets[key] = (time.monotonic(), value)
+    return value
+
@@ -0,0 +1,181 @@
+"""
+On-disk cache of raw HISTORICAL_OPTIONS responses.
+
+Response bodies are gzip-compressed and stored by the SHA-256 of their
+uncompressed bytes (blobs/<aa>/<sha>.json.gz), so identical payloads are kept
+once. A small index file per (symbol, date) points at the blob. When the blobs
+grow past max_bytes the least recently used ones are evicted.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = ".cache/responses"
+DEFAULT_CACHE_MAX_BYTES = 1024 ** 3
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class CacheWriter:
+    """
+    Tees a response body into a temporary compressed file while it is being
+    consumed. Nothing becomes visible in the cache until commit() is called.
+    """
+
+    def __init__(self, cache, symbol, date):
+        self.cache = cache
+        self.symbol = symbol
+        self.date = date
+        self.sha = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.tmp_dir, suffix=".gz")
+        self.file = gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb", compresslevel=6)
+
+    def write(self, chunk):
+        self.sha.update(chunk)
+        self.file.write(chunk)
+
+    def tee(self, chunks):
+        """Yield chunks unchanged while writing them to the cache file."""
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+    def commit(self):
+        fileobj = self.file.fileobj
+        self.file.close()
+        fileobj.close()
+        self.cache._store(self.symbol, self.date, self.sha.hexdigest(), self.tmp_path)
+
+    def abort(self):
+        fileobj = self.file.fileobj
+        self.file.close()
+        fileobj.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ResponseCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.index_dir = os.path.join(root, "index")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for path in (self.blob_dir, self.index_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.total_bytes = sum(os.path.getsize(path) for path in self._blob_paths())
+        self.hits = 0
+        self.misses = 0
+
+    def _blob_paths(self):
+        for dirpath, _, filenames in os.walk(self.blob_dir):
+            for filename in filenames:
+                yield os.path.join(dirpath, filename)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.json.gz")
+
+    def _index_path(self, symbol, date):
+        return os.path.join(self.index_dir, symbol.upper(), date)
+
+    def _lookup(self, symbol, date):
+        try:
+            with open(self._index_path(symbol, date), "r") as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = self._blob_path(digest)
+        return path if os.path.exists(path) else None
+
+    def contains(self, symbol, date):
+        return self._lookup(symbol, date) is not None
+
+    def iter_chunks(self, symbol, date):
+        """
+        Return an iterator over the decompressed response body for (symbol, date),
+        or None if it is not cached.
+        """
+        path = self._lookup(symbol, date)
+        if path is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Touch the blob so eviction treats it as recently used
+        os.utime(path)
+        return self._read_blob(path)
+
+    def _read_blob(self, path):
+        with gzip.open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+
+    def writer(self, symbol, date):
+        return CacheWriter(self, symbol, date)
+
+    def put(self, symbol, date, body):
+        """Store a complete response body."""
+        writer = self.writer(symbol, date)
+        writer.write(body)
+        writer.commit()
+
+    def _store(self, symbol, date, digest, tmp_path):
+        blob_path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        with self._lock:
+            if os.path.exists(blob_path):
+                os.remove(tmp_path)
+                os.utime(blob_path)
+            else:
+                os.replace(tmp_path, blob_path)
+                self.total_bytes += os.path.getsize(blob_path)
+            index_path = self._index_path(symbol, date)
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            tmp_index = f"{index_path}.tmp{threading.get_ident()}"
+            with open(tmp_index, "w") as f:
+                f.write(digest)
+            os.replace(tmp_index, index_path)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used blobs until the cache is 90% of max_bytes."""
+        target = self.max_bytes * 0.9
+        blobs = sorted(
+            ((os.path.getmtime(path), os.path.getsize(path), path) for path in self._blob_paths()),
+        )
+        evicted = 0
+        for _, size, path in blobs:
+            if self.total_bytes <= target:
+                break
+            os.remove(path)
+            self.total_bytes -= size
+            evicted += 1
+        # Index entries pointing at evicted blobs are ignored by _lookup and
+        # overwritten on the next fetch, so they are not cleaned up here.
+        print(f"Response cache evicted {evicted} blobs, {self.total_bytes / 1e6:.1f} MB remain")
+
+    def cached_dates(self, symbol):
+        """Sorted list of dates with a cached response for symbol."""
+        symbol_dir = os.path.join(self.index_dir, symbol.upper())
+        if not os.path.isdir(symbol_dir):
+            return []
+        return sorted(date for date in os.listdir(symbol_dir)
+                      if ".tmp" not in date and self._lookup(symbol, date) is not None)
+
+    def cached_symbols(self):
+        return sorted(os.listdir(self.index_dir))
+
+
+def get_response_cache(config):
+    """Build the response cache described by config, or None unless cache_enabled is set."""
+    if not config.get("cache_enabled", False):
+        return None
+    return ResponseCache(
+        config.get("cache_dir", DEFAULT_CACHE_DIR),
+        config.get("cache_max_bytes", DEFAULT_CACHE_MAX_BYTES)
+    )
@@ -0,0 +1,264 @@
+"""
+Sharded backfill: split the universe across N worker processes (or Cloud Run
+job tasks) that share one API-call budget.
+
+Work units are symbols, or (symbol, month) pairs with --unit month, assigned
+to shards by a stable hash, so every worker computes its own share without
+talking to the others and a shard always gets the same units. Workers on one
+machine draw from a FileTokenBucket in the shard directory; Cloud Run tasks,
+which share no disk, each take an equal slice of api_calls_per_minute.
+
+Each worker runs the normal loader for its units and writes its progress to
+<shard_dir>/shard-XXX-of-YYY.json. A failed shard can be rerun alone; units
+it already finished are skipped.
+
+    python -m utilities.sharding run --shards 4
+    python -m utilities.sharding status --shards 4
+    python -m utilities.sharding worker --shard 2 --shards 4   # retry one shard
+"""
+import argparse
+import calendar
+import datetime
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+from utilities.jobs import Job, JobStateStore
+from utilities.rate_limiter import FileTokenBucket, TokenBucket
+
+DEFAULT_SHARD_DIR = ".cache/shards"
+PROGRESS_INTERVAL = 5  # seconds between progress file updates
+
+
+def shard_of(key, shard_count):
+    """Stable shard index for a unit key (unlike hash(), the same in every process)."""
+    return zlib.crc32(key.encode()) % shard_count
+
+
+def month_windows(date_start, date_end):
+    """(YYYY-MM, first day, last day) for each month overlapping [date_start, date_end]."""
+    start = datetime.date.fromisoformat(str(date_start)[:10])
+    end = datetime.date.fromisoformat(str(date_end)[:10])
+    windows = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        first = max(start, datetime.date(year, month, 1))
+        last = min(end, datetime.date(year, month, calendar.monthrange(year, month)[1]))
+        windows.append((f"{year:04d}-{month:02d}", first.isoformat(), last.isoformat()))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return windows
+
+
+def plan_shard(symbols, shard_index, shard_count, date_start, date_end, unit="symbol"):
+    """
+    The shard's work as [(label, start, end, symbols)]: one window over the
+    whole range for symbol units, one per month for (symbol, month) units.
+    """
+    if unit == "symbol":
+        mine = [s for s in symbols if shard_of(s, shard_count) == shard_index]
+        return [("all", str(date_start), str(date_end), mine)] if mine else []
+    if unit != "month":
+        raise ValueError(f"Unknown shard unit: {unit}")
+    plan = []
+    for label, start, end in month_windows(date_start, date_end):
+        mine = [s for s in symbols if shard_of(f"{s}:{label}", shard_count) == shard_index]
+        if mine:
+            plan.append((label, start, end, mine))
+    return plan
+
+
+def shard_prefix(shard_dir, shard_index, shard_count):
+    return os.path.join(shard_dir, f"shard-{shard_index:03d}-of-{shard_count:03d}")
+
+
+def shard_rate_limiter(config, shard_count, shard_dir):
+    """
+    The shard's rate limiter. Cloud Run tasks each get an equal fractional
+    slice of api_calls_per_minute, so together they never exceed it; a task
+    count at or above api_calls_per_minute leaves no slice and is rejected.
+    """
+    calls_per_minute = config.get("api_calls_per_minute", 75)
+    if os.environ.get("CLOUD_RUN_TASK_COUNT"):
+        # Tasks run in separate containers: split the quota statically
+        if shard_count >= calls_per_minute:
+            raise ValueError(f"{shard_count} tasks cannot share {calls_per_minute} calls/minute; "
+                             f"run fewer than {calls_per_minute} tasks")
+        return TokenBucket(calls_per_minute / shard_count)
+    return FileTokenBucket(os.path.join(shard_dir, "rate_limit.json"), calls_per_minute)
+
+
+class ShardProgress:
+    """Writes a shard's progress to its JSON file every few seconds while it runs."""
+
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+        self.job = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(PROGRESS_INTERVAL):
+            self.write()
+
+    def start(self):
+        self.write()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def write(self):
+        payload = dict(self.info, updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        if self.job is not None:
+            payload["current_job"] = self.job.to_dict()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_shard(shard_index, shard_count, config=None, symbols=None, unit="symbol", shard_dir=None):
+    """Load this shard's units window by window. Returns True when nothing failed."""
+    import pandas as pd
+    import utilities.load_historical_options_data as loader
+
+    config = dict(config) if config is not None else loader.get_config()
+    shard_dir = shard_dir or config.get("shard_dir", DEFAULT_SHARD_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+    if symbols is None:
+        symbols = pd.read_csv("org_files/S&P 500 Constituents.csv")['Symbol'].tolist()
+    date_end = str(config.get("date_end") or pd.Timestamp.today().strftime("%Y-%m-%d"))
+    plan = plan_shard(symbols, shard_index, shard_count, config["date_start"], date_end, unit)
+    prefix = shard_prefix(shard_dir, shard_index, shard_count)
+    rate_limiter = shard_rate_limiter(config, shard_count, shard_dir)
+    # Files a worker rewrites wholesale get one copy per shard; listing windows
+    # are merged on save, so the shards share them
+    shard_config = {
+        **config,
+        "summary_path": f"{prefix}.summary.json",
+        "coverage_index_path": f"{prefix}.coverage.json",
+        "listing_windows_path": os.path.join(shard_dir, "listing_windows.json"),
+    }
+    if unit == "month":
+        # Probe each symbol's listing window over the whole backfill, not once per month
+        shard_config["listing_probe_range"] = [str(config["date_start"]), date_end]
+    progress = ShardProgress(f"{prefix}.json", {
+        "shard": shard_index, "shards": shard_count, "unit": unit, "pid": os.getpid(), "status": "running",
+        "windows_total": len(plan), "windows_done": 0, "current_window": None,
+        "symbols": len({s for window in plan for s in window[3]}), "rows": 0, "failed": [],
+    })
+    print(f"Shard {shard_index}/{shard_count}: {len(plan)} windows, "
+          f"{progress.info['symbols']} symbols, {rate_limiter.calls_per_minute:g} calls/minute budget")
+    progress.start()
+    try:
+        for label, start, end, window_symbols in plan:
+            progress.info["current_window"] = label
+            job = Job(f"shard-{shard_index}-{label}", JobStateStore(f"{prefix}.{label}.state.json"))
+            job.status = "running"
+            job.started = time.time()
+            progress.job = job
+            summary = loader.main(config={**shard_config, "date_start": start, "date_end": end},
+                                  symbols=window_symbols, job=job, rate_limiter=rate_limiter)
+            job.status = "succeeded"
+            job.finished = time.time()
+            failed = [s for s in window_symbols if job.state_store.get(s).get("status") in ("failed", "partial")]
+            if summary is None:
+                failed = window_symbols
+            else:
+                progress.info["rows"] += summary["total_rows"]
+                failed += summary["failed_symbols"]
+            progress.info["failed"] += [f"{s}:{label}" for s in sorted(set(failed))]
+            progress.info["windows_done"] += 1
+        progress.info["status"] = "failed" if progress.info["failed"] else "succeeded"
+    except BaseException as e:
+        progress.info["status"] = "failed"
+        progress.info["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        progress.info["current_window"] = None
+        progress.stop()
+    return progress.info["status"] == "succeeded"
+
+
+def shard_status(shard_count, shard_dir=DEFAULT_SHARD_DIR):
+    """The latest progress document of every shard (None for shards that never started)."""
+    statuses = []
+    for shard_index in range(shard_count):
+        path = f"{shard_prefix(shard_dir, shard_index, shard_count)}.json"
+        try:
+            with open(path, "r") as f:
+                statuses.append(json.load(f))
+        except (OSError, ValueError):
+            statuses.append(None)
+    return statuses
+
+
+def print_status(shard_count, shard_dir=DEFAULT_SHARD_DIR):
+    for shard_index, status in enumerate(shard_status(shard_count, shard_dir)):
+        if status is None:
+            print(f"shard {shard_index}: not started")
+            continue
+        job = status.get("current_job") or {}
+        print(f"shard {shard_index}: {status['status']}, windows {status['windows_done']}/{status['windows_total']}, "
+              f"rows {status['rows'] + (job.get('rows', 0) if status['status'] == 'running' else 0)}, "
+              f"api calls/min {job.get('api_calls_per_minute', 0.0)}, failed units {len(status['failed'])}, "
+              f"updated {status['updated']}")
+
+
+def coordinate(shard_count, unit="symbol", shard_dir=DEFAULT_SHARD_DIR):
+    """
+    Start one worker process per shard on this machine, sharing the rate-limit
+    file in shard_dir, and wait for all of them. Returns the failed shard indexes.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    workers = {}
+    for shard_index in range(shard_count):
+        log = open(f"{shard_prefix(shard_dir, shard_index, shard_count)}.log", "a")
+        command = [sys.executable, "-m", "utilities.sharding", "worker", "--shard", str(shard_index),
+                   "--shards", str(shard_count), "--unit", unit, "--shard-dir", shard_dir]
+        workers[shard_index] = (subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log)
+    print(f"Started {shard_count} workers, logs and progress in {shard_dir}")
+    while any(process.poll() is None for process, _ in workers.values()):
+        time.sleep(PROGRESS_INTERVAL * 6)
+        print_status(shard_count, shard_dir)
+    failed = []
+    for shard_index, (process, log) in workers.items():
+        log.close()
+        if process.returncode != 0:
+            failed.append(shard_index)
+    print_status(shard_count, shard_dir)
+    for shard_index in failed:
+        print(f"Shard {shard_index} failed; retry it alone with: python -m utilities.sharding worker "
+              f"--shard {shard_index} --shards {shard_count} --unit {unit} --shard-dir {shard_dir}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "worker", "status"])
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("CLOUD_RUN_TASK_COUNT", 1)))
+    parser.add_argument("--shard", type=int, default=int(os.environ.get("CLOUD_RUN_TASK_INDEX", 0)))
+    parser.add_argument("--unit", choices=["symbol", "month"], help="default: shard_unit from config.yaml")
+    parser.add_argument("--shard-dir", help="default: shard_dir from config.yaml")
+    args = parser.parse_args()
+    from utilities.load_historical_options_data import get_config
+    config = get_config()
+    unit = args.unit or config.get("shard_unit", "symbol")
+    shard_dir = args.shard_dir or config.get("shard_dir", DEFAULT_SHARD_DIR)
+    if args.command == "run":
+        return 1 if coordinate(args.shards, unit, shard_dir) else 0
+    if args.command == "status":
+        print_status(args.shards, shard_dir)
+        return 0
+    return 0 if run_shard(args.shard, args.shards, config, unit=unit, shard_dir=shard_dir) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
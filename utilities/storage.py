@@ -0,0 +1,455 @@
+"""
+Storage backends for the options tables.
+
+Every backend stores the same 22-column OPTIONS_SCHEMA and exposes the same
+small interface, so the loader and the analytics code do not care whether
+data lives in BigQuery or in a local partitioned Parquet dataset.
+
+With load_mode: merge, option batches are written through merge_batch: staged
+first, then merged into the table on (contractID, date), so reloading a date
+replaces its rows instead of duplicating them.
+
+Option chains live either in one table per symbol (historical_data.<symbol>)
+or, with options_table_mode: consolidated, in a single table partitioned by
+date and clustered by symbol, expiration and type. Code that reads or writes
+chains asks the backend for the table via storage.options_table_id(symbol).
+
+Other datasets (underlying prices, derived analytics) register their own
+schema with register_table_layout; every table has symbol and date columns.
+"""
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.columnar import OPTIONS_SCHEMA, concat_batches
+from utilities.metrics import METRICS
+
+DEFAULT_LOCAL_STORAGE_DIR = "data/warehouse"
+OPTIONS_DATASET = "historical_data"
+CONSOLIDATED_OPTIONS_TABLE = f"{OPTIONS_DATASET}.options"
+
+# Per-dataset (or per-table) layout: arrow schema, local hive partition columns and BigQuery clustering.
+# Options tables are laid out as <table>/date=YYYY-MM-DD/symbol=XXX/part-*.parquet
+TABLE_LAYOUTS = {
+    OPTIONS_DATASET: {
+        "schema": OPTIONS_SCHEMA,
+        "partition_by": ("date", "symbol"),
+        "cluster_by": ("symbol", "expiration", "type"),
+        "bq_partition": "DAY",
+    },
+}
+
+
+def register_table_layout(name, schema, partition_by=("date", "symbol"), cluster_by=("symbol",),
+                          bq_partition="DAY"):
+    """
+    Declare the schema and layout of a table (name = dataset.table) or of every
+    table in a dataset (name = dataset). bq_partition is the BigQuery time
+    partitioning on date (DAY, MONTH or YEAR).
+    """
+    TABLE_LAYOUTS[name] = {"schema": schema, "partition_by": tuple(partition_by),
+                           "cluster_by": tuple(cluster_by), "bq_partition": bq_partition}
+
+
+def table_layout(table_id):
+    if table_id in TABLE_LAYOUTS:
+        return TABLE_LAYOUTS[table_id]
+    return TABLE_LAYOUTS.get(table_id.split('.')[0], TABLE_LAYOUTS[OPTIONS_DATASET])
+
+
+def _partitioning(layout):
+    # pyarrow.dataset imports pandas, so it is imported where used to keep startup light
+    import pyarrow.dataset as ds
+    fields = [layout["schema"].field(name) for name in layout["partition_by"]]
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+MERGE_KEYS = ("contractID", "date")
+
+COVERAGE_SCHEMA = pa.schema([
+    ('symbol', pa.string()),
+    ('date', pa.string()),
+    ('row_count', pa.int64()),
+    ('loaded_at', pa.string()),
+])
+
+
+def coverage_table(tables):
+    """Group (symbol, date, collected_date) rows into COVERAGE_SCHEMA."""
+    if not tables:
+        return COVERAGE_SCHEMA.empty_table()
+    rows = pa.concat_tables(tables)
+    grouped = rows.group_by(["symbol", "date"]).aggregate([("symbol", "count"), ("collected_date", "max")])
+    return pa.table({
+        'symbol': grouped['symbol'],
+        'date': grouped['date'].cast(pa.string()),
+        'row_count': grouped['symbol_count'].cast(pa.int64()),
+        'loaded_at': grouped['collected_date_max'].cast(pa.string()),
+    }, schema=COVERAGE_SCHEMA)
+
+
+def merge_key(table, keys=MERGE_KEYS):
+    """One string per row identifying it by keys (contractID|date by default)."""
+    columns = [pc.fill_null(pc.cast(table[name], pa.string()), "") for name in keys]
+    return pc.binary_join_element_wise(*columns, "|") if len(columns) > 1 else columns[0]
+
+
+def dedupe_batch(batch, keys=MERGE_KEYS):
+    """Drop rows whose keys repeat within batch, keeping the last occurrence."""
+    if batch.num_rows == 0:
+        return batch
+    numbered = pa.table({'key': merge_key(batch, keys), 'row': pa.array(range(batch.num_rows), pa.int64())})
+    last = numbered.group_by('key').aggregate([('row', 'max')])['row_max']
+    if len(last) == batch.num_rows:
+        return batch
+    return batch.take(pc.take(last, pc.sort_indices(last)))
+
+
+def options_table_id(symbol):
+    """Per-symbol table holding the option chains for symbol, e.g. historical_data.aapl."""
+    return f"{OPTIONS_DATASET}.{symbol.lower()}"
+
+
+class OptionsStorage:
+    """Interface implemented by every storage backend."""
+
+    # Set by get_storage when options_table_mode is consolidated
+    consolidated_table = None
+
+    def options_table_id(self, symbol):
+        """Table holding symbol's option chains: the consolidated table if configured, else the per-symbol one."""
+        return self.consolidated_table or options_table_id(symbol)
+
+    def ensure_table(self, table_id):
+        """Create the dataset/table for table_id if it does not exist yet."""
+        raise NotImplementedError
+
+    def write_batch(self, batch, table_id):
+        """Append a pyarrow Table with the table's schema. Returns the number of rows written."""
+        raise NotImplementedError
+
+    def merge_batch(self, batch, table_id, keys=MERGE_KEYS):
+        """
+        Write batch so that each key appears once in the table: rows whose keys
+        already exist are replaced. Returns the number of rows merged (0 on failure).
+        """
+        raise NotImplementedError
+
+    def existing_dates(self, symbol, table_id):
+        """Set of YYYY-MM-DD dates that already have data for symbol."""
+        raise NotImplementedError
+
+    def read_table(self, table_id, symbol=None, start=None, end=None, columns=None):
+        """Read rows as a pyarrow Table, optionally filtered by symbol and date range."""
+        raise NotImplementedError
+
+    def query(self, sql, params=None):
+        """Run a SQL query and return the result as a pyarrow Table."""
+        raise NotImplementedError
+
+    def list_tables(self, dataset_id):
+        """Ids (dataset.table) of the tables in dataset_id."""
+        raise NotImplementedError
+
+    def symbols(self, table_id):
+        """Set of symbols that have rows in table_id."""
+        table = self.read_table(table_id, columns=["symbol"])
+        return set(pc.unique(table["symbol"]).to_pylist())
+
+    def coverage(self, table_ids):
+        """
+        Table of (symbol, date, row_count, loaded_at) over the given option
+        tables, loaded_at being the latest collected_date of the rows.
+        Raises when the tables cannot be read, never returns a partial answer.
+        """
+        tables = [self.read_table(table_id, columns=["symbol", "date", "collected_date"]) for table_id in table_ids]
+        return coverage_table([table for table in tables if table.num_rows])
+
+    def copy_into(self, source_ids, target_id, dates=None):
+        """
+        Append the rows of the source tables to target_id. dates, when given,
+        maps a source table to the only dates (YYYY-MM-DD) to copy from it; a
+        table it maps to None is copied whole. Returns the number of rows copied.
+        """
+        copied = 0
+        for source_id in source_ids:
+            table = self.read_table(source_id)
+            wanted = (dates or {}).get(source_id)
+            if wanted is not None:
+                table = table.filter(pc.is_in(pc.cast(table['date'], pa.string()), pa.array(list(wanted), pa.string())))
+            copied += self.write_batch(table, target_id)
+        return copied
+
+
+class LocalParquetStorage(OptionsStorage):
+    """
+    Tables stored as Parquet under root, partitioned by date and symbol (or as
+    declared in the dataset's layout).
+    A table_id such as historical_data.aapl maps to root/historical_data/aapl.
+    SQL queries run through DuckDB.
+    """
+
+    def __init__(self, root=DEFAULT_LOCAL_STORAGE_DIR):
+        self.root = root
+
+    def table_path(self, table_id):
+        dataset_id, table_name = table_id.split('.')
+        return os.path.join(self.root, dataset_id, table_name)
+
+    def ensure_table(self, table_id):
+        os.makedirs(self.table_path(table_id), exist_ok=True)
+
+    def write_batch(self, batch, table_id):
+        import pyarrow.dataset as ds
+        if isinstance(batch, list):
+            with METRICS.timer("transform"):
+                batch = concat_batches(batch)
+        if batch.num_rows == 0:
+            print("Warning: Empty batch received, skipping write")
+            return 0
+        path = self.table_path(table_id)
+        with METRICS.timer("load"):
+            ds.write_dataset(
+                batch,
+                path,
+                format="parquet",
+                partitioning=_partitioning(table_layout(table_id)),
+                basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+        METRICS.inc("load_jobs")
+        METRICS.inc("rows_loaded", batch.num_rows)
+        print(f"Wrote {batch.num_rows} rows to {path}")
+        return batch.num_rows
+
+    def merge_batch(self, batch, table_id, keys=MERGE_KEYS):
+        """
+        Merge per (date, symbol) partition: the existing rows not replaced by
+        batch plus the new rows are written to a staging directory, which then
+        takes the partition's place. Readers ignore the _-prefixed directories
+        used during the swap.
+        """
+        import pyarrow.dataset as ds
+        if isinstance(batch, list):
+            batch = concat_batches(batch)
+        if table_layout(table_id)["partition_by"] != ("date", "symbol"):
+            raise ValueError(f"merge_batch needs a table partitioned by date and symbol, not {table_id}")
+        batch = dedupe_batch(batch, keys)
+        if batch.num_rows == 0:
+            return 0
+        path = self.table_path(table_id)
+        staging = os.path.join(self.root, "_staging", uuid.uuid4().hex)
+        with METRICS.timer("load"):
+            partitions = batch.group_by(["date", "symbol"]).aggregate([])
+            merged = []
+            for date, symbol in zip(partitions["date"].cast(pa.string()).to_pylist(), partitions["symbol"].to_pylist()):
+                new = batch.filter(pc.and_(pc.equal(batch["date"].cast(pa.string()), date),
+                                           pc.equal(batch["symbol"], symbol)))
+                existing = self.read_table(table_id, symbol=symbol, start=date, end=date) \
+                    if os.path.isdir(os.path.join(path, f"date={date}", f"symbol={symbol}")) else None
+                if existing is not None and existing.num_rows:
+                    kept = existing.filter(pc.invert(pc.is_in(merge_key(existing, keys), merge_key(new, keys))))
+                    new = pa.concat_tables([kept.select(new.column_names).cast(new.schema), new])
+                merged.append(new)
+            ds.write_dataset(pa.concat_tables(merged), staging, format="parquet",
+                             partitioning=_partitioning(table_layout(table_id)),
+                             basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet")
+            for date, symbol in zip(partitions["date"].cast(pa.string()).to_pylist(), partitions["symbol"].to_pylist()):
+                target = os.path.join(path, f"date={date}", f"symbol={symbol}")
+                old = os.path.join(path, f"date={date}", f"_replaced-{uuid.uuid4().hex}")
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.isdir(target):
+                    os.rename(target, old)
+                os.rename(os.path.join(staging, f"date={date}", f"symbol={symbol}"), target)
+                shutil.rmtree(old, ignore_errors=True)
+            shutil.rmtree(staging, ignore_errors=True)
+        METRICS.inc("load_jobs")
+        METRICS.inc("rows_loaded", batch.num_rows)
+        print(f"Merged {batch.num_rows} rows into {path}")
+        return batch.num_rows
+
+    def existing_dates(self, symbol, table_id):
+        path = self.table_path(table_id)
+        if not os.path.isdir(path):
+            return set()
+        if table_layout(table_id)["partition_by"] != ("date", "symbol"):
+            dates = self.read_table(table_id, symbol=symbol, columns=["date"])["date"]
+            return {str(d) for d in pc.unique(dates).to_pylist()}
+        # Partition directories answer this without reading any data
+        symbol_dir = f"symbol={symbol}"
+        dates = set()
+        for entry in os.listdir(path):
+            if entry.startswith("date=") and os.path.isdir(os.path.join(path, entry, symbol_dir)):
+                dates.add(entry[len("date="):])
+        print(f"Found {len(dates)} existing dates for {symbol}")
+        return dates
+
+    def dataset(self, table_id):
+        import pyarrow.dataset as ds
+        layout = table_layout(table_id)
+        return ds.dataset(self.table_path(table_id), format="parquet",
+                          partitioning=_partitioning(layout), schema=layout["schema"])
+
+    def read_table(self, table_id, symbol=None, start=None, end=None, columns=None):
+        import pyarrow.dataset as ds
+        if not os.path.isdir(self.table_path(table_id)):
+            empty = table_layout(table_id)["schema"].empty_table()
+            return empty.select(columns) if columns else empty
+        condition = None
+        filters = []
+        if symbol is not None:
+            filters.append(ds.field("symbol") == symbol)
+        if start is not None:
+            filters.append(ds.field("date") >= pa.scalar(start).cast(pa.date32()))
+        if end is not None:
+            filters.append(ds.field("date") <= pa.scalar(end).cast(pa.date32()))
+        for f in filters:
+            condition = f if condition is None else condition & f
+        return self.dataset(table_id).to_table(columns=columns, filter=condition)
+
+    def drop_table(self, table_id):
+        shutil.rmtree(self.table_path(table_id), ignore_errors=True)
+
+    def list_tables(self, dataset_id):
+        path = os.path.join(self.root, dataset_id)
+        if not os.path.isdir(path):
+            return []
+        return sorted(f"{dataset_id}.{name}" for name in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, name)))
+
+    def query(self, sql, params=None):
+        """
+        Run DuckDB SQL over the local tables. Tables are referenced as
+        dataset.table (e.g. historical_data.aapl); params fill $name placeholders.
+        """
+        import duckdb
+
+        con = duckdb.connect()
+        try:
+            for dataset_id, table_name in set(re.findall(r"\b(\w+)\.(\w+)\b", sql)):
+                path = self.table_path(f"{dataset_id}.{table_name}")
+                if not os.path.isdir(path):
+                    continue
+                con.execute(f'CREATE SCHEMA IF NOT EXISTS "{dataset_id}"')
+                glob = os.path.join(path, "**", "*.parquet").replace("'", "''")
+                hive_types = {"date": "DATE", "symbol": "VARCHAR"}
+                types = ", ".join(f"'{c}': {hive_types[c]}"
+                                  for c in table_layout(f"{dataset_id}.{table_name}")["partition_by"])
+                con.execute(
+                    f'CREATE VIEW "{dataset_id}"."{table_name}" AS '
+                    f"SELECT * FROM read_parquet('{glob}', hive_partitioning = true, union_by_name = true, hive_types = "
+                    f"{{{types}}})"
+                )
+            return con.execute(sql, params or {}).fetch_arrow_table()
+        finally:
+            con.close()
+
+
+class MemoryStorage(OptionsStorage):
+    """
+    In-memory stand-in for the warehouse, used by benchmarks and offline experiments.
+    With keep_data=False only the (symbol, date) coverage and write counts are
+    kept, so the sink itself does not add to the memory being measured.
+    """
+
+    def __init__(self, keep_data=True):
+        self.keep_data = keep_data
+        self.tables = {}
+        self.dates = {}
+        self.write_count = 0
+        self.rows_written = 0
+        self._lock = threading.Lock()
+
+    def ensure_table(self, table_id):
+        with self._lock:
+            self.tables.setdefault(table_id, [])
+            self.dates.setdefault(table_id, set())
+
+    def write_batch(self, batch, table_id):
+        if isinstance(batch, list):
+            batch = concat_batches(batch)
+        if batch.num_rows == 0:
+            return 0
+        with METRICS.timer("load"):
+            keys = pa.Table.from_arrays(
+                [batch["symbol"], batch["date"].cast(pa.string())], names=["symbol", "date"]
+            ).group_by(["symbol", "date"]).aggregate([])
+        with self._lock:
+            self.write_count += 1
+            self.rows_written += batch.num_rows
+            self.dates.setdefault(table_id, set()).update(
+                zip(keys["symbol"].to_pylist(), keys["date"].to_pylist())
+            )
+            if self.keep_data:
+                self.tables.setdefault(table_id, []).append(batch)
+        METRICS.inc("load_jobs")
+        METRICS.inc("rows_loaded", batch.num_rows)
+        return batch.num_rows
+
+    def merge_batch(self, batch, table_id, keys=MERGE_KEYS):
+        if isinstance(batch, list):
+            batch = concat_batches(batch)
+        batch = dedupe_batch(batch, keys)
+        if self.keep_data and batch.num_rows:
+            new_keys = merge_key(batch, keys)
+            with self._lock:
+                self.tables[table_id] = [t.filter(pc.invert(pc.is_in(merge_key(t, keys), new_keys)))
+                                         for t in self.tables.get(table_id, [])]
+        return self.write_batch(batch, table_id)
+
+    def existing_dates(self, symbol, table_id):
+        with self._lock:
+            return {date for s, date in self.dates.get(table_id, ()) if s == symbol}
+
+    def symbols(self, table_id):
+        with self._lock:
+            return {s for s, date in self.dates.get(table_id, ())}
+
+    def list_tables(self, dataset_id):
+        with self._lock:
+            return sorted(t for t in self.tables if t.split('.')[0] == dataset_id)
+
+    def read_table(self, table_id, symbol=None, start=None, end=None, columns=None):
+        with self._lock:
+            tables = [t for t in self.tables.get(table_id, []) if t.num_rows]
+        table = pa.concat_tables(tables) if tables else table_layout(table_id)["schema"].empty_table()
+        mask = None
+        for condition in (
+            pc.equal(table["symbol"], symbol) if symbol is not None else None,
+            pc.greater_equal(table["date"], pa.scalar(start).cast(pa.date32())) if start is not None else None,
+            pc.less_equal(table["date"], pa.scalar(end).cast(pa.date32())) if end is not None else None,
+        ):
+            if condition is not None:
+                mask = condition if mask is None else pc.and_(mask, condition)
+        if mask is not None:
+            table = table.filter(mask)
+        return table.select(columns) if columns else table
+
+
+def _build_storage(config):
+    backend = config.get("storage_backend", "bigquery")
+    if backend == "local":
+        return LocalParquetStorage(config.get("local_storage_dir", DEFAULT_LOCAL_STORAGE_DIR))
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "bigquery":
+        # Imported lazily so local runs do not need google-cloud-bigquery
+        from utilities.bigquery_storage import BigQueryStorage, DEFAULT_MAX_LOAD_BYTES
+        return BigQueryStorage(config["project_id"], config.get("max_load_bytes", DEFAULT_MAX_LOAD_BYTES))
+    raise ValueError(f"Unknown storage_backend: {backend}")
+
+
+def get_storage(config):
+    """Build the storage backend selected by storage_backend in config."""
+    storage = _build_storage(config)
+    mode = config.get("options_table_mode", "per_symbol")
+    if mode == "consolidated":
+        storage.consolidated_table = config.get("consolidated_options_table", CONSOLIDATED_OPTIONS_TABLE)
+    elif mode != "per_symbol":
+        raise ValueError(f"Unknown options_table_mode: {mode}")
+    return storage
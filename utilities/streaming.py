@@ -0,0 +1,192 @@
+"""
+Incremental parsing of Alpha Vantage responses and budget-based batching.
+
+Large option chains are never held as one decoded JSON document: rows of the
+top-level `data` array are decoded one at a time from the HTTP byte stream,
+parsed into arrow tables in small chunks, and flushed whenever the pending
+batch reaches a row or byte budget.
+"""
+import codecs
+import json
+import time
+
+from utilities.columnar import concat_batches, parse_options_rows
+from utilities.metrics import METRICS
+
+DEFAULT_CHUNK_ROWS = 5000  # rows decoded into dicts before converting to arrow
+DEFAULT_FLUSH_ROWS = 250000
+DEFAULT_FLUSH_BYTES = 128 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Text buffer over an iterator of byte chunks that only keeps unconsumed text."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read one more chunk. Returns False once the stream is exhausted."""
+        if self.eof:
+            return False
+        # Drop consumed text so the buffer never grows past one row plus one chunk
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += self.decoder.decode(chunk)
+                return True
+        self.buf += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON response: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self, decoder=json.JSONDecoder()):
+        """Decode the next complete JSON value, reading more chunks as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and isinstance(value, (int, float)):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks, key="data", meta=None):
+    """
+    Yield the items of the array stored under `key` in a top-level JSON object,
+    decoding them one at a time from an iterator of byte chunks.
+    Other top-level keys (e.g. "message", "Information") are stored in meta if given.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    separator = reader.peek()
+                    reader.pos += 1
+                    if separator == "]":
+                        break
+                    if separator != ",":
+                        raise ValueError(f"Malformed JSON response: unexpected {separator!r} in {key} array")
+        else:
+            value = reader.value()
+            if meta is not None:
+                meta[name] = value
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Malformed JSON response: unexpected {separator!r} after key {name!r}")
+
+
+def iter_response_tables(chunks, symbol, date, chunk_rows=DEFAULT_CHUNK_ROWS, meta=None):
+    """Yield arrow tables of at most chunk_rows contracts parsed from a streamed response."""
+    rows = []
+    for row in iter_json_array(chunks, "data", meta):
+        rows.append(row)
+        if len(rows) >= chunk_rows:
+            yield parse_options_rows(rows, symbol, date)
+            rows = []
+    if rows:
+        yield parse_options_rows(rows, symbol, date)
+
+
+class BatchBuffer:
+    """
+    Accumulates parsed arrow tables and hands them to flush_fn whenever the
+    pending rows or bytes reach the configured budget.
+    """
+
+    def __init__(self, flush_fn, max_rows=DEFAULT_FLUSH_ROWS, max_bytes=DEFAULT_FLUSH_BYTES):
+        self.flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.tables = []
+        self.rows = 0
+        self.bytes = 0
+        self.flushed_rows = 0
+        self.flush_seconds = 0.0
+        self.flushes = 0
+
+    def add(self, table):
+        if table.num_rows == 0:
+            return
+        self.tables.append(table)
+        self.rows += table.num_rows
+        self.bytes += table.nbytes
+        if self.rows >= self.max_rows or self.bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """Send the pending tables to flush_fn and return the number of rows it reported."""
+        if not self.tables:
+            return 0
+        started = time.perf_counter()
+        with METRICS.timer("transform"):
+            batch = concat_batches(self.tables)
+        self.tables = []
+        self.rows = 0
+        self.bytes = 0
+        self.flushes += 1
+        inserted = self.flush_fn(batch)
+        self.flushed_rows += inserted
+        self.flush_seconds += time.perf_counter() - started
+        return inserted
+
+    def mark(self):
+        """A position to roll back to with rollback()."""
+        return self.flushes, len(self.tables)
+
+    def rollback(self, mark):
+        """
+        Drop the tables added since mark. Returns False if some of them were
+        already flushed (and only the rest could be dropped).
+        """
+        flushes, count = mark
+        if flushes != self.flushes:
+            # Everything pending was added after the flush that took the earlier part
+            count = 0
+        for table in self.tables[count:]:
+            self.rows -= table.num_rows
+            self.bytes -= table.nbytes
+        del self.tables[count:]
+        return flushes == self.flushes
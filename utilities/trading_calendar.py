@@ -0,0 +1,295 @@
+"""
+Offline NYSE trading calendar and per-symbol listing windows.
+
+Holidays follow the exchange's rules (observed on the nearest weekday, except
+that a Saturday New Year's Day is not observed), plus the unscheduled
+closures listed in SPECIAL_CLOSURES, so no API call is spent on a date the
+market was shut.
+
+A listing window is the first and last trading day on which a symbol has
+option data, found by bisecting over the requested days with single-date
+probes and cached in a JSON file. Days before a listing or after a
+delisting are then dropped from the work list before anything is fetched.
+A last day earlier than the probed range's end only counts as a delisting
+once it is older than the last settle_days trading days, since Alpha Vantage
+may not have published the most recent chains when the probe ran; until
+then nothing is trimmed at the end, and the tail is probed again once it
+has settled.
+"""
+import datetime
+import json
+import os
+import threading
+
+DEFAULT_LISTING_WINDOWS_PATH = ".cache/listing_windows.json"
+INTERIOR_PROBES = 8  # days sampled when neither end of the range has data
+DEFAULT_SETTLE_DAYS = 3  # trading days before an empty date is taken as final
+
+# Unscheduled full-day closures (national days of mourning, Hurricane Sandy)
+SPECIAL_CLOSURES = {
+    datetime.date(2007, 1, 2),
+    datetime.date(2012, 10, 29),
+    datetime.date(2012, 10, 30),
+    datetime.date(2018, 12, 5),
+    datetime.date(2025, 1, 9),
+}
+
+_holiday_cache = {}
+
+
+def easter(year):
+    """Gregorian Easter Sunday (anonymous computus)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """n-th (1-based) weekday of the month, or the last one for n = -1."""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year):
+    """Set of NYSE full-day holidays (as observed) in year."""
+    if year in _holiday_cache:
+        return _holiday_cache[year]
+    holidays = set()
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    if year >= 1998:
+        holidays.add(_nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    holidays.add(_nth_weekday(year, 2, 0, 3))  # Washington's Birthday
+    holidays.add(easter(year) - datetime.timedelta(days=2))  # Good Friday
+    holidays.add(_nth_weekday(year, 5, 0, -1))  # Memorial Day
+    if year >= 2022:
+        holidays.add(_observed(datetime.date(year, 6, 19)))  # Juneteenth
+    holidays.add(_observed(datetime.date(year, 7, 4)))
+    holidays.add(_nth_weekday(year, 9, 0, 1))  # Labor Day
+    holidays.add(_nth_weekday(year, 11, 3, 4))  # Thanksgiving
+    holidays.add(_observed(datetime.date(year, 12, 25)))
+    holidays.update(day for day in SPECIAL_CLOSURES if day.year == year)
+    _holiday_cache[year] = holidays
+    return holidays
+
+
+def is_trading_day(day):
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return day.weekday() < 5 and day not in nyse_holidays(day.year)
+
+
+def trading_days(start, end):
+    """NYSE trading days in [start, end] as YYYY-MM-DD strings."""
+    start = datetime.date.fromisoformat(str(start)[:10])
+    end = datetime.date.fromisoformat(str(end)[:10])
+    days = []
+    day = start
+    while day <= end:
+        if is_trading_day(day):
+            days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def unsettled_from(settle_days=DEFAULT_SETTLE_DAYS, today=None):
+    """
+    First of the last settle_days trading days up to today (default: the
+    current date), whose chains may not be published yet; None if settle_days is 0.
+    """
+    if not settle_days:
+        return None
+    today = datetime.date.fromisoformat(str(today or datetime.date.today())[:10])
+    recent = trading_days(today - datetime.timedelta(days=2 * settle_days + 7), today)
+    return recent[-settle_days] if recent else None
+
+
+class _ProbeFailed(Exception):
+    pass
+
+
+def _probe(has_data, day):
+    result = has_data(day)
+    if result is None:
+        raise _ProbeFailed(day)
+    return result
+
+
+def _bisect(days, has_data, lo, hi, first):
+    """
+    Boundary between days[lo] and days[hi], which differ in having data.
+    Returns the index of the first day with data (first=True) or the last one.
+    """
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if _probe(has_data, days[mid]) == first:
+            hi = mid
+        else:
+            lo = mid
+    return hi if first else lo
+
+
+def _sample_indices(n, samples=INTERIOR_PROBES):
+    """Evenly spaced interior indices of a list of n days."""
+    step = max(1, (n - 1) // (samples + 1))
+    return list(range(step, n - 1, step))[:samples]
+
+
+def probe_listing_window(days, has_data, settled_before=None):
+    """
+    First and last of days (sorted YYYY-MM-DD strings) on which has_data(day)
+    is True, assuming data is contiguous. has_data returns None when a probe
+    is inconclusive, in which case the window is unknown and None is returned.
+    When neither end has data a few interior days are sampled before the
+    symbol is taken to have no data in days at all. The window is marked
+    delisted when its last day is before settled_before (see unsettled_from)
+    and before the end of days.
+    """
+    if not days:
+        return None
+    try:
+        start_has = _probe(has_data, days[0])
+        end_has = _probe(has_data, days[-1]) if len(days) > 1 else start_has
+        lo, hi = 0, len(days) - 1
+        if not start_has and not end_has:
+            # Listed and delisted inside days, or no data at all: look for any day with data
+            inside = next((i for i in _sample_indices(len(days)) if _probe(has_data, days[i])), None)
+            if inside is None:
+                return {"first": None, "last": None, "probed_start": days[0], "probed_end": days[-1]}
+            first = days[_bisect(days, has_data, lo, inside, True)]
+            last = days[_bisect(days, has_data, inside, hi, False)]
+        else:
+            first = days[0] if start_has else days[_bisect(days, has_data, lo, hi, True)]
+            last = days[-1] if end_has else days[_bisect(days, has_data, lo, hi, False)]
+    except _ProbeFailed as e:
+        print(f"Listing probe inconclusive on {e}, not trimming")
+        return None
+    delisted = last < days[-1] and (settled_before is None or last < settled_before)
+    return {"first": first, "last": last, "probed_start": days[0], "probed_end": days[-1], "delisted": delisted}
+
+
+def needs_probe(window, start, end, settled_before=None):
+    """
+    Whether a cached window leaves days in [start, end] undecided that a probe
+    could trim, including a possible delisting that has settled since the
+    window was probed.
+    """
+    if window is None:
+        return True
+    listed_inside = window["first"] is not None and window["first"] > window["probed_start"]
+    if start < window["probed_start"] and not listed_inside:
+        return True
+    if window["first"] is None:
+        return end > window["probed_end"]
+    unconfirmed_end = window["last"] < window["probed_end"] and not window.get("delisted")
+    return unconfirmed_end and (settled_before is None or window["probed_end"] < settled_before)
+
+
+def trim_to_window(window, days):
+    """Drop days before a listing or after a confirmed delisting found inside the probed range."""
+    if window is None:
+        return list(days)
+    if window["first"] is None:
+        # No data anywhere in the probed range
+        return [d for d in days if d < window["probed_start"] or d > window["probed_end"]]
+    lo = window["first"] if window["first"] > window["probed_start"] else None
+    hi = window["last"] if window["last"] < window["probed_end"] and window.get("delisted") else None
+    return [d for d in days if (lo is None or d >= lo) and (hi is None or d <= hi)]
+
+
+class ListingWindows:
+    """
+    Per-symbol listing windows persisted as one JSON document, rewritten
+    atomically. Several processes may share the file: each save merges the
+    windows this process probed into what is on disk, so at worst a window
+    written concurrently is probed again.
+    """
+
+    def __init__(self, path=DEFAULT_LISTING_WINDOWS_PATH, settle_days=DEFAULT_SETTLE_DAYS):
+        self.path = path
+        self.settle_days = settle_days
+        self.windows = self._read()
+        # Symbols whose windows this process probed, written over the file's on save
+        self.probed = set()
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("symbols", {})
+        except (OSError, ValueError) as e:
+            print(f"Could not read listing windows from {self.path}: {e}")
+            return {}
+
+    def get(self, symbol):
+        with self._lock:
+            return self.windows.get(symbol)
+
+    def trim(self, symbol, days, has_data, today=None, probe_days=None):
+        """
+        days without those outside symbol's listing window, probing (and
+        caching) it when needed. probe_days, when given, is the wider range to
+        probe, e.g. the whole backfill when days is one month of it, so the
+        window is probed once per symbol rather than once per month.
+        """
+        if not days:
+            return days
+        window = self.get(symbol)
+        settled_before = unsettled_from(self.settle_days, today)
+        if needs_probe(window, days[0], days[-1], settled_before) and symbol not in self.probed:
+            # Another process sharing the file may have probed it since it was read
+            window = self._read().get(symbol, window)
+            if window is not None:
+                with self._lock:
+                    self.windows[symbol] = window
+        if needs_probe(window, days[0], days[-1], settled_before):
+            probed = probe_listing_window(probe_days or days, has_data, settled_before)
+            if probed is not None:
+                window = probed
+                with self._lock:
+                    self.windows[symbol] = window
+                    self.probed.add(symbol)
+                self.save()
+        trimmed = trim_to_window(window, days)
+        if len(trimmed) < len(days):
+            print(f"{symbol}: {len(days) - len(trimmed)} days outside its listing window "
+                  f"({window['first']} to {window['last']}) skipped")
+        return trimmed
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            windows = self._read()
+            windows.update({symbol: self.windows[symbol] for symbol in self.probed})
+            self.windows.update(windows)
+            payload = {"symbols": windows}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)
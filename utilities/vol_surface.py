@@ -0,0 +1,365 @@
+"""
+Per-expiry SVI volatility smiles fitted over the stored chains.
+
+For every (symbol, date, expiration) the raw SVI total variance
+
+    w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2)),  k = ln(K / F)
+
+is fitted to the out-of-the-money implied vols. For fixed (m, sigma) the
+other three parameters solve a linear least-squares problem, so only (m, sigma)
+are searched with Nelder-Mead (the quasi-explicit method of Zeller and
+Mastinsek). Fits start from the previous date's parameters of the same
+expiration when they exist (otherwise from the nearest fitted expiration),
+with a much smaller initial simplex than a cold start.
+
+Parameters are stored in analytics.svi_params, so readers evaluate a few
+floats (surface_points) instead of refitting thousands of contracts.
+
+    python -m utilities.vol_surface --start 2025-05-01 --end 2025-05-30
+"""
+import argparse
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities.black_scholes import DEFAULT_RISK_FREE_RATE, DAYS_PER_YEAR, option_prices
+from utilities.storage import get_storage, register_table_layout
+
+SVI_PARAMS_TABLE = "analytics.svi_params"
+MIN_POINTS = 5  # fewer OTM quotes than this and the slice is not fitted
+MAX_ABS_LOG_MONEYNESS = 1.5
+COLD_ITERATIONS = 300
+WARM_ITERATIONS = 80
+WARM_START_LOOKBACK_DAYS = 10
+# N^-1(0.75): d1 of a 25-delta put, minus d1 of a 25-delta call
+_Z25 = 0.6744897501960817
+
+SVI_PARAMS_SCHEMA = pa.schema([
+    ('symbol', pa.string()),
+    ('date', pa.date32()),
+    ('expiration', pa.date32()),
+    ('t', pa.float64()),
+    ('forward', pa.float64()),
+    ('a', pa.float64()),
+    ('b', pa.float64()),
+    ('rho', pa.float64()),
+    ('m', pa.float64()),
+    ('sigma', pa.float64()),
+    ('rmse', pa.float64()),
+    ('n_points', pa.int64()),
+    ('warm_start', pa.bool_()),
+])
+
+register_table_layout(SVI_PARAMS_TABLE, SVI_PARAMS_SCHEMA, partition_by=("symbol",),
+                      cluster_by=("symbol", "expiration"), bq_partition="MONTH")
+
+SURFACE_COLUMNS = ['symbol', 'date', 'expiration', 'type', 'strike', 'last', 'mark', 'bid', 'ask',
+                   'implied_volatility']
+
+
+def svi_total_variance(k, a, b, rho, m, sigma):
+    return a + b * (rho * (k - m) + np.sqrt((k - m) ** 2 + sigma ** 2))
+
+
+def _linear_fit(y, w, weights):
+    """
+    Best (a, d, c) of w ~ a + d * y + c * sqrt(y^2 + 1) for fixed (m, sigma),
+    kept inside the no-arbitrage box c >= 0, |d| <= c. Returns (params, sse).
+    """
+    z = np.sqrt(y * y + 1.0)
+    design = np.stack([np.ones_like(y), y, z]) * weights
+    target = w * weights
+    try:
+        a, d, c = np.linalg.solve(design @ design.T, design @ target)
+    except np.linalg.LinAlgError:
+        a, d, c = np.linalg.lstsq(design.T, target, rcond=None)[0]
+    if c < 0 or abs(d) > c:
+        c = max(c, 0.0)
+        d = float(np.clip(d, -c, c))
+        a = float(np.sum(weights ** 2 * (w - d * y - c * z)) / np.sum(weights ** 2))
+    residual = (a + d * y + c * z - w) * weights
+    return (a, d, c), float(residual @ residual)
+
+
+def _nelder_mead(f, x0, step, iterations, ftol=1e-12, xtol=1e-5):
+    simplex = np.array([x0, x0 + [step[0], 0.0], x0 + [0.0, step[1]]], dtype=np.float64)
+    values = np.array([f(x) for x in simplex])
+    for _ in range(iterations):
+        order = np.argsort(values)
+        simplex, values = simplex[order], values[order]
+        if values[-1] - values[0] < ftol or np.abs(simplex[1:] - simplex[0]).max() < xtol:
+            break
+        centroid = simplex[:2].mean(axis=0)
+        reflected = centroid + (centroid - simplex[2])
+        f_reflected = f(reflected)
+        if f_reflected < values[0]:
+            expanded = centroid + 2.0 * (centroid - simplex[2])
+            f_expanded = f(expanded)
+            if f_expanded < f_reflected:
+                simplex[2], values[2] = expanded, f_expanded
+            else:
+                simplex[2], values[2] = reflected, f_reflected
+        elif f_reflected < values[1]:
+            simplex[2], values[2] = reflected, f_reflected
+        else:
+            contracted = centroid + 0.5 * (simplex[2] - centroid)
+            f_contracted = f(contracted)
+            if f_contracted < values[2]:
+                simplex[2], values[2] = contracted, f_contracted
+            else:
+                simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+                values[1:] = [f(x) for x in simplex[1:]]
+    best = int(np.argmin(values))
+    return simplex[best], values[best]
+
+
+def fit_svi_slice(k, iv, t, previous=None):
+    """
+    Fit one expiry. previous is a dict of earlier SVI parameters used as the
+    starting point. Returns a dict of a, b, rho, m, sigma, rmse (in vol) and
+    n_points, or None if the slice cannot be fitted.
+    """
+    keep = np.isfinite(k) & np.isfinite(iv) & (iv > 0.01) & (iv < 5.0) & (np.abs(k) < MAX_ABS_LOG_MONEYNESS)
+    k, iv = k[keep], iv[keep]
+    if k.size < MIN_POINTS or t <= 0:
+        return None
+    w = iv * iv * t
+    # Points near the money matter most for ATM and 25-delta readings
+    weights = 1.0 / np.sqrt(1.0 + (k / (0.25 + np.sqrt(t))) ** 2)
+
+    def objective(x):
+        m, log_sigma = x
+        sigma = np.exp(log_sigma)
+        return _linear_fit((k - m) / sigma, w, weights)[1]
+
+    if previous is not None:
+        x0 = np.array([previous['m'], np.log(max(previous['sigma'], 1e-4))])
+        x, _ = _nelder_mead(objective, x0, (0.01, 0.05), WARM_ITERATIONS)
+    else:
+        x0 = np.array([float(k[np.argmin(w)]), np.log(0.1)])
+        x, _ = _nelder_mead(objective, x0, (0.1, 0.5), COLD_ITERATIONS)
+    m, sigma = float(x[0]), float(np.exp(x[1]))
+    (a, d, c), _ = _linear_fit((k - m) / sigma, w, weights)
+    b = c / sigma
+    rho = d / c if c > 0 else 0.0
+    fitted = svi_total_variance(k, a, b, rho, m, sigma)
+    rmse = float(np.sqrt(np.mean((np.sqrt(np.maximum(fitted, 0.0) / t) - iv) ** 2)))
+    return {'a': a, 'b': b, 'rho': rho, 'm': m, 'sigma': sigma, 'rmse': rmse, 'n_points': int(k.size)}
+
+
+def implied_forward(strike, price, is_call, t, rate=DEFAULT_RISK_FREE_RATE):
+    """
+    Forward from put-call parity, F = K + e^(rt) (C - P), averaged over the
+    three strikes where call and put prices are closest. None without pairs.
+    """
+    calls = {K: p for K, p, c in zip(strike, price, is_call) if c and np.isfinite(p)}
+    pairs = [(K, calls[K] - p) for K, p, c in zip(strike, price, is_call)
+             if not c and K in calls and np.isfinite(p)]
+    if not pairs:
+        return None
+    pairs.sort(key=lambda pair: abs(pair[1]))
+    return float(np.mean([K + np.exp(rate * t) * diff for K, diff in pairs[:3]]))
+
+
+def _nearest_params(previous_params, expiration_key):
+    """Parameters of the closest previously fitted expiration (for newly listed expiries)."""
+    if not previous_params:
+        return None
+    target = datetime.date.fromisoformat(expiration_key)
+    nearest = min(previous_params, key=lambda key: abs((datetime.date.fromisoformat(key) - target).days))
+    return previous_params[nearest]
+
+
+def fit_chain(chain, previous_params=None, rate=DEFAULT_RISK_FREE_RATE):
+    """
+    Fit every (date, expiration) slice of one symbol's chain Table, in date
+    order. previous_params maps expiration (YYYY-MM-DD) to the last fitted
+    parameters and is updated as dates are fitted, so each day warm-starts the next.
+    Returns a Table with SVI_PARAMS_SCHEMA.
+    """
+    previous_params = {} if previous_params is None else previous_params
+    rows = []
+    if chain.num_rows == 0:
+        return SVI_PARAMS_SCHEMA.empty_table()
+    chain = chain.sort_by([('date', 'ascending'), ('expiration', 'ascending')])
+    symbol = chain['symbol'][0].as_py()
+    days = chain['date'].cast(pa.int32()).to_numpy()
+    expirations = pc.fill_null(chain['expiration'].cast(pa.int32()), -1).to_numpy()
+    strikes = pc.cast(chain['strike'], pa.float64()).to_numpy(zero_copy_only=False)
+    ivs = pc.cast(chain['implied_volatility'], pa.float64()).to_numpy(zero_copy_only=False)
+    is_call = pc.fill_null(pc.equal(chain['type'], 'call'), False).to_numpy(zero_copy_only=False)
+    prices = option_prices(chain)
+
+    keys = np.stack([days, expirations], axis=1)
+    boundaries = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+    for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(days)]))):
+        day, expiration = int(days[start]), int(expirations[start])
+        t = (expiration - day) / DAYS_PER_YEAR
+        if expiration < 0 or t <= 0:
+            continue
+        forward = implied_forward(strikes[start:end], prices[start:end], is_call[start:end], t, rate)
+        if forward is None or forward <= 0:
+            continue
+        k = np.log(strikes[start:end] / forward)
+        # Out-of-the-money side only: calls above the forward, puts below
+        otm = np.where(is_call[start:end], k >= 0, k < 0)
+        expiration_key = str(datetime.date(1970, 1, 1) + datetime.timedelta(days=expiration))
+        previous = previous_params.get(expiration_key) or _nearest_params(previous_params, expiration_key)
+        params = fit_svi_slice(k[otm], ivs[start:end][otm], t, previous)
+        if params is None:
+            continue
+        previous_params[expiration_key] = params
+        rows.append({'symbol': symbol, 'date': day, 'expiration': expiration, 't': t, 'forward': forward,
+                     **params, 'warm_start': previous is not None})
+    if not rows:
+        return SVI_PARAMS_SCHEMA.empty_table()
+    table = pa.Table.from_pylist(rows)
+    table = table.set_column(table.schema.get_field_index('date'), 'date', table['date'].cast(pa.int32()).cast(pa.date32()))
+    table = table.set_column(table.schema.get_field_index('expiration'), 'expiration',
+                             table['expiration'].cast(pa.int32()).cast(pa.date32()))
+    return table.select(SVI_PARAMS_SCHEMA.names).cast(SVI_PARAMS_SCHEMA)
+
+
+def load_previous_params(storage, symbol, before):
+    """Latest stored parameters per expiration in the days before `before`, for warm starts."""
+    start = (datetime.date.fromisoformat(before) - datetime.timedelta(days=WARM_START_LOOKBACK_DAYS)).isoformat()
+    end = (datetime.date.fromisoformat(before) - datetime.timedelta(days=1)).isoformat()
+    try:
+        stored = storage.read_table(SVI_PARAMS_TABLE, symbol=symbol, start=start, end=end)
+    except Exception as e:
+        print(f"No stored SVI parameters for {symbol}: {e}")
+        return {}
+    previous = {}
+    for row in stored.sort_by('date').to_pylist():
+        previous[str(row['expiration'])] = row
+    return previous
+
+
+def fit_symbol(symbol, start, end, config=None, storage=None):
+    """
+    Fit the dates in [start, end] that have no stored parameters yet for
+    symbol, write them and return the number of slices written (fewer than
+    fitted when the write fails; the rest are fitted again next time).
+    """
+    config = config or {}
+    storage = storage or get_storage(config)
+    storage.ensure_table(SVI_PARAMS_TABLE)
+    done = storage.existing_dates(symbol, SVI_PARAMS_TABLE)
+    chain = storage.read_table(storage.options_table_id(symbol), symbol=symbol, start=start, end=end,
+                               columns=SURFACE_COLUMNS)
+    if chain.num_rows and done:
+        chain = chain.filter(pc.invert(pc.is_in(chain['date'].cast(pa.string()), pa.array(sorted(done)))))
+    if chain.num_rows == 0:
+        return 0
+    first_date = str(pc.min(chain['date']).as_py())
+    previous = load_previous_params(storage, symbol, first_date)
+    params = fit_chain(chain, previous, config.get("risk_free_rate", DEFAULT_RISK_FREE_RATE))
+    if params.num_rows == 0:
+        return 0
+    written = storage.write_batch(params, SVI_PARAMS_TABLE)
+    if written != params.num_rows:
+        print(f"Wrote {written} of {params.num_rows} SVI slices for {symbol}")
+    return written
+
+
+def _fit_symbol_task(symbol, start, end, config):
+    # Runs in a worker process, which builds its own storage client
+    return symbol, fit_symbol(symbol, start, end, config)
+
+
+def fit_surfaces(symbols, start, end=None, config=None, max_workers=None):
+    """Fit all symbols for [start, end] across a process pool. Returns {symbol: slices written}."""
+    config = dict(config or {})
+    end = end or start
+    max_workers = max_workers or config.get("surface_workers") or os.cpu_count()
+    results = {}
+    if max_workers <= 1:
+        for symbol in symbols:
+            results[symbol] = fit_symbol(symbol, start, end, config)
+        return results
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fit_symbol_task, symbol, start, end, config): symbol for symbol in symbols}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                results[symbol] = future.result()[1]
+                print(f"Wrote {results[symbol]} SVI slices for {symbol}")
+            except Exception as e:
+                results[symbol] = 0
+                print(f"SVI fit failed for {symbol}: {e}")
+    return results
+
+
+def _interpolated_variance(k, t, ts, params):
+    """Total variance at log-moneyness k and maturity t, linear in t between fitted slices."""
+    slices = [svi_total_variance(k, p['a'], p['b'], p['rho'], p['m'], p['sigma']) for p in params]
+    if t <= ts[0]:
+        return slices[0] * t / ts[0]  # flat vol before the first expiry
+    if t >= ts[-1]:
+        return slices[-1] * t / ts[-1]
+    i = int(np.searchsorted(ts, t))
+    weight = (t - ts[i - 1]) / (ts[i] - ts[i - 1])
+    return slices[i - 1] + weight * (slices[i] - slices[i - 1])
+
+
+def _delta_strike(t, ts, params, z, iterations=20):
+    """Log-moneyness where d1 = -z (25-delta call for z = _Z25, put for -_Z25), by fixed-point iteration."""
+    k = 0.0
+    for _ in range(iterations):
+        w = max(_interpolated_variance(k, t, ts, params), 1e-12)
+        k = w / 2.0 + z * np.sqrt(w)
+    return k
+
+
+def surface_points(params, tenors=(30, 90)):
+    """
+    Read fixed points off the fitted smiles for every (symbol, date): ATM vol and
+    25-delta put/call vols (and their difference) at each tenor in days.
+    """
+    columns = {'symbol': [], 'date': []}
+    for tenor in tenors:
+        for name in ('atm_iv', 'put_25d_iv', 'call_25d_iv', 'skew_25d'):
+            columns[f"{name}_{tenor}d"] = []
+    groups = {}
+    for row in params.sort_by([('symbol', 'ascending'), ('date', 'ascending'), ('t', 'ascending')]).to_pylist():
+        groups.setdefault((row['symbol'], row['date']), []).append(row)
+    for (symbol, date), slices in groups.items():
+        ts = np.array([p['t'] for p in slices])
+        columns['symbol'].append(symbol)
+        columns['date'].append(date)
+        for tenor in tenors:
+            t = tenor / DAYS_PER_YEAR
+            atm = np.sqrt(max(_interpolated_variance(0.0, t, ts, slices), 0.0) / t)
+            put = np.sqrt(max(_interpolated_variance(_delta_strike(t, ts, slices, -_Z25), t, ts, slices), 0.0) / t)
+            call = np.sqrt(max(_interpolated_variance(_delta_strike(t, ts, slices, _Z25), t, ts, slices), 0.0) / t)
+            columns[f"atm_iv_{tenor}d"].append(float(atm))
+            columns[f"put_25d_iv_{tenor}d"].append(float(put))
+            columns[f"call_25d_iv_{tenor}d"].append(float(call))
+            columns[f"skew_25d_{tenor}d"].append(float(put - call))
+    table = pa.table({name: pa.array(values) for name, values in columns.items() if name not in ('symbol', 'date')})
+    return table.add_column(0, 'symbol', pa.array(columns['symbol'], pa.string())) \
+                .add_column(1, 'date', pa.array(columns['date'], pa.date32()))
+
+
+def main():
+    from utilities.load_historical_options_data import get_config
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", required=True)
+    parser.add_argument("--end")
+    parser.add_argument("--symbols", nargs="*", help="default: the S&P 500 constituents file")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    config = get_config()
+    symbols = args.symbols or pd.read_csv("org_files/S&P 500 Constituents.csv")['Symbol'].tolist()
+    results = fit_surfaces(symbols, args.start, args.end, config, args.workers)
+    print(f"Wrote {sum(results.values())} SVI slices for {len(results)} symbols")
+
+
+if __name__ == "__main__":
+    main()